@@ -0,0 +1,111 @@
+# api/batcher.py
+"""
+跨請求的 micro-batching：
+
+同時進來的多個請求先放進 queue，第一個請求到達後最多再等 max_wait_ms 湊滿 max_batch_size，
+整批交給 batch_fn 在背景 thread 執行（一次 encode / 一次 index.search / 一次 rerank），
+結果再依序發回各個等待中的請求。
+
+- backpressure：排隊請求超過 max_queue 時直接丟 QueueFullError（API 回 503）
+- 逾時：呼叫端等不到結果時丟 asyncio.TimeoutError（API 回 504），已逾時的請求不會再進 batch
+- batch_fn 只在單一 worker thread 執行，模型不會被多個 thread 同時呼叫
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from config.settings import (
+    SERVER_MAX_BATCH_SIZE, SERVER_MAX_WAIT_MS, SERVER_MAX_QUEUE, SERVER_REQUEST_TIMEOUT_S,
+)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class MicroBatcher:
+    def __init__(self,
+                 batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = SERVER_MAX_BATCH_SIZE,
+                 max_wait_ms: float = SERVER_MAX_WAIT_MS,
+                 max_queue: int = SERVER_MAX_QUEUE):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch")
+
+        self.batches = 0
+        self.items = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, item: Any, timeout: float = SERVER_REQUEST_TIMEOUT_S) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"排隊請求已達上限 {self.max_queue}")
+        return await asyncio.wait_for(future, timeout)
+
+    async def _collect(self) -> List:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        # 已逾時 / 被取消的請求不用算
+        return [(item, fut) for item, fut in batch if not fut.done()]
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self.batch_fn, items)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,85 @@
+# api/main.py
+"""
+FastAPI 查詢 Server：
+
+    uvicorn api.main:app --host 0.0.0.0 --port 8000
+
+同時進來的請求由 MicroBatcher 合併成一批，
+一次 FileEmbedder.encode、一次 index.search、一次跨請求的 rerank batch，再把結果發回各請求。
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from config.settings import VECTOR_DB_PATH, SERVER_REQUEST_TIMEOUT_S
+from retriever import RetrieverPipeline
+from utils import instrument
+from .batcher import MicroBatcher, QueueFullError
+from .schemas import RetrieveRequest, RetrieveResponse
+
+
+def make_batch_fn(pipeline: RetrieverPipeline):
+    def run(requests: List[RetrieveRequest]):
+        stats: List[dict] = []
+        results = pipeline.retrieve_many(
+            [r.query for r in requests],
+            top_k=[r.top_k for r in requests],
+            use_rerank=[r.use_rerank for r in requests],
+            hybrid=[r.hybrid for r in requests],
+            filters=[r.filters for r in requests],
+            cascade=[r.cascade for r in requests],
+            chunk_size=None,        # MicroBatcher 已限制 batch 大小，整批一次跑
+            stats=stats,
+        )
+        return list(zip(results, stats))
+    return run
+
+
+def create_app(pipeline: RetrieverPipeline | None = None,
+               metrics: instrument.MetricsRegistry | None = None) -> FastAPI:
+    """
+    metrics：已註冊為 hook 的 MetricsRegistry；None 時依 INSTRUMENT_LOG / METRICS_ENABLED 設定建立
+    """
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.pipeline = pipeline or RetrieverPipeline(vector_db_path=VECTOR_DB_PATH)
+        # server 啟動時就載入模型，第一個請求不用等
+        await asyncio.get_running_loop().run_in_executor(None, app.state.pipeline.warmup)
+        app.state.batcher = MicroBatcher(make_batch_fn(app.state.pipeline))
+        await app.state.batcher.start()
+        yield
+        await app.state.batcher.stop()
+
+    app = FastAPI(title="RAG Retriever API", lifespan=lifespan)
+    app.state.metrics = metrics or instrument.setup_from_settings()
+
+    @app.post("/retrieve", response_model=RetrieveResponse)
+    async def retrieve(req: RetrieveRequest):
+        try:
+            results, stats = await app.state.batcher.submit(req, timeout=SERVER_REQUEST_TIMEOUT_S)
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="查詢逾時")
+        return RetrieveResponse(query=req.query, results=results, stats=stats)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok",
+                "vectors": len(app.state.pipeline.vector_store),
+                "batcher": app.state.batcher.stats()}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics_endpoint():
+        if app.state.metrics is None:
+            raise HTTPException(status_code=404, detail="METRICS_ENABLED 未開啟")
+        return app.state.metrics.render()
+
+    return app
+
+
+app = create_app()
@@ -0,0 +1,35 @@
+# api/schemas.py
+"""
+查詢 API 的 request / response schema
+"""
+
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+from config.settings import DEFAULT_USE_RERANK, DEFAULT_HYBRID
+from retriever.metadata_filter import validate_filters
+
+
+class RetrieveRequest(BaseModel):
+    query: str = Field(..., min_length=1, description="查詢問句")
+    top_k: Optional[int] = Field(None, ge=1, description="回傳筆數，預設 RERANK_TOPK")
+    use_rerank: bool = Field(DEFAULT_USE_RERANK, description="是否使用 Reranker 重新排序")
+    hybrid: bool = Field(DEFAULT_HYBRID, description="是否同時使用 BM25 關鍵字檢索")
+    filters: Optional[Dict[str, Any]] = Field(
+        None, description='metadata 過濾，例如 {"source": "特殊教育法*.pdf", "chunk_id": {"lt": 10}}')
+    cascade: Optional[bool] = Field(
+        None, description="rerank 時分批打分、前 top_k 穩定就停（較快、品質略低），預設 RERANK_CASCADE")
+
+    @field_validator("filters")
+    @classmethod
+    def _check_filters(cls, v):
+        # 在進 batch 之前擋掉，避免一筆錯誤的條件讓同 batch 的其他請求一起失敗
+        return validate_filters(v)
+
+
+class RetrieveResponse(BaseModel):
+    query: str
+    results: List[Dict[str, Any]]
+    stats: Dict[str, Any] = Field(
+        default_factory=dict, description="候選數、reranker 實際打分筆數、是否跳過 rerank / 提早結束等")
@@ -0,0 +1,325 @@
+# benchmarks/run_suite.py
+"""
+離線 benchmark suite（不需要網路、不需要正式模型）：
+合成中文法規語料 + 迷你 Qwen3 模型（benchmarks/synthetic.py），量測
+
+- chunking      句子切分 / token 切分的吞吐量
+- pdf_extract   PDF 抽取（process pool，不走快取；另量 streaming ingest 的逐檔載入）
+- embedding     FileEmbedder.encode 吞吐量
+- index         各語料大小的 index 建立時間、單筆查詢 p50 / p99、批次查詢 QPS
+- rerank        不同候選數的 rerank 延遲（關閉分數快取）
+- recall        有標註 query 的 recall@k（dense / hybrid）
+
+結果寫成 JSON，可用 --compare 對照另一次的結果（例如上一個 commit），
+超過門檻的退步會列出來並以 exit code 1 結束，方便放進 CI。
+
+命名慣例：*_ms / *_s 越小越好，*_per_s / recall@* 越大越好。
+
+用法：
+    python -m benchmarks.run_suite --out bench_output.json
+    python -m benchmarks.run_suite --quick --out new.json --compare old.json
+"""
+
+from typing import Dict, List
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_corpus, make_queries, write_pdfs, make_tiny_models
+
+
+def _percentiles(latencies_ms: List[float]) -> Dict[str, float]:
+    return {"p50_ms": float(np.percentile(latencies_ms, 50)),
+            "p99_ms": float(np.percentile(latencies_ms, 99))}
+
+
+def _timed(fn, repeat: int = 1) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+# ==========================================================
+# 各項量測
+# ==========================================================
+def bench_chunking(docs: List[Dict], tokenizer) -> Dict:
+    from utils.chunk import chunk_by_sentences, chunk_by_tokens
+
+    texts = [d["text"] for d in docs]
+    chars = sum(len(t) for t in texts)
+    out = {"chars": chars}
+
+    sec = _timed(lambda: [chunk_by_sentences(t) for t in texts], repeat=3)
+    out["sentences"] = {"chars_per_s": chars / sec}
+
+    sec = _timed(lambda: [chunk_by_tokens(t, tokenizer) for t in texts], repeat=3)
+    out["tokens"] = {"chars_per_s": chars / sec}
+    return out
+
+
+def bench_pdf_extract(docs: List[Dict], workdir: str) -> Dict:
+    from concurrent.futures import ProcessPoolExecutor
+    from retriever.file_loader import load_files
+
+    paths = write_pdfs(docs, os.path.join(workdir, "pdf"))
+    sec = _timed(lambda: load_files(paths, cache_dir=None), repeat=2)
+
+    # streaming ingest 的呼叫方式：共用 process pool、一次載入一個檔案、寫入抽取快取
+    def per_file():
+        cache_dir = tempfile.mkdtemp(dir=workdir)
+        with ProcessPoolExecutor() as pool:
+            for path in paths:
+                doc, = load_files([path], cache_dir=cache_dir, executor=pool)
+                if not doc["text"].strip():
+                    raise RuntimeError(f"逐檔載入沒有抽出文字：{path}")
+
+    per_file_sec = _timed(per_file)
+    return {"files": len(paths), "files_per_s": len(paths) / sec,
+            "per_file_files_per_s": len(paths) / per_file_sec}
+
+
+def bench_embedding(embedder, texts: List[str]) -> Dict:
+    tokens = sum(len(ids) for ids in embedder.tokenizer(texts)["input_ids"])
+    embedder.encode(texts[:8])     # warmup
+    sec = _timed(lambda: embedder.encode(texts), repeat=2)
+    return {"texts": len(texts), "texts_per_s": len(texts) / sec, "tokens_per_s": tokens / sec}
+
+
+def bench_index(sizes: List[int], dim: int, index_types: List[str], workdir: str,
+                num_queries: int = 200, top_k: int = 50) -> Dict:
+    from retriever.vector_store import VectorStore
+
+    rng = np.random.default_rng(0)
+    out = {}
+    for n in sizes:
+        base = rng.normal(size=(n, dim)).astype("float32")
+        base /= np.linalg.norm(base, axis=1, keepdims=True)
+        queries = base[rng.choice(n, num_queries)] + rng.normal(scale=0.05, size=(num_queries, dim))
+        queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype("float32")
+        metas = [{"id": str(i)} for i in range(n)]
+
+        for index_type in index_types:
+            store = VectorStore(os.path.join(workdir, f"index_{index_type}_{n}.faiss"),
+                                index_type=index_type)
+            t0 = time.perf_counter()
+            store.add_embeddings(base, metas)
+            build_s = time.perf_counter() - t0
+
+            latencies = []
+            for q in queries:
+                t0 = time.perf_counter()
+                store.search(q[None], top_k=top_k)
+                latencies.append((time.perf_counter() - t0) * 1000)
+            batch_s = _timed(lambda: store.search(queries, top_k=top_k), repeat=3)
+
+            out[f"{index_type}@{n}"] = {"build_s": build_s, **_percentiles(latencies),
+                                        "batch_queries_per_s": num_queries / batch_s}
+    return out
+
+
+def bench_rerank(reranker, docs: List[Dict], candidate_counts: List[int], repeat: int = 5) -> Dict:
+    texts = [d["text"] for d in docs]
+    out = {}
+    for n in candidate_counts:
+        cands = [texts[i % len(texts)] for i in range(n)]
+        reranker.score("民法第1條的規定是什麼", cands[:2])     # warmup
+        latencies = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            reranker.score("民法第1條的規定是什麼", cands)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        out[f"candidates@{n}"] = {**_percentiles(latencies), "pairs_per_s": n * 1000 / min(latencies)}
+    return out
+
+
+def bench_recall(pipeline, docs: List[Dict], queries: List[Dict], ks: List[int]) -> Dict:
+    from preprocess_data import chunk_document
+
+    files = []
+    for doc in docs:
+        for meta in chunk_document(doc, tokenizer=pipeline.embedder.tokenizer):
+            files.append({"id": f"{meta['id']}_chunk{meta['chunk_id']}", "text": meta["text"],
+                          "source": meta["id"], "chunk_id": meta["chunk_id"]})
+    t0 = time.perf_counter()
+    pipeline.index_files(files)
+    pipeline.vector_store.build_bm25()
+    index_s = time.perf_counter() - t0
+
+    texts = [q["query"] for q in queries]
+    out = {"chunks": len(files), "index_s": index_s}
+    for mode, hybrid in (("dense", False), ("hybrid", True)):
+        t0 = time.perf_counter()
+        results = pipeline.retrieve_many(texts, top_k=max(ks), use_rerank=False, hybrid=hybrid)
+        sec = time.perf_counter() - t0
+        row = {"queries_per_s": len(texts) / sec}
+        for k in ks:
+            hits = sum(bool(set(q["relevant"]) & {r["source"] for r in res[:k]})
+                       for q, res in zip(queries, results))
+            row[f"recall@{k}"] = hits / len(queries)
+        out[mode] = row
+    return out
+
+
+# ==========================================================
+# 比較兩次結果
+# ==========================================================
+def _flatten(tree: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for k, v in tree.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            flat.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)):
+            flat[key] = float(v)
+    return flat
+
+
+def _direction(key: str) -> int:
+    """
+    +1：越大越好，-1：越小越好，0：不比較（資料量等）
+    """
+    leaf = key.rsplit(".", 1)[-1]
+    if leaf.endswith("_per_s") or leaf.startswith("recall@"):
+        return 1
+    if leaf.endswith("_ms") or leaf.endswith("_s"):
+        return -1
+    return 0
+
+
+def compare(new: Dict, old: Dict, threshold: float) -> List[str]:
+    """
+    回傳退步超過 threshold（相對值）的項目說明
+    """
+    new_flat, old_flat = _flatten(new["results"]), _flatten(old["results"])
+    regressions = []
+    print(f"\n{'metric':<48}{'old':>12}{'new':>12}{'change':>9}")
+    for key in sorted(new_flat.keys() & old_flat.keys()):
+        direction = _direction(key)
+        if direction == 0 or old_flat[key] == 0:
+            continue
+        change = (new_flat[key] - old_flat[key]) / abs(old_flat[key])
+        flag = ""
+        if change * direction < -threshold:
+            flag = "  ⚠️"
+            regressions.append(f"{key}: {old_flat[key]:.4g} → {new_flat[key]:.4g} ({change:+.1%})")
+        print(f"{key:<48}{old_flat[key]:>12.4g}{new_flat[key]:>12.4g}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ==========================================================
+# CLI 入口
+# ==========================================================
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default="bench_output.json")
+    parser.add_argument("--compare", help="另一次的結果 JSON，列出退步項目")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="相對退步超過這個比例就算 regression（預設 20%%）")
+    parser.add_argument("--quick", action="store_true", help="縮小語料 / index 大小（約一分鐘內跑完）")
+    parser.add_argument("--model-dir", default=None, help="迷你模型存放位置（預設用暫存資料夾）")
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 50000])
+    parser.add_argument("--dim", type=int, default=1024, help="index 量測用的向量維度")
+    parser.add_argument("--index-types", nargs="+", default=["flat", "hnsw"])
+    parser.add_argument("--candidates", nargs="+", type=int, default=[10, 25, 50, 100])
+    parser.add_argument("--only", nargs="+",
+                        choices=["chunking", "pdf_extract", "embedding", "index", "rerank", "recall"])
+    args = parser.parse_args()
+
+    if args.quick:
+        args.docs, args.queries = min(args.docs, 100), min(args.queries, 50)
+        args.sizes = [s for s in args.sizes if s <= 10000][:2] or [1000]
+        args.candidates = [c for c in args.candidates if c <= 50]
+
+    sections = set(args.only or ["chunking", "pdf_extract", "embedding", "index", "rerank", "recall"])
+    docs = make_corpus(args.docs)
+    queries = make_queries(docs, args.queries)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        embedder = reranker = None
+        if sections & {"chunking", "embedding", "rerank", "recall"}:
+            from retriever.file_embedding import FileEmbedder
+            from retriever.reranker import Reranker
+
+            paths = make_tiny_models(args.model_dir or os.path.join(workdir, "models"))
+            embedder = FileEmbedder(paths["embedder"])
+            reranker = Reranker(paths["reranker"])
+            reranker.cache = None      # 量測模型本身，不讓分數快取命中
+
+        steps = [
+            ("chunking", lambda: bench_chunking(docs, embedder.tokenizer)),
+            ("pdf_extract", lambda: bench_pdf_extract(docs[:50], workdir)),
+            ("embedding", lambda: bench_embedding(embedder, [d["text"] for d in docs])),
+            ("index", lambda: bench_index(args.sizes, args.dim, args.index_types, workdir)),
+            ("rerank", lambda: bench_rerank(reranker, docs, args.candidates)),
+            ("recall", lambda: bench_recall(_pipeline(workdir, embedder, reranker),
+                                            docs, queries, ks=[1, 5, 10])),
+        ]
+        for name, fn in steps:
+            if name not in sections:
+                continue
+            print(f"==== {name} ====")
+            t0 = time.perf_counter()
+            results[name] = fn()
+            print(json.dumps(results[name], ensure_ascii=False, indent=2))
+            print(f"（{time.perf_counter() - t0:.1f} s）\n")
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        regressions = compare(report, old, args.threshold)
+        if regressions:
+            print(f"\n⚠️  {len(regressions)} 項退步超過 {args.threshold:.0%}：")
+            for line in regressions:
+                print(f"  - {line}")
+            raise SystemExit(1)
+        print("\n沒有超過門檻的退步")
+
+
+def _pipeline(workdir: str, embedder, reranker):
+    from retriever import RetrieverPipeline
+
+    pipeline = RetrieverPipeline(os.path.join(workdir, "recall", "index.faiss"),
+                                 embedder=embedder, reranker=reranker)
+    # 量測的是檢索本身，不能讓重複的 query 直接命中結果快取
+    pipeline.cache = None
+    return pipeline
+
+
+if __name__ == "__main__":
+    main()
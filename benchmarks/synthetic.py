@@ -0,0 +1,120 @@
+# benchmarks/synthetic.py
+"""
+Benchmark 用的離線素材（不需要網路）：
+- make_corpus():      合成的中文法規語料（每份文件含多個「法規 + 條號 + 主題」條文）
+- make_queries():     有標註答案的 query（問某法規某條 → 答案是含該條文的文件）
+- write_pdfs():       把語料寫成 PDF，量測 PDF 抽取
+- make_tiny_models(): 隨機初始化的迷你 Qwen3 embedding / reranker（字元級 tokenizer），
+                      架構與正式模型相同，只用來量測程式本身的開銷，分數沒有語意
+"""
+
+from typing import Dict, List
+import os
+import random
+
+LAWS = ["民法", "刑法", "特殊教育法", "勞動基準法", "個人資料保護法", "著作權法",
+        "消費者保護法", "行政程序法", "公司法", "所得稅法", "道路交通管理處罰條例", "教師法"]
+TOPICS = ["損害賠償", "契約解除", "主管機關", "罰則", "修正日期", "適用範圍", "申請程序",
+          "資格條件", "補助經費", "申訴救濟", "資料保存", "施行細則"]
+FILLERS = ["前項情形應以書面通知相對人", "違反者處新臺幣三萬元以上十五萬元以下罰鍰",
+           "主管機關得視實際需要定期檢討", "其辦法由中央主管機關定之",
+           "當事人得於收受處分後三十日內提起訴願", "本條自公布日施行",
+           "學校應提供必要之協助與支持服務", "雇主不得拒絕或為不利之處分",
+           "相關紀錄應保存五年", "經費由各級政府編列預算支應"]
+
+# 迷你 tokenizer 的字元集：語料會用到的字 + CJK 常用區段 + 英數標點
+_EXTRA_CHARS = "0123456789abcdefghijklmnopqrstuvwxyz，。！？：；、（）「」 \n"
+
+
+def _article(law: str, no: int, rng: random.Random) -> str:
+    topic = rng.choice(TOPICS)
+    body = "；".join(rng.sample(FILLERS, 3))
+    return f"{law}第{no}條（{topic}）：有關{topic}之規定，{body}。"
+
+
+def make_corpus(n_docs: int, articles_per_doc: int = 8, seed: int = 0) -> List[Dict]:
+    """
+    回傳 [{"id", "text", "articles": [(法規, 條號), ...]}]；(法規, 條號) 全語料唯一
+    """
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n_docs):
+        law = LAWS[i % len(LAWS)]
+        first = (i // len(LAWS)) * articles_per_doc + 1
+        numbers = list(range(first, first + articles_per_doc))
+        text = "\n".join(_article(law, no, rng) for no in numbers)
+        docs.append({"id": f"doc{i:05d}.txt", "text": text,
+                     "articles": [(law, no) for no in numbers]})
+    return docs
+
+
+def make_queries(docs: List[Dict], n_queries: int, seed: int = 1) -> List[Dict]:
+    """
+    回傳 [{"query", "relevant": [文件 id]}]
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        doc = rng.choice(docs)
+        law, no = rng.choice(doc["articles"])
+        queries.append({"query": f"{law}第{no}條的規定是什麼", "relevant": [doc["id"]]})
+    return queries
+
+
+def write_pdfs(docs: List[Dict], folder: str, repeat_pages: int = 4) -> List[str]:
+    """
+    每份文件寫成一個多頁 PDF（內容重複 repeat_pages 頁），回傳路徑
+    """
+    import fitz
+
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for doc in docs:
+        path = os.path.join(folder, doc["id"].replace(".txt", ".pdf"))
+        pdf = fitz.open()
+        for _ in range(repeat_pages):
+            page = pdf.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), doc["text"],
+                                fontname="china-t", fontsize=10)
+        pdf.save(path)
+        pdf.close()
+        paths.append(path)
+    return paths
+
+
+def make_tiny_models(out_dir: str, hidden_size: int = 64, num_layers: int = 2) -> Dict[str, str]:
+    """
+    在 out_dir 建立迷你 embedding / reranker 模型（已存在就直接沿用），回傳 {"embedder", "reranker"} 路徑
+    """
+    paths = {"embedder": os.path.join(out_dir, "embedder"),
+             "reranker": os.path.join(out_dir, "reranker")}
+    if all(os.path.exists(os.path.join(p, "config.json")) for p in paths.values()):
+        return paths
+
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import (PreTrainedTokenizerFast, Qwen3Config,
+                              Qwen3Model, Qwen3ForSequenceClassification)
+
+    chars = set("".join(LAWS + TOPICS + FILLERS) + "第條有關之規定是什麼的")
+    chars.update(chr(c) for c in range(0x4e00, 0x4e00 + 3000))
+    vocab = {"<unk>": 0, "<pad>": 1, "<eos>": 2}
+    for c in sorted(chars) + list(_EXTRA_CHARS):
+        vocab.setdefault(c, len(vocab))
+
+    tok = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tok.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tok, unk_token="<unk>",
+                                        pad_token="<pad>", eos_token="<eos>")
+
+    config = dict(vocab_size=len(vocab), hidden_size=hidden_size,
+                  intermediate_size=hidden_size * 2, num_hidden_layers=num_layers,
+                  num_attention_heads=4, num_key_value_heads=2, head_dim=hidden_size // 4,
+                  max_position_embeddings=2048, pad_token_id=1, eos_token_id=2)
+
+    torch.manual_seed(0)
+    for name, cls, extra in [("embedder", Qwen3Model, {}),
+                             ("reranker", Qwen3ForSequenceClassification, {"num_labels": 2})]:
+        cls(Qwen3Config(**config, **extra)).save_pretrained(paths[name])
+        tokenizer.save_pretrained(paths[name])
+    return paths
@@ -2,6 +2,9 @@
 
 # ===== Chunking =====
 CHUNK_MAX_TOKENS = 1000     # 每個 chunk 的最大字元/token 長度
+CHUNK_MODE = "tokens"       # tokens：用 embedding tokenizer 計算真實 token 數；chars：舊的字元長度
+CHUNK_TOKEN_BUDGET = 512    # tokens 模式下每個 chunk 的 token 上限（不應超過 EMBEDDING_MAX_LENGTH）
+CHUNK_OVERLAP_TOKENS = 0    # 相鄰 chunk 重疊的 token 數（以句子為單位，不超過此值）
 
 # ===== Retrieval =====
 SEARCH_TOPK = 50           # 相似度搜尋取前 N 個
@@ -9,3 +12,111 @@ RERANK_TOPK = 10           # reranker 最終留下前 N 個（最後返回的結
 
 
 DEFAULT_USE_RERANK = False
+RETRIEVE_MANY_CHUNK = 512  # retrieve_many() 每次合併處理的 query 數（embedding / search / rerank 共用 batch 的單位）
+
+# ===== Vector Store 持久化 =====
+VECTOR_STORE_FLUSH_ROWS = 1024      # pending 向量累積到 N 筆就自動寫入 append-only log
+VECTOR_STORE_COMPACT_RATIO = 0.5    # log 大小超過 snapshot 的比例時，commit() 會做 compaction
+
+# ===== ANN Index（只在建立新 index 時生效，既有 index 依檔案內容載入）=====
+VECTOR_INDEX_TYPE = "flat"          # flat / ivf_flat / hnsw / ivf_pq
+INDEX_TRAIN_SAMPLE = 100000         # IVF / PQ 訓練時最多取樣的向量數
+IVF_NLIST = 1024                    # IVF 分群數（訓練資料不足時會自動調小）
+IVF_NPROBE = 16                     # 預設搜尋的分群數，可於 retrieve() 逐次覆寫
+PQ_M = 32                           # PQ 子向量數（embedding 維度須可被整除）
+PQ_NBITS = 8
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128                # 預設 efSearch，可於 retrieve() 逐次覆寫
+
+# ===== Sharding（既有的以 index.faiss.shards.json 為準；既有的未分片 DB 會在第一次開啟時搬進各 shard）=====
+VECTOR_SHARDS = 1                   # shard 數，1 = 單一 VectorStore
+SHARD_PLACEMENT = "source"          # source：同一文件的 chunk 放同一個 shard / hash：依 chunk id 平均分散
+SHARD_SEARCH_WORKERS = None         # 平行搜尋的 thread 數，None = shard 數
+
+# ===== 向量壓縮（只在建立新 index 時生效）=====
+VECTOR_STORAGE = "float32"          # float32 / fp16 / int8（scalar quantizer）/ binary（1 bit，只支援 flat）
+VECTOR_SEARCH_DIM = None            # Matryoshka 截斷：第一輪只用前 N 維搜尋（None = 完整維度）
+RESCORE_FACTOR = 4                  # 壓縮 / 截斷時第一輪取 top_k × N 筆，再用 float32 原向量重新打分
+
+# ===== Metadata 過濾 =====
+FILTER_FIELDS = ("source", "chunk_id")   # 預先建好 欄位值 → vector id 索引的欄位（其他欄位過濾時逐筆掃 metadata）
+FILTER_EXACT_MAX = 4096             # 過濾後剩不到 N 筆時直接對這些向量算精確內積，不走 ANN index
+
+# ===== Multi-query 融合 =====
+QUERY_FUSION = "rrf"                # rrf（reciprocal rank fusion）/ max（取最高相似度）
+RRF_K = 60                          # RRF 的平滑常數：score = Σ 1 / (RRF_K + rank)
+
+# ===== Hybrid 檢索（BM25 + dense）=====
+DEFAULT_HYBRID = False              # 是否同時用 BM25 關鍵字檢索，與向量檢索的結果以 RRF 融合
+SPARSE_TOPK = 50                    # BM25 每個 query 取前 N 個
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# ===== Reranker =====
+RERANK_MAX_LENGTH = 512             # query + 文件 的最大 token 數
+RERANK_BATCH_TOKENS = 8192          # 每個 batch padding 後的 token 上限（batch 大小 × 最長序列）
+TOKEN_STORE = True                  # ingest 時把 chunk 的 token id 存進 vector DB，rerank 時不再 tokenize 候選原文
+
+# ===== 查詢結果快取 =====
+QUERY_CACHE_SIZE = 1024             # retrieve() 結果的 LRU 筆數，0 = 關閉
+QUERY_CACHE_TTL_S = 600             # 快取存活秒數（None = 不過期；vector DB 有變動時一律清空）
+QUERY_CACHE_SEMANTIC_THRESHOLD = None  # 選用（例如 0.97）：與快取中的 query embedding cosine ≥ 此值就沿用其結果（相近的不同問題會共用結果）；None = 只比對正規化後的字串
+
+# ===== Rerank 前的候選精簡（near-duplicate + MMR）=====
+RERANK_PRUNE = False                # 選用：rerank 前先用存好的向量去重 / 多樣化，減少 cross-encoder 次數（會改變送進 reranker 的候選）
+PRUNE_DUP_THRESHOLD = 0.95          # 與排序較前的候選 cosine ≥ 此值視為重複，併掉
+PRUNE_MMR_LAMBDA = 0.7              # MMR：λ·相關度 − (1−λ)·與已選候選的相似度（1 = 只看相關度）
+RERANK_MAX_CANDIDATES = 30          # 去重後最多送幾筆進 reranker（None = 只去重）
+
+# ===== Cascade rerank（分批打分、提早結束）=====
+RERANK_CASCADE = False              # 依第一階段排序分批送進 reranker，前 top_k 穩定後就停（請求可個別開關）
+RERANK_CASCADE_BATCH = 8            # 每一輪新打分的候選數（第一輪至少 top_k 筆）
+RERANK_CASCADE_MARGIN = 1.0         # 這一輪沒有候選擠進前 top_k，且最高分比第 top_k 名低至少此值（reranker 分數單位）就停
+RERANK_SKIP_GAP = None              # 候選中最高的 cosine 相似度比第二高的高出此值時整個 query 不 rerank（cosine 尺度，不是 RRF fusion_score；None = 一律 rerank）
+RERANK_CASCADE_SMALL_MODEL = None   # 先用小 reranker 對全部候選重排、再由大模型分批打分（例如 "Qwen/Qwen3-Reranker-0.6B"）
+
+# ===== Rerank 分數快取 =====
+RERANK_CACHE_SIZE = 100000          # 記憶體 LRU 筆數，0 = 關閉快取
+RERANK_CACHE_PATH = None            # SQLite 磁碟快取路徑（例如 "data/cache/rerank.sqlite"），None = 只用記憶體
+RERANK_CACHE_DISK_MAX = 1000000     # 磁碟快取筆數上限，超過時刪掉最舊的
+
+# ===== Embedding =====
+EMBEDDING_MAX_LENGTH = 512          # 每段文字的最大 token 數
+EMBEDDING_BATCH_TOKENS = 16384      # 每個 batch padding 後的 token 上限（batch 大小 × 最長序列）
+EMBEDDING_POOLING = "auto"          # auto / last / cls / mean（auto：decoder 模型用 last，其餘用 cls）
+EMBEDDING_NORMALIZE = True          # L2 normalize，IndexFlatIP 的內積即 cosine
+
+# ===== 推論 backend（embedding / reranker）=====
+EMBEDDING_BACKEND = "torch"         # torch / onnx（ONNX Runtime，CPU 部署用；需 pip install onnxruntime onnx）
+RERANK_BACKEND = "torch"            # 同上
+ONNX_DIR = "data/onnx"              # 匯出的 ONNX 模型（第一次使用時自動從 HF 模型匯出）
+ONNX_QUANTIZE = True                # dynamic int8 量化（權重 int8，CPU 較快、分數會有些微差異）
+ONNX_INTRA_OP_THREADS = None        # 單一運算子內的 thread 數（None = ONNX Runtime 預設，約為實體核心數）
+ONNX_INTER_OP_THREADS = None        # 運算子之間平行的 thread 數（None = 循序執行）
+
+# ===== 文件載入 / PDF 抽取 =====
+PDF_WORKERS = None                  # PDF 抽取的 process 數，None = CPU 核心數
+PDF_PAGES_PER_TASK = 32             # 大型 PDF 依頁數切成多個 task 平行抽取
+EXTRACT_CACHE_DIR = "data/processed/extract_cache"   # 抽取結果快取（None = 不快取）
+
+# ===== Streaming ingest =====
+INGEST_BATCH_SIZE = 64              # 每批 chunk 數（summarize → embed → 寫入 vector DB 的單位）
+INGEST_QUEUE_SIZE = 4               # stage 之間的 queue 最多暫存幾個項目（限制記憶體用量）
+
+# ===== LLM 摘要 =====
+SUMMARY_STORE_PATH = "data/processed/summaries.jsonl"   # 以 chunk hash 為 key 的摘要 checkpoint
+SUMMARY_BATCH_TOKENS = 16384        # 每個 generate batch 的 token 上限（batch 大小 ×（最長 prompt + 生成長度））
+SUMMARY_MAX_NEW_TOKENS = 256
+
+# ===== Instrumentation =====
+INSTRUMENT_LOG = False              # 每個 span / 計數事件寫一行 JSON log（logger "rag.trace"）
+METRICS_ENABLED = False             # 累積 Prometheus 指標（API server 提供 GET /metrics）
+METRICS_PORT = None                 # preprocess 等沒有 API 的 process 另開 /metrics 的 port（None = 不開）
+
+# ===== 查詢 API Server =====
+VECTOR_DB_PATH = "data/vector_db/index.faiss"
+SERVER_MAX_BATCH_SIZE = 32          # 一次 micro-batch 最多合併幾個請求
+SERVER_MAX_WAIT_MS = 5              # 第一個請求進來後最多等多久湊 batch
+SERVER_MAX_QUEUE = 1024             # 排隊中的請求上限，超過直接回 503（backpressure）
+SERVER_REQUEST_TIMEOUT_S = 30.0     # 單一請求的逾時秒數，逾時回 504
@@ -17,49 +17,223 @@ Mode B (--mode no_summarize):
 4. 不摘要（直接用 chunk 原文）
 5. embedding
 6. 儲存到 vector DB
+
+加上 --sync 時改為增量同步：
+依 manifest（每個檔案的內容 hash + chunk hash，存在 vector DB 旁的 <index>.manifest.json）比對，
+只對新增 / 變動的 chunk 做摘要與 embedding，並刪除已移除 / 已修改檔案的舊向量。
+
+兩種流程都是 streaming：load → clean/chunk → (summarize) → embed → 寫入 vector DB，
+各 stage 平行執行、以固定大小的 batch 經 bounded queue 傳遞，記憶體用量與語料大小無關。
+每個 batch 寫入後就 commit，檔案的所有 chunk 都落地後才寫進 manifest，
+中途中斷時用 --sync 重跑即可從斷點繼續（已寫入的 chunk 依 hash 直接沿用）。
 """
 
 import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+
 from retriever import RetrieverPipeline
-from retriever.file_loader import load_text_files
-from utils.pdf_reader import read_pdf
+from retriever.file_loader import load_documents, load_files, SUPPORTED_EXTS
+from retriever.file_abstractor import abstract_files
+from retriever.file_embedding import embed_files
+from retriever.ingest import run_stages
+from retriever.sharded_store import is_sharded, drop_unsharded
 from utils.preprocess import clean_text
-from utils.chunk import chunk_by_sentences
+from utils.chunk import chunk_by_sentences, chunk_by_tokens
 from retriever.file_abstractor_llm import abstract_chunks
-from utils.storage import save_json, load_json
-from config.settings import CHUNK_MAX_TOKENS
+from utils.storage import save_json, load_json, JsonlStore
+from utils.hashing import file_sha256, text_hash
+from utils import instrument
+from config.settings import (
+    CHUNK_MAX_TOKENS, CHUNK_MODE, INGEST_BATCH_SIZE, PDF_WORKERS, SUMMARY_STORE_PATH,
+    METRICS_PORT,
+)
 
 
-SUMMARY_PATH = "data/processed/abstracts.json"
+def manifest_path(vector_db):
+    """
+    manifest 與 vector DB 一一對應（同 .wal / .bm25.npz），不同 index 各自比對
+    """
+    return vector_db + ".manifest.json"
 
 
 # ==========================================================
 # 載入所有文件
 # ==========================================================
 def load_all_documents(folder):
-    docs = []
+    # PDF 平行抽取 + 抽取結果快取（與 retriever.file_loader 共用）
+    return load_documents(folder)
+
 
-    for fname in os.listdir(folder):
-        fpath = os.path.join(folder, fname)
+def list_source_files(folder):
+    return sorted(f for f in os.listdir(folder) if f.lower().endswith(SUPPORTED_EXTS))
 
-        if fname.endswith(".txt"):
-            with open(fpath, "r", encoding="utf-8") as f:
-                text = f.read()
 
-        elif fname.endswith(".pdf"):
-            text = read_pdf(fpath)
+def chunk_document(doc, tokenizer=None):
+    """
+    清洗 + 切 chunk，回傳該文件每個 chunk 的 metadata
+    tokenizer：CHUNK_MODE="tokens" 時用來計算真實 token 數（通常是 embedder 的 tokenizer）
+    """
+    clean = clean_text(doc["text"])
+    if CHUNK_MODE == "tokens" and tokenizer is not None:
+        chunks = chunk_by_tokens(clean, tokenizer)
+    else:
+        chunks = chunk_by_sentences(clean, max_tokens=CHUNK_MAX_TOKENS)
 
-        else:
-            continue
+    return [{
+        "id": doc["id"],
+        "chunk_id": idx,
+        "text": c,
+        "chunk_hash": text_hash(c),
+    } for idx, c in enumerate(chunks)]
 
-        docs.append({
-            "id": fname,
-            "text": text,
-            "path": fpath
-        })
 
-    return docs
+def build_final_doc(meta, summary):
+    """
+    chunk metadata → 寫入 vector DB 的文件格式
+    """
+    return {
+        "id": f"{meta['id']}_chunk{meta['chunk_id']}",
+        "text": meta["text"],            # 原文 chunk
+        "abstract": summary,             # 摘要（no_summarize 時為原文）
+        "source": meta["id"],
+        "chunk_id": meta["chunk_id"],
+        "chunk_hash": meta["chunk_hash"],
+    }
+
+
+# ==========================================================
+# Streaming ingest
+# ==========================================================
+def ingest_files(pipeline, paths, manifest, mode="summarize",
+                 old_chunks=None, batch_size=INGEST_BATCH_SIZE):
+    """
+    逐檔 streaming 寫入 vector DB。
+
+    old_chunks: {檔名: {chunk_hash: [vector id, ...]}}，
+                該檔已在 vector DB 裡的 chunk；hash 相同的 chunk 直接沿用向量（只更新位置），
+                沒再出現的 chunk 會被刪掉。
+    manifest 會在檔案的所有 chunk commit 之後才更新並存檔。
+    """
+    store = pipeline.vector_store
+    old_chunks = old_chunks or {}
+    file_hashes = {}
+    manifest_file = manifest_path(store.index_path)
+
+    # ---------- stages ----------
+
+    def load(path_iter):
+        with ProcessPoolExecutor(max_workers=PDF_WORKERS) as pool:
+            for path in path_iter:
+                with instrument.span("ingest.load", file=os.path.basename(path)):
+                    file_hashes[os.path.basename(path)] = file_sha256(path)
+                    docs = load_files([path], executor=pool)
+                yield from docs
+
+    tokenizer = getattr(pipeline.embedder, "tokenizer", None) if CHUNK_MODE == "tokens" else None
+
+    def chunk(docs):
+        for doc in docs:
+            fname = doc["id"]
+            with instrument.span("ingest.chunk", file=fname) as sp:
+                doc_metas = chunk_document(doc, tokenizer=tokenizer)
+                sp.set(chunks=len(doc_metas))
+
+            old_by_hash = {h: list(ids) for h, ids in old_chunks.get(fname, {}).items()}
+            moved = {}
+            for meta in doc_metas:
+                reuse = old_by_hash.get(meta["chunk_hash"])
+                if reuse:
+                    moved[reuse.pop()] = meta
+                else:
+                    yield "chunk", meta
+
+            yield "file", {
+                "name": fname,
+                "moved": moved,
+                "stale": [vid for ids in old_by_hash.values() for vid in ids],
+                "entry": {"hash": file_hashes[fname],
+                          "chunks": [m["chunk_hash"] for m in doc_metas]},
+            }
+
+    def batch(items):
+        # 檔案完成的標記掛在「包含該檔最後一個 chunk」的 batch 上，確保 commit 後才更新 manifest
+        current = {"metas": [], "files": []}
+        for kind, item in items:
+            if kind == "chunk":
+                current["metas"].append(item)
+                if len(current["metas"]) >= batch_size:
+                    yield current
+                    current = {"metas": [], "files": []}
+            else:
+                current["files"].append(item)
+                if not current["metas"]:
+                    yield current
+                    current = {"metas": [], "files": []}
+        if current["metas"] or current["files"]:
+            yield current
+
+    # 摘要以 chunk hash 存檔，中斷重跑只補缺的摘要
+    summary_store = JsonlStore(SUMMARY_STORE_PATH) if mode == "summarize" else None
+
+    def summarize(batches):
+        for b in batches:
+            texts = [m["text"] for m in b["metas"]]
+            if mode == "summarize" and texts:
+                with instrument.span("ingest.summarize", chunks=len(texts)):
+                    summaries = abstract_chunks(texts, store=summary_store)
+            else:
+                summaries = texts      # 用原文取代摘要
+            b["docs"] = [build_final_doc(m, s) for m, s in zip(b["metas"], summaries)]
+            yield b
+
+    # embedder / reranker 的 tokenizer 各 tokenize 一次（TOKEN_STORE），token id 隨向量一起寫進 vector DB
+    def embed(batches):
+        for b in batches:
+            b["tokens"] = []
+            if b["docs"]:
+                abstracts = abstract_files(b["docs"])
+                with instrument.span("ingest.tokenize", chunks=len(abstracts)):
+                    b["tokens"], emb_ids = pipeline.pretokenize([a["abstract"] for a in abstracts])
+                with instrument.span("ingest.embed", chunks=len(b["docs"])):
+                    b["embeddings"], b["docs"] = embed_files(abstracts, embedder=pipeline.embedder,
+                                                             token_ids=emb_ids)
+            yield b
+
+    # ---------- sink：寫入 vector DB（只有這裡會改 store / manifest）----------
+
+    total = 0
+    for b in run_stages(paths, [load, chunk, batch, summarize, embed]):
+        with instrument.span("ingest.write", chunks=len(b["docs"]), files=len(b["files"])):
+            if b["docs"]:
+                ids = store.add_embeddings(b["embeddings"], b["docs"])
+                for tok, token_ids in b["tokens"]:
+                    store.put_tokens(ids, tok, token_ids)
+                total += len(b["docs"])
+
+            for f in b["files"]:
+                store.remove_ids(f["stale"])
+                updates = {}
+                for vid, meta in f["moved"].items():
+                    updated = dict(store.metadatas[vid])
+                    updated.update(id=f"{meta['id']}_chunk{meta['chunk_id']}", chunk_id=meta["chunk_id"])
+                    updates[vid] = updated
+                store.update_metadata(updates)
+
+            store.commit()
+        instrument.count("ingest.chunks", len(b["docs"]))
+        instrument.count("ingest.reused_chunks", sum(len(f["moved"]) for f in b["files"]))
+
+        for f in b["files"]:
+            manifest[f["name"]] = f["entry"]
+        if b["files"]:
+            save_json(manifest_file, manifest)
+            print(f"  已完成 {', '.join(f['name'] for f in b['files'])}（累計新增 {total} 個 chunks）")
+
+    store.commit(compact=True)
+    # BM25 倒排索引由全部 chunk 原文重建（hybrid 檢索用）
+    store.build_bm25()
+    return total
 
 
 # ==========================================================
@@ -73,80 +247,74 @@ def process_and_index(folder="data/raw_files",
     - "summarize": 使用 LLM 摘要
     - "no_summarize": 不做摘要
     """
+    paths = [os.path.join(folder, f) for f in list_source_files(folder)]
+    print(f"==== 共 {len(paths)} 份教材，模式：{mode} ====")
+
+    # 建立 retriever pipeline（full rebuild：先清空舊 index，避免重跑時向量重複 append）
+    # 改成分片時舊的未分片 DB 直接刪掉，不必先搬進 shard（只有 metadata 的舊 DB 也搬不了）
+    if is_sharded(vector_db):
+        drop_unsharded(vector_db)
+    pipeline = RetrieverPipeline(vector_db_path=vector_db)
+    pipeline.vector_store.reset()
+    manifest = {}
+    save_json(manifest_path(vector_db), manifest)
+
+    print("==== 寫入 Vector DB（load → chunk → 摘要 → embedding → indexing） ====")
+    total = ingest_files(pipeline, paths, manifest, mode=mode)
+    print(f"完成！共寫入 {total} 個 chunks")
 
-    print("==== 讀取文件中 ====")
-    docs = load_all_documents(folder)
-    print(f"共載入 {len(docs)} 份教材")
 
-    # 建立 retriever pipeline
+# ==========================================================
+# 增量同步
+# ==========================================================
+def sync_and_index(folder="data/raw_files",
+                   vector_db="data/vector_db/index.faiss",
+                   mode="summarize"):
+    """
+    依 manifest 做增量同步：
+    - 檔案內容 hash 沒變 → 完全跳過（不讀 PDF、不 embedding）
+    - 新增 / 修改的檔案 → 只對新出現的 chunk hash 做摘要 + embedding，
+      內容沒變的 chunk 保留原向量（只更新 chunk 位置）
+    - 刪除的檔案 / 修改後消失的 chunk → 從 vector DB 移除
+    """
+    manifest = load_json(manifest_path(vector_db))
     pipeline = RetrieverPipeline(vector_db_path=vector_db)
+    store = pipeline.vector_store
 
-    all_chunks = []
-    metas = []
+    # 沒有 manifest（或 index 是舊格式、沒有 source 欄位）時無法比對 → 直接 full rebuild
+    legacy = any("source" not in m for m in store.metadatas.values())
+    if manifest is None or legacy:
+        print("==== 找不到可用的 manifest，改為完整重建 ====")
+        return process_and_index(folder=folder, vector_db=vector_db, mode=mode)
 
-    print("==== 清洗 + Chunking ====")
-    for doc in docs:
-        clean = clean_text(doc["text"])
-        chunks = chunk_by_sentences(clean, max_tokens=CHUNK_MAX_TOKENS)
+    fnames = list_source_files(folder)
+    file_hashes = {f: file_sha256(os.path.join(folder, f)) for f in fnames}
 
-        for idx, c in enumerate(chunks):
-            all_chunks.append(c)
-            metas.append({
-                "id": doc["id"],
-                "chunk_id": idx,
-                "text": c
-            })
-
-    print(f"共切成 {len(all_chunks)} 個 chunks")
-
-
-    # ==========================================================
-    # 模式 A：Summarize
-    # ==========================================================
-    if mode == "summarize":
-        print("==== 模式：LLM 摘要 ====")
-
-        # 若已有摘要紀錄 → 跳過
-        old_summary = load_json(SUMMARY_PATH)
-        if old_summary is not None and len(old_summary) == len(all_chunks):
-            print("==== 發現已存在摘要，跳過 LLM 摘要 ====")
-            summaries = old_summary
-        else:
-            print("==== 執行 LLM 摘要（Files Abstracting）====")
-            summaries = abstract_chunks(all_chunks)
-            print(f"==== 摘要完成，寫入 {SUMMARY_PATH} ====")
-            save_json(SUMMARY_PATH, summaries)
-
-        # 建立 final_docs
-        final_docs = []
-        for meta, summary in zip(metas, summaries):
-            final_docs.append({
-                "id": f"{meta['id']}_chunk{meta['chunk_id']}",
-                "text": meta["text"],        # 原文 chunk
-                "abstract": summary          # 摘要
-            })
-
-    # ==========================================================
-    # 模式 B：No Summarize
-    # ==========================================================
-    else:
-        print("==== 模式：不做摘要（直接使用 chunk 原始內容）====")
+    changed = [f for f in fnames
+               if f not in manifest or manifest[f]["hash"] != file_hashes[f]]
+    deleted = [f for f in manifest if f not in file_hashes]
 
-        final_docs = []
-        for meta in metas:
-            final_docs.append({
-                "id": f"{meta['id']}_chunk{meta['chunk_id']}",
-                "text": meta["text"],
-                "abstract": meta["text"],     # 用原文取代摘要
-            })
+    print(f"==== 同步：{len(changed)} 個新增/修改，{len(deleted)} 個刪除，"
+          f"{len(fnames) - len(changed)} 個未變動 ====")
 
+    # ---------- 刪除的檔案 ----------
+    for fname in deleted:
+        store.remove_ids(store.find_ids(source=fname))
+        del manifest[fname]
+    store.commit()
+    save_json(manifest_path(vector_db), manifest)
 
-    # ==========================================================
-    # 寫入向量資料庫
-    # ==========================================================
-    print("==== 寫入 Vector DB（embedding + indexing） ====")
-    pipeline.index_files(final_docs)
-    print("完成！")
+    # ---------- 新增 / 修改的檔案：已有的 chunk 依 hash 分組（同一 hash 可能出現多次）----------
+    changed_set = set(changed)
+    old_chunks = {}
+    for vid, meta in store.metadatas.items():
+        if meta.get("source") in changed_set:
+            old_chunks.setdefault(meta["source"], {}).setdefault(meta.get("chunk_hash"), []).append(vid)
+
+    print("==== 寫入 Vector DB（只 embedding 新 chunk） ====")
+    total = ingest_files(pipeline, [os.path.join(folder, f) for f in changed],
+                         manifest, mode=mode, old_chunks=old_chunks)
+    print(f"完成！共新增 {total} 個 chunks")
 
 
 # ==========================================================
@@ -158,6 +326,16 @@ if __name__ == "__main__":
                         choices=["summarize", "no_summarize"],
                         default="summarize",
                         help="choose processing mode")
+    parser.add_argument("--sync",
+                        action="store_true",
+                        help="incremental sync against the manifest instead of full rebuild")
     args = parser.parse_args()
 
-    process_and_index(mode=args.mode)
+    registry = instrument.setup_from_settings()
+    if registry is not None and METRICS_PORT:
+        instrument.serve_metrics(registry, METRICS_PORT)
+
+    if args.sync:
+        sync_and_index(mode=args.mode)
+    else:
+        process_and_index(mode=args.mode)
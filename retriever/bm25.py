@@ -0,0 +1,167 @@
+# retriever/bm25.py
+"""
+BM25 稀疏檢索：
+補足 dense 檢索對「精確字串」的弱點（條號、法規名稱、日期等）。
+
+斷詞不依賴額外套件：
+- 中文連續字串 → 字元 bigram（單一字則保留 unigram）
+- 英數字串 → 整段當一個 token（全形轉半形、轉小寫），例如 "184"、"gdpr"
+
+倒排索引以 CSR 陣列存放（term → postings 區段），整份存成一個 .npz：
+    terms        所有 term 以 "\n" 串接的 utf-8 bytes（位置即 term id；避免定長字串陣列被長 token 撐大）
+    indptr       term id → postings 起訖位置
+    postings_doc 文件位置（int32）
+    postings_tf  詞頻（uint16）
+    doc_ids      文件位置 → vector id
+    doc_len      每份文件的 token 數
+"""
+
+from typing import Dict, List, Optional, Tuple
+from collections import Counter
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from config.settings import BM25_K1, BM25_B
+
+_TOKEN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[0-9a-z]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文字元 bigram + 英數字 token
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens: List[str] = []
+    for run in _TOKEN_RE.findall(text):
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    def __init__(self,
+                 terms: List[str],
+                 indptr: np.ndarray,
+                 postings_doc: np.ndarray,
+                 postings_tf: np.ndarray,
+                 doc_ids: np.ndarray,
+                 doc_len: np.ndarray,
+                 k1: float = BM25_K1,
+                 b: float = BM25_B):
+        self.terms = terms
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.indptr = indptr
+        self.postings_doc = postings_doc
+        self.postings_tf = postings_tf
+        self.doc_ids = doc_ids
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.avgdl = float(doc_len.mean()) if len(doc_len) else 0.0
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    # ---------- 建立 / 讀寫 ----------
+
+    @classmethod
+    def build(cls, docs: Dict[int, str], k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        """
+        docs: vector id → 文字
+        """
+        term_ids: Dict[str, int] = {}
+        rows_term, rows_doc, rows_tf = [], [], []
+        doc_len = np.zeros(len(docs), dtype="float32")
+
+        for d, text in enumerate(docs.values()):
+            counts = Counter(tokenize(text))
+            doc_len[d] = sum(counts.values())
+            for t, c in counts.items():
+                rows_term.append(term_ids.setdefault(t, len(term_ids)))
+                rows_doc.append(d)
+                rows_tf.append(c)
+
+        term = np.asarray(rows_term, dtype="int32")
+        order = np.argsort(term, kind="stable")
+        indptr = np.zeros(len(term_ids) + 1, dtype="int64")
+        indptr[1:] = np.cumsum(np.bincount(term, minlength=len(term_ids)))
+
+        return cls(
+            terms=list(term_ids),
+            indptr=indptr,
+            postings_doc=np.asarray(rows_doc, dtype="int32")[order],
+            postings_tf=np.minimum(np.asarray(rows_tf, dtype="int64"), 65535).astype("uint16")[order],
+            doc_ids=np.fromiter(docs.keys(), dtype="int64", count=len(docs)),
+            doc_len=doc_len,
+            k1=k1,
+            b=b,
+        )
+
+    def save(self, path: str):
+        """
+        先寫 .tmp 再 os.replace，中斷時不會留下寫一半的檔案
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f,
+                     terms=np.frombuffer("\n".join(self.terms).encode("utf-8"), dtype="uint8"),
+                     indptr=self.indptr,
+                     postings_doc=self.postings_doc, postings_tf=self.postings_tf,
+                     doc_ids=self.doc_ids, doc_len=self.doc_len,
+                     params=np.asarray([self.k1, self.b], dtype="float64"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as z:
+            k1, b = z["params"].tolist()
+            terms = z["terms"].tobytes().decode("utf-8")
+            return cls(terms=terms.split("\n") if terms else [], indptr=z["indptr"],
+                       postings_doc=z["postings_doc"], postings_tf=z["postings_tf"],
+                       doc_ids=z["doc_ids"], doc_len=z["doc_len"], k1=k1, b=b)
+
+    # ---------- 搜尋 ----------
+
+    def search(self, queries: List[str], top_k: int = 50,
+               allowed: Optional[np.ndarray] = None) -> List[List[Tuple[float, int]]]:
+        """
+        allowed：只回傳這些 vector id（metadata 過濾，None = 不限制）
+        回傳：List (num_queries)，每個元素是 list[(bm25 分數, vector id)]，分數由高到低
+        """
+        n_docs = len(self.doc_ids)
+        mask = np.isin(self.doc_ids, allowed) if allowed is not None else None
+        all_results: List[List[Tuple[float, int]]] = []
+
+        for q in queries:
+            scores = np.zeros(n_docs, dtype="float32")
+            for t in set(tokenize(q)):
+                tid = self.vocab.get(t)
+                if tid is None:
+                    continue
+                start, end = self.indptr[tid], self.indptr[tid + 1]
+                docs = self.postings_doc[start:end]
+                tf = self.postings_tf[start:end].astype("float32")
+
+                df = end - start
+                idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / self.avgdl)
+                # 同一個 term 的 postings 內文件不重複，可直接用 fancy index 累加
+                scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            if mask is not None:
+                scores *= mask
+            hit = np.flatnonzero(scores)
+            if len(hit) > top_k:
+                hit = hit[np.argpartition(-scores[hit], top_k - 1)[:top_k]]
+            hit = hit[np.argsort(-scores[hit], kind="stable")]
+            all_results.append([(float(scores[d]), int(self.doc_ids[d])) for d in hit])
+
+        return all_results
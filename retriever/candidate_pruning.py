@@ -0,0 +1,120 @@
+# retriever/candidate_pruning.py
+"""
+Rerank 前的候選精簡：
+similarity search 的前 SEARCH_TOPK 筆常有大量幾乎相同的 chunk（同一份 PDF 重疊切出的 chunk、
+法規與施行細則重複的條文），每一筆都要跑一次 cross-encoder。
+這裡直接用 vector DB 裡存的向量（不重新 embedding），在送進 reranker 前：
+
+1. near-duplicate collapse：與排序較前的候選 cosine ≥ PRUNE_DUP_THRESHOLD 的併掉
+   （保留排序最前的那筆，被併掉的 chunk id 記在 "duplicates"）
+2. MMR（maximal marginal relevance）：從剩下的候選挑出 RERANK_MAX_CANDIDATES 筆，
+   每一步選 λ·與 query 的相似度 − (1−λ)·與已選候選的最高相似度 最大者
+
+兩步都至少留下 min_keep 筆（該 query 要回傳的筆數）：去重後不足時依原排序補回被併掉的候選，
+精簡只省 reranker 次數，不會讓 retrieve() 回傳的結果變少。
+
+全部是 (N, dim) 的矩陣運算，N = 候選數（50 左右），成本遠低於一次 reranker forward。
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import PRUNE_DUP_THRESHOLD, PRUNE_MMR_LAMBDA, RERANK_MAX_CANDIDATES
+
+
+def _normalize(vecs: np.ndarray) -> np.ndarray:
+    return vecs / np.maximum(np.linalg.norm(vecs, axis=-1, keepdims=True), 1e-12)
+
+
+def collapse_duplicates(sim: np.ndarray, threshold: float = PRUNE_DUP_THRESHOLD) -> np.ndarray:
+    """
+    sim：候選之間的 cosine 矩陣（依原排序）
+    回傳 keep_of：每個候選被併進哪一筆（保留的候選指向自己）
+    """
+    n = len(sim)
+    keep_of = np.arange(n)
+    alive = np.ones(n, dtype=bool)
+    later = np.arange(n)
+    for i in range(n):
+        if not alive[i]:
+            continue
+        dup = alive & (later > i) & (sim[i] >= threshold)
+        keep_of[dup] = i
+        alive[dup] = False
+    return keep_of
+
+
+def mmr_select(query_sim: np.ndarray, sim: np.ndarray, k: int,
+               lam: float = PRUNE_MMR_LAMBDA) -> np.ndarray:
+    """
+    query_sim：(N,) 各候選與 query 的相似度；sim：(N, N) 候選間相似度
+    回傳選中的位置（依選取順序）
+    """
+    n = len(query_sim)
+    if k >= n:
+        return np.arange(n)
+
+    selected = [int(np.argmax(query_sim))]
+    max_sim = sim[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    for _ in range(k - 1):
+        gain = np.where(available, lam * query_sim - (1 - lam) * max_sim, -np.inf)
+        j = int(np.argmax(gain))
+        selected.append(j)
+        available[j] = False
+        np.maximum(max_sim, sim[j], out=max_sim)
+    return np.asarray(selected)
+
+
+def prune_candidates(candidates: List[Dict],
+                     vectors: np.ndarray,
+                     query_vec: np.ndarray,
+                     max_candidates: Optional[int] = RERANK_MAX_CANDIDATES,
+                     dup_threshold: float = PRUNE_DUP_THRESHOLD,
+                     mmr_lambda: float = PRUNE_MMR_LAMBDA,
+                     min_keep: int = 0) -> Tuple[List[Dict], Dict]:
+    """
+    candidates：融合後的候選（依排序），vectors：對應的向量 (N, dim)，query_vec：(dim,)
+    max_candidates：MMR 最多留幾筆（None = 只做去重；小於 min_keep 時以 min_keep 為準）
+    min_keep：至少留下幾筆（候選本身不足時全留）
+
+    回傳 (精簡後的候選（維持原排序）, 統計 {"candidates", "duplicates", "diversity", "kept"})
+    """
+    n = len(candidates)
+    stats = {"candidates": n, "duplicates": 0, "diversity": 0, "kept": n}
+    if n <= 1:
+        return list(candidates), stats
+
+    vecs = _normalize(np.asarray(vectors, dtype="float32"))
+    sim = vecs @ vecs.T
+
+    keep_of = collapse_duplicates(sim, dup_threshold)
+    survivors = np.flatnonzero(keep_of == np.arange(n))
+    if len(survivors) < min_keep:
+        # 依原排序補回被併掉的候選，補回的不再算是重複
+        collapsed = np.flatnonzero(keep_of != np.arange(n))[:min_keep - len(survivors)]
+        keep_of[collapsed] = collapsed
+        survivors = np.flatnonzero(keep_of == np.arange(n))
+
+    if max_candidates is not None:
+        max_candidates = max(max_candidates, min_keep)
+    chosen = survivors
+    if max_candidates is not None and len(survivors) > max_candidates:
+        query_sim = vecs[survivors] @ _normalize(np.asarray(query_vec, dtype="float32"))
+        picked = mmr_select(query_sim, sim[np.ix_(survivors, survivors)], max_candidates, mmr_lambda)
+        chosen = np.sort(survivors[picked])
+
+    out = []
+    for i in chosen:
+        item = candidates[i]
+        dups = [candidates[j].get("id") for j in np.flatnonzero(keep_of == i) if j != i]
+        if dups:
+            item = dict(item)
+            item["duplicates"] = dups
+        out.append(item)
+
+    stats.update(duplicates=n - len(survivors), diversity=len(survivors) - len(chosen),
+                 kept=len(chosen))
+    return out, stats
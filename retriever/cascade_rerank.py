@@ -0,0 +1,150 @@
+# retriever/cascade_rerank.py
+"""
+Cascade rerank：不把全部候選都送進 4B reranker，而是依第一階段的排序分批打分，
+前 top_k 名穩定後就提早結束。
+
+每個 query 的流程：
+1. skip：最高的 cosine 相似度比第二高的高出 RERANK_SKIP_GAP 以上（答案很明確）→ 不 rerank，直接依原排序回傳
+   （候選依 fusion_score 排序，RRF 時前兩名不一定是相似度最高的兩筆，所以比較的是全部候選中最高的兩個 "score"）
+2. 小模型（選用）：RERANK_CASCADE_SMALL_MODEL 先對全部候選打分，改用它的排序決定大模型的打分順序
+3. 大模型分批打分：第一輪 max(top_k, RERANK_CASCADE_BATCH) 筆，之後每輪 RERANK_CASCADE_BATCH 筆；
+   某一輪新打分的候選「沒有任何一筆擠進前 top_k」且「其中最高分比第 top_k 名低至少 RERANK_CASCADE_MARGIN」
+   就停止（後面的候選第一階段排序更低，通常只會更差）
+4. 回傳已打分候選的前 top_k 名（依 rerank_score）
+
+多個 query 每一輪的 pair 一起送進 score_pairs，仍共用 batch。
+每個 query 回傳一份統計（candidates / scored / small_scored / rounds / skipped / early_exit），
+用來對照延遲與品質。
+"""
+
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+import heapq
+
+import numpy as np
+
+from config.settings import (
+    RERANK_CASCADE_BATCH, RERANK_CASCADE_MARGIN, RERANK_SKIP_GAP,
+)
+
+if TYPE_CHECKING:
+    from .reranker import Reranker
+
+
+def _doc(c: Dict) -> str:
+    return c.get("abstract") or c.get("text")
+
+
+def similarity_gap(candidates: List[Dict]) -> Optional[float]:
+    """
+    候選中最高與第二高的 cosine 相似度（"score"）之差，不看候選的排列順序；
+    有相似度的候選不到 2 筆（例如其餘只被 BM25 找到）時回傳 None
+    """
+    top = heapq.nlargest(2, (c["score"] for c in candidates if "score" in c))
+    if len(top) < 2:
+        return None
+    return top[0] - top[1]
+
+
+def is_stable(top_scores: List[float], new_scores: List[float], entered: bool,
+              margin: float = RERANK_CASCADE_MARGIN) -> bool:
+    """
+    top_scores：目前前 top_k 名的分數；new_scores：這一輪新打分的分數；
+    entered：這一輪是否有候選擠進前 top_k
+    """
+    if entered or not new_scores:
+        return False
+    return min(top_scores) - max(new_scores) >= margin
+
+
+def cascade_rerank(queries: List[str],
+                   candidates_per_query: List[List[Dict]],
+                   reranker: "Reranker",
+                   top_k: int | List[int] = 10,
+                   small_reranker: "Reranker | None" = None,
+                   batch_size: int = RERANK_CASCADE_BATCH,
+                   margin: float = RERANK_CASCADE_MARGIN,
+                   skip_gap: Optional[float] = RERANK_SKIP_GAP,
+                   doc_tokens: Dict[int, np.ndarray] | None = None
+                   ) -> Tuple[List[List[Dict]], List[Dict]]:
+    """
+    回傳 (各 query 的前 top_k 筆, 各 query 的統計)，順序同 queries
+    doc_tokens：vector id → 用 reranker.doc_tokenizer 預先 tokenize 的 token id；
+                小模型的 tokenizer 相同時也一起用
+    """
+    top_ks = top_k if isinstance(top_k, list) else [top_k] * len(queries)
+    order: List[List[Dict]] = [list(c) for c in candidates_per_query]
+    stats = [{"candidates": len(c), "scored": 0, "small_scored": 0, "rounds": 0,
+              "skipped": False, "early_exit": False} for c in order]
+
+    # 1. 相似度差距夠大的 query 不 rerank
+    active = []
+    for i, cands in enumerate(order):
+        gap = similarity_gap(cands)
+        if not cands or (skip_gap is not None and gap is not None and gap >= skip_gap):
+            stats[i]["skipped"] = bool(cands)
+        else:
+            active.append(i)
+
+    def tokens(pairs, model):
+        if doc_tokens is None or model.doc_tokenizer.key != reranker.doc_tokenizer.key:
+            return None
+        return [doc_tokens.get(c.get("vid")) for _, c in pairs]
+
+    # 2. 小模型先把全部候選重排
+    if small_reranker is not None and active:
+        pairs = [(i, c) for i in active for c in order[i]]
+        scores = small_reranker.score_pairs([queries[i] for i, _ in pairs], [_doc(c) for _, c in pairs],
+                                            doc_tokens=tokens(pairs, small_reranker))
+        for (i, c), s in zip(pairs, scores):
+            c["small_rerank_score"] = s
+        for i in active:
+            order[i].sort(key=lambda x: x["small_rerank_score"], reverse=True)
+            stats[i]["small_scored"] = len(order[i])
+
+    # 3. 大模型依序分批打分，直到前 top_k 穩定或候選用完
+    scored: Dict[int, List[Dict]] = {i: [] for i in active}
+    while active:
+        batch: List[Tuple[int, Dict]] = []
+        for i in active:
+            start = len(scored[i])
+            size = batch_size if start else max(top_ks[i], batch_size)
+            batch += [(i, c) for c in order[i][start:start + size]]
+
+        scores = reranker.score_pairs([queries[i] for i, _ in batch], [_doc(c) for _, c in batch],
+                                      doc_tokens=tokens(batch, reranker))
+        new: Dict[int, List[Dict]] = {i: [] for i in active}
+        for (i, c), s in zip(batch, scores):
+            c["rerank_score"] = s
+            new[i].append(c)
+
+        still = []
+        for i in active:
+            k = top_ks[i]
+            prev_top = {id(c) for c in _top(scored[i], k)} if len(scored[i]) >= k else None
+            scored[i] += new[i]
+            stats[i]["scored"] = len(scored[i])
+            stats[i]["rounds"] += 1
+            if len(scored[i]) == len(order[i]):
+                continue
+
+            top = _top(scored[i], k)
+            if prev_top is not None and is_stable(
+                    [c["rerank_score"] for c in top], [c["rerank_score"] for c in new[i]],
+                    entered=any(id(c) not in prev_top for c in top), margin=margin):
+                stats[i]["early_exit"] = True
+                continue
+            still.append(i)
+        active = still
+
+    # 4. 組出結果：rerank 過的依分數排序，跳過的依原排序
+    results = []
+    for i, cands in enumerate(order):
+        if i in scored:
+            results.append(_top(scored[i], top_ks[i]))
+        else:
+            results.append(cands[:top_ks[i]])
+    return results, stats
+
+
+def _top(items: List[Dict], k: int) -> List[Dict]:
+    return sorted(items, key=lambda x: x["rerank_score"], reverse=True)[:k]
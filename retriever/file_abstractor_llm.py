@@ -1,58 +1,116 @@
 # retriever/file_abstractor_llm.py
 
+from typing import List
+
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from tqdm import tqdm
 
+from config.settings import SUMMARY_STORE_PATH, SUMMARY_BATCH_TOKENS, SUMMARY_MAX_NEW_TOKENS
+from utils.batching import token_budget_batches
+from utils.hashing import text_hash
+from utils.storage import JsonlStore
+from utils import instrument
+
 LLM_MODEL = "Qwen/Qwen3-4B-Instruct-2507"  # 自行換模型
 
+PROMPT = "請將以下教材內容濃縮成重點摘要（越清楚越好）：\n{text}\n\n摘要："
+
 class LLMAbstractor:
     def __init__(self, model_name: str = LLM_MODEL):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # 左側 padding：batch 內每一列的 prompt 都緊接著生成的 token
+        self.tokenizer.padding_side = "left"
+
         self.model = AutoModelForCausalLM.from_pretrained(
             model_name,
             torch_dtype=torch.float16,
             device_map="auto"
         )
 
-    @torch.no_grad()
-    def summarize(self, text: str) -> str:
-        prompt = f"請將以下教材內容濃縮成重點摘要（越清楚越好）：\n{text}\n\n摘要："
+    def prompt_lengths(self, texts: List[str]) -> List[int]:
+        prompts = [PROMPT.format(text=t) for t in texts]
+        return [len(ids) for ids in self.tokenizer(prompts)["input_ids"]]
 
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+    @torch.no_grad()
+    def summarize_batch(self, texts: List[str],
+                        max_new_tokens: int = SUMMARY_MAX_NEW_TOKENS) -> List[str]:
+        """
+        一次 generate 一整批；只 decode prompt 之後新生成的 token，
+        不需要再用「摘要：」切掉 prompt。
+        """
+        prompts = [PROMPT.format(text=t) for t in texts]
+        inputs = self.tokenizer(prompts, padding=True, return_tensors="pt").to(self.model.device)
 
         outputs = self.model.generate(
             **inputs,
-            max_new_tokens=256,
-            temperature=0.2
+            max_new_tokens=max_new_tokens,
+            temperature=0.2,
+            pad_token_id=self.tokenizer.pad_token_id
         )
 
-        decoded = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        decoded = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+        return [d.strip() for d in decoded]
 
-        # ---------------------------------------------------------
-        # 🔥 從「摘要：」後面開始截取（去掉 prompt）
-        # ---------------------------------------------------------
-        if "摘要：" in decoded:
-            summary = decoded.split("摘要：", 1)[1].strip()
-        else:
-            # 如果模型沒有照格式輸出 fallback 到全文
-            summary = decoded.strip()
+    def summarize(self, text: str) -> str:
+        return self.summarize_batch([text])[0]
 
-        return summary
 
+_abstractor: LLMAbstractor | None = None
 
 
-def abstract_chunks(chunks: list) -> list:
+def get_abstractor() -> LLMAbstractor:
     """
-    對每個 chunk 做 LLM 摘要
+    共用同一個模型，不要每次 abstract_chunks 都重新載入
     """
-    abs_model = LLMAbstractor()
-    results = []
+    global _abstractor
+    if _abstractor is None:
+        _abstractor = LLMAbstractor()
+    return _abstractor
+
+
+def abstract_chunks(chunks: list,
+                    abstractor: LLMAbstractor | None = None,
+                    store: JsonlStore | None = None,
+                    batch_tokens: int = SUMMARY_BATCH_TOKENS) -> list:
+    """
+    對每個 chunk 做 LLM 摘要（結果順序同輸入）
+
+    - 摘要以 chunk 內容 hash 為 key 存在 store（預設 SUMMARY_STORE_PATH），
+      已有摘要的 chunk 不再生成；每完成一個 batch 就寫入，中斷後重跑只補缺的
+    - 缺少摘要的 chunk 依 prompt 長度分桶，每批 token 數不超過 batch_tokens
+    """
+    if store is None:
+        store = JsonlStore(SUMMARY_STORE_PATH)
+
+    hashes = [text_hash(c) for c in chunks]
+
+    # 還沒有摘要的 chunk（相同內容只生成一次）
+    todo = {}
+    for h, c in zip(hashes, chunks):
+        if h not in store and h not in todo:
+            todo[h] = c
+    # 不需要生成的 chunk 數（已有摘要 / 與同批其他 chunk 內容相同）
+    instrument.count("summary.reused", len(chunks) - len(todo))
+
+    if todo:
+        abs_model = abstractor or get_abstractor()
+        todo_hashes = list(todo)
+        todo_texts = list(todo.values())
+
+        lengths = [n + SUMMARY_MAX_NEW_TOKENS for n in abs_model.prompt_lengths(todo_texts)]
+        batches = token_budget_batches(lengths, batch_tokens)
 
-    for c in tqdm(chunks, desc="摘要中"):
-        summary = abs_model.summarize(c)
-        results.append(summary)
+        with tqdm(total=len(todo_texts), desc="摘要中") as bar:
+            for batch in batches:
+                with instrument.span("summarize.generate", batch=len(batch)):
+                    summaries = abs_model.summarize_batch([todo_texts[i] for i in batch])
+                store.put_many((todo_hashes[i], s) for i, s in zip(batch, summaries))
+                bar.update(len(batch))
 
-    return results
+    return [store.get(h) for h in hashes]
@@ -3,58 +3,163 @@
 Files Embedding 模組：
 將摘要後的文件轉成向量表示，供後續向量搜尋使用。
 這裡使用 HuggingFace 的 sentence-transformers / embedding 模型。
+EMBEDDING_BACKEND = "onnx" 時 forward 改用 ONNX Runtime（見 retriever/onnx_backend.py）。
+encode() 也可以直接吃預先 tokenize 好的 token id（retriever/token_store.py），ingest 時 tokenize 一次、
+token id 存進 vector DB，重新 embedding 時不用再 tokenize。
 """
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
+from types import SimpleNamespace
 
 import numpy as np
 import torch
-from transformers import AutoTokenizer, AutoModel
+import torch.nn.functional as F
+from transformers import AutoConfig, AutoTokenizer, AutoModel
+
+from config.settings import (
+    EMBEDDING_MAX_LENGTH, EMBEDDING_BATCH_TOKENS,
+    EMBEDDING_POOLING, EMBEDDING_NORMALIZE,
+    EMBEDDING_BACKEND, ONNX_QUANTIZE,
+)
+from utils.batching import token_budget_batches
+from utils import instrument
+from .onnx_backend import BACKENDS, load_onnx_model
+from .token_store import DocTokenizer
 
 # === 這裡換成你的 Qwen3-Embedding 模型名稱 ===
 EMBEDDING_MODEL_NAME = "Qwen/Qwen3-Embedding-0.6B"  # TODO: 改成實際可用的名稱
 
+# decoder-only 的 embedding 模型（Qwen3-Embedding 等）用最後一個 token 的 hidden state
+DECODER_MODEL_TYPES = {"qwen2", "qwen3", "llama", "mistral", "gemma", "gemma2", "gemma3"}
+
 class FileEmbedder:
-    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME,
+                 pooling: str = EMBEDDING_POOLING,
+                 normalize: bool = EMBEDDING_NORMALIZE,
+                 backend: str = EMBEDDING_BACKEND,
+                 quantize: bool = ONNX_QUANTIZE):
+        """
+        backend："torch"（HF 模型，有 GPU 就用）/ "onnx"（ONNX Runtime CPU；quantize → int8）
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的 backend：{backend}（可用：{', '.join(BACKENDS)}）")
+        self.backend = backend
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModel.from_pretrained(model_name).to(self.device)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        if backend == "onnx":
+            self.device = "cpu"
+            self.config = AutoConfig.from_pretrained(model_name)
+            self.model = load_onnx_model(model_name, "embedder", quantize=quantize,
+                                         pad_token_id=self.tokenizer.pad_token_id)
+        else:
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.model = AutoModel.from_pretrained(model_name).to(self.device)
+            self.model.eval()
+            self.config = self.model.config
+
+        self.pooling = self._resolve_pooling(pooling)
+        self.normalize = normalize
+
+        if self.pooling == "last":
+            # 左側 padding：每一列的最後一個 token 都在位置 -1
+            self.tokenizer.padding_side = "left"
+        self.doc_tokenizer = DocTokenizer(self.tokenizer, EMBEDDING_MAX_LENGTH)
+
+    def _resolve_pooling(self, pooling: str) -> str:
+        if pooling != "auto":
+            if pooling not in ("last", "cls", "mean"):
+                raise ValueError(f"未知的 pooling：{pooling}（可用：auto / last / cls / mean）")
+            return pooling
+        config = self.config
+        if getattr(config, "model_type", None) in DECODER_MODEL_TYPES or getattr(config, "is_decoder", False):
+            return "last"
+        return "cls"
+
+    def _pool(self, outputs, attention_mask: torch.Tensor) -> torch.Tensor:
+        hidden = outputs.last_hidden_state
+
+        if self.pooling == "last":
+            if bool(attention_mask[:, -1].all()):
+                return hidden[:, -1]
+            # 右側 padding 的情況：取每列最後一個非 pad 位置
+            last = attention_mask.sum(dim=1) - 1
+            return hidden[torch.arange(hidden.shape[0], device=hidden.device), last]
+
+        if self.pooling == "mean":
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            return (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+        if getattr(outputs, "pooler_output", None) is not None:
+            return outputs.pooler_output
+        return hidden[:, 0]  # CLS token
+
+    def _forward(self, inputs):
+        if self.backend == "onnx":
+            hidden = self.model(inputs["input_ids"].numpy(), inputs["attention_mask"].numpy())
+            return SimpleNamespace(last_hidden_state=torch.from_numpy(hidden), pooler_output=None)
+        return self.model(**inputs)
 
     @torch.no_grad()
-    def encode(self, texts: List[str], batch_size: int = 8) -> np.ndarray:
+    def encode(self, texts: List[str],
+               batch_size: int | None = None,
+               batch_tokens: int = EMBEDDING_BATCH_TOKENS,
+               token_ids: Optional[List[np.ndarray]] = None) -> np.ndarray:
         """
         將多個文字編碼成 numpy 向量 (num_texts, dim)
+
+        先不 padding 地 tokenize 取得長度，依長度分桶成 token 數受限的 batch
+        （batch_size 另外限制每批筆數），結果直接寫進預先配置好的 float32 陣列，
+        順序與輸入一致。
+        token_ids：與 texts 對應、self.doc_tokenizer.tokenize() 的結果，有的話不再 tokenize
         """
-        all_embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            enc = self.tokenizer(
-                batch,
+        dim = self.config.hidden_size
+        out = np.empty((len(texts), dim), dtype="float32")
+        if not texts:
+            return out
+
+        if token_ids is not None and self.doc_tokenizer.supported:
+            seqs = self.doc_tokenizer.single(token_ids)
+            lengths = [len(ids) for ids in seqs]
+            make_inputs = lambda batch: self.doc_tokenizer.pad([seqs[i] for i in batch])
+        else:
+            with instrument.span("embed.tokenize", texts=len(texts)):
+                enc = self.tokenizer(
+                    texts,
+                    truncation=True,
+                    max_length=EMBEDDING_MAX_LENGTH
+                )
+            lengths = [len(ids) for ids in enc["input_ids"]]
+            make_inputs = lambda batch: self.tokenizer.pad(
+                [{k: enc[k][i] for k in enc.keys()} for i in batch],
                 padding=True,
-                truncation=True,
-                max_length=512,
                 return_tensors="pt"
-            ).to(self.device)
+            )
+
+        for batch in token_budget_batches(lengths, batch_tokens, max_batch_size=batch_size):
+            inputs = make_inputs(batch).to(self.device)
 
-            outputs = self.model(**enc)
-            # 這裡示意使用 CLS pooling，你可依模型官方建議修改
-            if hasattr(outputs, "pooler_output") and outputs.pooler_output is not None:
-                emb = outputs.pooler_output
-            else:
-                emb = outputs.last_hidden_state[:, 0]  # CLS token
+            with instrument.span("embed.forward", batch=len(batch),
+                                 padded_tokens=int(inputs["input_ids"].numel())):
+                outputs = self._forward(inputs)
+                emb = self._pool(outputs, inputs["attention_mask"])
+                if self.normalize:
+                    emb = F.normalize(emb.float(), p=2, dim=-1)
 
-            emb = emb.cpu().numpy()
-            all_embeddings.append(emb)
+                out[batch] = emb.float().cpu().numpy()
 
-        return np.vstack(all_embeddings)
+        return out
 
-def embed_files(abstracts: List[Dict], embedder: FileEmbedder | None = None
+def embed_files(abstracts: List[Dict], embedder: FileEmbedder | None = None,
+                token_ids: Optional[List[np.ndarray]] = None
                 ) -> Tuple[np.ndarray, List[Dict]]:
     """
     將摘要文件轉成向量。
 
     輸入：
         abstracts: list[{"id": str, "abstract": str, ...}]
+        token_ids: 選用，各摘要預先 tokenize 的結果（embedder.doc_tokenizer）
     輸出：
         embeddings: np.ndarray (N, dim)
         metadatas:  list[dict]（每筆對應的 meta，包含 id / 原始路徑 / 摘要等）
@@ -63,6 +168,6 @@ def embed_files(abstracts: List[Dict], embedder: FileEmbedder | None = None
         embedder = FileEmbedder()
 
     texts = [f["abstract"] for f in abstracts]
-    embeddings = embedder.encode(texts)
+    embeddings = embedder.encode(texts, token_ids=token_ids)
     metadatas = abstracts  # 這裡直接沿用，裡面已包含 id/abstract/path 等資訊
     return embeddings, metadatas
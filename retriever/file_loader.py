@@ -1,26 +1,90 @@
 # retriever/file_loader.py
 """
 載入原始教材 / 文件的工具。
-目前示範從資料夾讀取 .txt 檔，你可依需求改成 PDF / DOCX 解析。
+支援 .txt 與 .pdf；PDF 以 process pool 平行抽取，
+抽取結果依 (路徑, 大小, mtime, 內容 hash) 快取，沒變動的 PDF 不會再解析一次。
 """
 
+import logging
 import os
-from typing import List, Dict
+from concurrent.futures import Executor
+from typing import List, Dict, Optional, Sequence
+
+from config.settings import PDF_WORKERS, EXTRACT_CACHE_DIR
+from utils.extract_cache import ExtractCache
+
+SUPPORTED_EXTS = (".txt", ".pdf")
+
+logger = logging.getLogger(__name__)
+
+
+def load_files(paths: Sequence[str],
+               workers: Optional[int] = PDF_WORKERS,
+               cache_dir: Optional[str] = EXTRACT_CACHE_DIR,
+               executor: Optional[Executor] = None) -> List[Dict]:
+    """
+    載入指定檔案，回傳 list[{"id": 檔名, "text": str, "path": str}]（順序同輸入）
+    executor：共用的 process pool（見 utils.pdf_reader.read_pdfs）
+    """
+    texts: Dict[str, str] = {}
+    pdfs = []
+    for fpath in paths:
+        if fpath.lower().endswith(".pdf"):
+            pdfs.append(fpath)
+        else:
+            with open(fpath, "r", encoding="utf-8", errors="ignore") as f:
+                texts[fpath] = f.read()
+
+    if pdfs:
+        # 延後 import：只讀 .txt 時不需要 PyMuPDF
+        from utils.pdf_reader import read_pdfs
+
+        cache = ExtractCache(cache_dir) if cache_dir else None
+        todo, shas = [], {}
+        for fpath in pdfs:
+            if cache is None:
+                todo.append(fpath)
+                continue
+            text, shas[fpath] = cache.lookup(fpath)
+            if text is None:
+                todo.append(fpath)
+            else:
+                texts[fpath] = text
+
+        if todo:
+            # streaming ingest 逐檔呼叫（一次一個 PDF），只在批次載入時記錄進度
+            if len(pdfs) > 1:
+                logger.info("extracting %d PDFs (%d from cache)", len(todo), len(pdfs) - len(todo))
+            extracted = read_pdfs(todo, workers=workers, executor=executor)
+            texts.update(extracted)
+            if cache is not None:
+                for fpath, text in extracted.items():
+                    cache.store(shas[fpath], text)
+
+        if cache is not None:
+            cache.save()
+
+    return [{
+        "id": os.path.basename(fpath),
+        "text": texts[fpath],
+        "path": fpath
+    } for fpath in paths]
+
+
+def load_documents(folder: str,
+                   exts: Sequence[str] = SUPPORTED_EXTS,
+                   workers: Optional[int] = PDF_WORKERS,
+                   cache_dir: Optional[str] = EXTRACT_CACHE_DIR) -> List[Dict]:
+    """
+    讀取資料夾內所有指定副檔名的檔案（依檔名排序）
+    """
+    paths = [os.path.join(folder, fname) for fname in sorted(os.listdir(folder))
+             if fname.lower().endswith(tuple(exts))]
+    return load_files(paths, workers=workers, cache_dir=cache_dir)
+
 
 def load_text_files(folder: str) -> List[Dict]:
     """
     從資料夾讀取所有 .txt 檔案，回傳 list[{"id": str, "text": str, "path": str}]
     """
-    files = []
-    for fname in os.listdir(folder):
-        if not fname.lower().endswith(".txt"):
-            continue
-        fpath = os.path.join(folder, fname)
-        with open(fpath, "r", encoding="utf-8", errors="ignore") as f:
-            text = f.read()
-        files.append({
-            "id": fname,
-            "text": text,
-            "path": fpath
-        })
-    return files
+    return load_documents(folder, exts=(".txt",))
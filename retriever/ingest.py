@@ -0,0 +1,87 @@
+# retriever/ingest.py
+"""
+Streaming ingest 工具：
+把資料流依序經過多個 stage，每個 stage 一個 thread，stage 之間用 bounded queue 連接，
+上游跑太快時會被 queue 擋住，整體記憶體用量只跟 queue 大小 × batch 大小有關，與語料大小無關。
+
+stage 是「吃 iterator、吐 iterator」的函式，因此可以自由做 flat-map 或累積成 batch：
+
+    def batch(items):
+        buf = []
+        for x in items:
+            buf.append(x)
+            if len(buf) == 64:
+                yield buf
+                buf = []
+        if buf:
+            yield buf
+
+    for out in run_stages(paths, [load, chunk, batch, embed]):
+        store.add_embeddings(...)
+
+任何 stage 丟出例外時，其他 stage 會停下，例外在消費端重新拋出。
+"""
+
+from typing import Callable, Iterable, Iterator, List
+import queue
+import threading
+
+from config.settings import INGEST_QUEUE_SIZE
+
+_DONE = object()
+_POLL = 0.1
+
+
+def run_stages(source: Iterable,
+               stages: List[Callable[[Iterator], Iterable]],
+               queue_size: int = INGEST_QUEUE_SIZE) -> Iterator:
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def put(q, item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def drain(q) -> Iterator:
+        while not stop.is_set():
+            try:
+                item = q.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def run(items: Iterable, q_out):
+        try:
+            for item in items:
+                if not put(q_out, item):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(q_out, _DONE)
+
+    threads = [threading.Thread(target=run, args=(source, queues[0]), daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(
+            target=lambda fn=stage, q_in=queues[i], q_out=queues[i + 1]: run(fn(drain(q_in)), q_out),
+            daemon=True))
+    for t in threads:
+        t.start()
+
+    try:
+        yield from drain(queues[-1])
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
@@ -0,0 +1,184 @@
+# retriever/metadata_filter.py
+"""
+Metadata 過濾：
+把 {"欄位": 條件} 解析成符合的 vector id 集合，讓 VectorStore.search() 在 FAISS 內部就只看這些 id
+（IDSelector），而不是多撈再用 Python 篩。
+
+條件寫法（多個欄位之間是 AND）：
+    {"source": "特殊教育法.pdf"}                    完全相等
+    {"source": "特殊教育法*.pdf"}                   含 * ? [ 的字串 → glob（fnmatch，區分大小寫）
+    {"source": ["a.pdf", "b*.pdf"]}                 list → 任一符合
+    {"chunk_id": {"gte": 0, "lt": 10}}              dict → 範圍（gt / gte / lt / lte 可任意組合）
+
+FILTER_FIELDS 裡的欄位預先建好 欄位值 → vector id 的索引（MetadataIndex），
+完全相等直接查表，glob / 範圍只需比對「不同的欄位值」（文件數 / chunk 編號），不用掃過每個 chunk；
+其他欄位則退回逐筆掃 metadata。
+解析結果依條件快取（同一組 filter 反覆查詢時不用重算），索引有任何變動就整個清掉。
+"""
+
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+import json
+
+import numpy as np
+
+from config.settings import FILTER_FIELDS
+
+RANGE_OPS = ("gt", "gte", "lt", "lte")
+_RESOLVE_CACHE_SIZE = 128
+
+Filters = Dict[str, Any]
+
+
+def _is_glob(cond) -> bool:
+    return isinstance(cond, str) and any(c in cond for c in "*?[")
+
+
+def _indexable(value) -> bool:
+    return value is not None and not isinstance(value, (list, dict))
+
+
+def _exact_values(cond) -> Optional[List]:
+    """
+    條件只是「等於某些值」時回傳這些值（可直接查表），否則 None
+    """
+    conds = list(cond) if isinstance(cond, (list, tuple, set)) else [cond]
+    if all(_indexable(c) and not isinstance(c, (tuple, set)) and not _is_glob(c) for c in conds):
+        return conds
+    return None
+
+
+def match_value(value, cond) -> bool:
+    """
+    單一欄位值是否符合條件
+    """
+    if isinstance(cond, dict):
+        unknown = set(cond) - set(RANGE_OPS)
+        if unknown:
+            raise ValueError(f"未知的範圍條件：{', '.join(sorted(unknown))}（可用：{', '.join(RANGE_OPS)}）")
+        if value is None:
+            return False
+        try:
+            return (("gt" not in cond or value > cond["gt"])
+                    and ("gte" not in cond or value >= cond["gte"])
+                    and ("lt" not in cond or value < cond["lt"])
+                    and ("lte" not in cond or value <= cond["lte"]))
+        except TypeError:       # 型別不能比較（例如字串對數字）視為不符合
+            return False
+    if isinstance(cond, (list, tuple, set)):
+        return any(match_value(value, c) for c in cond)
+    if _is_glob(cond):
+        return isinstance(value, str) and fnmatchcase(value, cond)
+    return value == cond
+
+
+def validate_filters(filters: Optional[Filters]) -> Optional[Filters]:
+    """
+    檢查條件寫法（欄位名稱須為字串、範圍條件只能用 RANGE_OPS），有誤丟 ValueError
+    """
+    def check(cond):
+        if isinstance(cond, dict):
+            unknown = set(cond) - set(RANGE_OPS)
+            if unknown or not cond:
+                raise ValueError(f"範圍條件只能使用：{', '.join(RANGE_OPS)}")
+        elif isinstance(cond, (list, tuple, set)):
+            for c in cond:
+                check(c)
+
+    for f, cond in (filters or {}).items():
+        if not isinstance(f, str):
+            raise ValueError(f"過濾欄位名稱須為字串：{f!r}")
+        check(cond)
+    return filters
+
+
+def match_meta(meta: Dict, filters: Optional[Filters]) -> bool:
+    return not filters or all(match_value(meta.get(f), cond) for f, cond in filters.items())
+
+
+def filter_key(filters: Optional[Filters]) -> str:
+    """
+    過濾條件的正規化字串（分組 / cache key 用），沒有條件時為 ""
+    """
+    if not filters:
+        return ""
+    return json.dumps(filters, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class MetadataIndex:
+    """
+    欄位 → {欄位值 → vector id 集合}，隨 VectorStore 的 add / remove / update 增量維護
+    """
+
+    def __init__(self, fields: Iterable[str] = FILTER_FIELDS):
+        self.fields = tuple(fields)
+        self._postings: Dict[str, Dict[Any, Set[int]]] = {f: {} for f in self.fields}
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    @classmethod
+    def build(cls, metadatas: Mapping[int, Dict], fields: Iterable[str] = FILTER_FIELDS) -> "MetadataIndex":
+        index = cls(fields)
+        index.add(metadatas.keys(), metadatas.values())
+        return index
+
+    def add(self, ids: Iterable[int], metadatas: Iterable[Dict]):
+        self._cache.clear()
+        for i, meta in zip(ids, metadatas):
+            for f in self.fields:
+                value = meta.get(f)
+                if _indexable(value):
+                    self._postings[f].setdefault(value, set()).add(i)
+
+    def remove(self, ids: Iterable[int], metadatas: Iterable[Dict]):
+        self._cache.clear()
+        for i, meta in zip(ids, metadatas):
+            for f in self.fields:
+                value = meta.get(f)
+                ids_of_value = self._postings[f].get(value) if _indexable(value) else None
+                if ids_of_value is not None:
+                    ids_of_value.discard(i)
+                    if not ids_of_value:
+                        del self._postings[f][value]
+
+    def resolve(self, filters: Filters, metadatas: Mapping[int, Dict]) -> np.ndarray:
+        """
+        回傳符合所有條件的 vector id（排序過的 int64 陣列，呼叫端不要就地修改）
+        """
+        key = filter_key(filters)
+        ids = self._cache.get(key)
+        if ids is not None:
+            self._cache.move_to_end(key)
+            return ids
+
+        ids = self._resolve(filters, metadatas)
+        self._cache[key] = ids
+        if len(self._cache) > _RESOLVE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return ids
+
+    def _resolve(self, filters: Filters, metadatas: Mapping[int, Dict]) -> np.ndarray:
+        result: Optional[Set[int]] = None
+        scan: Dict[str, Any] = {}
+        # 先算有索引的欄位，越早縮小範圍越好
+        for f, cond in filters.items():
+            if f not in self._postings:
+                scan[f] = cond
+                continue
+            postings = self._postings[f]
+            values = _exact_values(cond)
+            if values is None:
+                values = [v for v in postings if match_value(v, cond)]
+            matched: Set[int] = set()
+            for value in values:
+                matched |= postings.get(value, set())
+            result = matched if result is None else result & matched
+            if not result:
+                break
+
+        if scan and result != set():
+            candidates = metadatas.keys() if result is None else result
+            result = {i for i in candidates if match_meta(metadatas[i], scan)}
+
+        ids: List[int] = sorted(result) if result is not None else sorted(metadatas.keys())
+        return np.asarray(ids, dtype="int64")
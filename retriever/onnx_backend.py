@@ -0,0 +1,148 @@
+# retriever/onnx_backend.py
+"""
+ONNX Runtime 推論 backend（CPU 部署用）：
+FileEmbedder / Reranker 在 EMBEDDING_BACKEND / RERANK_BACKEND = "onnx" 時改用這裡的 OnnxModel，
+tokenize、分桶、pooling 等流程不變，只有 forward 換成 ONNX Runtime。
+
+第一次使用某個模型時自動匯出（之後直接讀檔）：
+    ONNX_DIR/<模型名稱>/embedder.onnx         float32
+    ONNX_DIR/<模型名稱>/embedder.int8.onnx    dynamic int8 量化（ONNX_QUANTIZE）
+reranker 同理（reranker.onnx / reranker.int8.onnx）。
+
+輸入固定為 input_ids / attention_mask（batch、序列長度皆為動態），
+輸出 embedder 是 last_hidden_state、reranker 是 logits，與 PyTorch 模型的輸出相同，
+一致性與速度可用 tools/check_backend.py 比對。
+
+onnxruntime / onnx 是選用套件，只有選了 onnx backend 才需要安裝。
+"""
+
+from typing import Optional
+import logging
+import os
+import re
+
+import numpy as np
+
+from config.settings import ONNX_DIR, ONNX_QUANTIZE, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx")
+KINDS = ("embedder", "reranker")
+_OUTPUT_NAME = {"embedder": "last_hidden_state", "reranker": "logits"}
+_OPSET = 17
+
+
+def onnx_path(model_name: str, kind: str, quantize: bool = ONNX_QUANTIZE,
+              onnx_dir: str = ONNX_DIR) -> str:
+    safe = re.sub(r"[^0-9A-Za-z._-]+", "_", model_name).strip("_")
+    return os.path.join(onnx_dir, safe, f"{kind}{'.int8' if quantize else ''}.onnx")
+
+
+def export_onnx(model_name: str, kind: str, path: str, pad_token_id: Optional[int] = None):
+    """
+    把 HF 模型（float32、eager attention）匯出成 ONNX；先寫 .tmp 再換上，中斷不會留下壞檔
+    """
+    import torch
+    from transformers import AutoModel, AutoModelForSequenceClassification
+
+    cls = AutoModel if kind == "embedder" else AutoModelForSequenceClassification
+    model = cls.from_pretrained(model_name, torch_dtype=torch.float32, attn_implementation="eager")
+    if pad_token_id is not None:
+        model.config.pad_token_id = pad_token_id
+    model.config.use_cache = False
+    model.eval()
+
+    class _Wrapper(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            out = self.model(input_ids=input_ids, attention_mask=attention_mask, use_cache=False)
+            return getattr(out, _OUTPUT_NAME[kind])
+
+    dummy = torch.full((2, 8), pad_token_id or 0, dtype=torch.long)
+    dummy[:, 1:] = 100
+    mask = torch.ones_like(dummy)
+    mask[0, 0] = 0
+    dynamic = {"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"},
+               _OUTPUT_NAME[kind]: {0: "batch"} if kind == "reranker" else {0: "batch", 1: "seq"}}
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with torch.no_grad():
+        torch.onnx.export(_Wrapper(), (dummy, mask), tmp,
+                          input_names=["input_ids", "attention_mask"],
+                          output_names=[_OUTPUT_NAME[kind]],
+                          dynamic_axes=dynamic, opset_version=_OPSET, dynamo=False)
+    os.replace(tmp, path)
+
+
+def quantize_onnx(src: str, dst: str):
+    """
+    dynamic int8 量化：權重轉 int8，activation 執行時才量化（不需要校正資料）
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp = dst + ".tmp"
+    # 超過 protobuf 2GB 上限的模型（例如 4B reranker）匯出時權重已放在同資料夾的外部檔，量化結果也一樣
+    folder = os.path.dirname(src) or "."
+    large = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)) > 2 ** 31
+    quantize_dynamic(src, tmp, weight_type=QuantType.QInt8, use_external_data_format=large)
+    os.replace(tmp, dst)
+
+
+def ensure_onnx(model_name: str, kind: str, quantize: bool = ONNX_QUANTIZE,
+                pad_token_id: Optional[int] = None, onnx_dir: str = ONNX_DIR) -> str:
+    """
+    回傳可直接載入的 ONNX 檔路徑，不存在就先匯出（與量化）
+    """
+    if kind not in KINDS:
+        raise ValueError(f"未知的模型種類：{kind}（可用：{', '.join(KINDS)}）")
+    fp32 = onnx_path(model_name, kind, quantize=False, onnx_dir=onnx_dir)
+    target = onnx_path(model_name, kind, quantize=quantize, onnx_dir=onnx_dir)
+    if not os.path.exists(fp32) and not os.path.exists(target):
+        logger.info("exporting ONNX: %s -> %s", model_name, fp32)
+        export_onnx(model_name, kind, fp32, pad_token_id=pad_token_id)
+    if quantize and not os.path.exists(target):
+        logger.info("int8 quantizing: %s -> %s", fp32, target)
+        quantize_onnx(fp32, target)
+    return target
+
+
+class OnnxModel:
+    """
+    ONNX Runtime session（CPU），呼叫方式：model(input_ids, attention_mask) → 輸出 np.ndarray
+    """
+
+    def __init__(self, path: str,
+                 intra_op_threads: Optional[int] = ONNX_INTRA_OP_THREADS,
+                 inter_op_threads: Optional[int] = ONNX_INTER_OP_THREADS):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("onnx backend 需要 onnxruntime：pip install onnxruntime onnx") from e
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            opts.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            opts.inter_op_num_threads = inter_op_threads
+            if inter_op_threads > 1:
+                opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        self.path = path
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {
+            "input_ids": np.ascontiguousarray(input_ids, dtype="int64"),
+            "attention_mask": np.ascontiguousarray(attention_mask, dtype="int64"),
+        })[0]
+
+
+def load_onnx_model(model_name: str, kind: str, quantize: bool = ONNX_QUANTIZE,
+                    pad_token_id: Optional[int] = None) -> OnnxModel:
+    return OnnxModel(ensure_onnx(model_name, kind, quantize=quantize, pad_token_id=pad_token_id))
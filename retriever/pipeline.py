@@ -5,43 +5,186 @@ RetrieverPipeline：
 
 - index_files(): 用於離線建立索引（Files → Abstracting → Embedding → 向量 DB）
 - retrieve():    線上查詢流程（Query → Expand → Embedding → Similarity Search → Reranking）
+- retrieve_many(): 大量 query 的批次檢索（離線評估、批次 QA），分段合併成 batch 處理
 """
 """
 RetrieverPipeline：
 新增兩種模式：
 1. use_rerank = True  →  Query → Embedding → Similarity Search → Reranker
 2. use_rerank = False →  Query → Embedding → Similarity Search（直接結果）
+hybrid = True 時 Similarity Search 之外再加 BM25 關鍵字檢索，兩者以 RRF 融合後才進 Reranker。
+filters 可限定只在部分文件 / chunk 中檢索（例如 {"source": "特殊教育法*.pdf"}），在 index 內過濾。
+RERANK_PRUNE 時，進 Reranker 前先用存好的向量把近似重複的候選併掉、以 MMR 挑出多樣的子集合
+（retriever/candidate_pruning.py），省下的 reranker 次數記在 "rerank.pruned" 計數。
+QUERY_CACHE_SIZE > 0 時前面再加一層查詢結果快取（exact + semantic，見 retriever/query_cache.py），
+vector DB 內容改變時自動失效。
+cascade=True（預設 RERANK_CASCADE）時 reranker 依序分批打分、前 top_k 穩定就停，
+相似度差距明顯的 query 直接跳過 rerank（見 retriever/cascade_rerank.py）；
+每個 query 實際打分幾筆等統計可用 retrieve(..., stats={}) 取回。
+TOKEN_STORE 時 index_files() 把每個 chunk 的 token id（embedder / reranker 的 tokenizer 各一份）存進 vector DB，
+rerank 時直接讀出來與 query 的 token id 接起來（見 retriever/token_store.py）。
+
+各階段的耗時 / 候選數透過 utils.instrument 的 span / count 送給註冊的 hook（沒有 hook 時不做事）。
 """
 
-from typing import List, Dict
-from config.settings import SEARCH_TOPK, RERANK_TOPK, DEFAULT_USE_RERANK
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+import logging
+
+import numpy as np
 
+from config.settings import (
+    SEARCH_TOPK, RERANK_TOPK, DEFAULT_USE_RERANK, DEFAULT_HYBRID, QUERY_FUSION, RETRIEVE_MANY_CHUNK,
+    RERANK_PRUNE, RERANK_MAX_CANDIDATES, QUERY_CACHE_SIZE,
+    RERANK_CASCADE, RERANK_CASCADE_SMALL_MODEL, RERANK_MAX_LENGTH, TOKEN_STORE,
+)
+
+from .candidate_pruning import prune_candidates
 from .file_abstractor import abstract_files
-from .file_embedding import embed_files, FileEmbedder
 from .query_expand import expand_query
+from .metadata_filter import Filters, filter_key
+from .query_cache import QueryCache
 from .query_embedding import embed_query
-from .vector_store import VectorStore
-from .similarity_search import similarity_search
-from .reranker import rerank_results, Reranker
+from .sharded_store import open_vector_store
+from .similarity_search import similarity_search, sparse_search, fuse_results
+from .token_store import DocTokenizer
+from utils import instrument
+
+# torch / transformers 與模型都延後到第一次使用時才載入：
+# 快速模式（use_rerank=False）永遠不會載入 4B 的 reranker
+if TYPE_CHECKING:
+    from .file_embedding import FileEmbedder
+    from .reranker import Reranker
+
+logger = logging.getLogger(__name__)
+
+
+def _per_query(name: str, value, total: int) -> List:
+    """
+    所有 query 共用的值 → 長度 total 的 list；已是 list 時檢查長度
+    """
+    if not isinstance(value, list):
+        return [value] * total
+    if len(value) != total:
+        raise ValueError(f"{name} 數量（{len(value)}）與 queries（{total}）不符")
+    return value
+
+
+def _group_by_filter(idx: Iterable[int], filters: List[Optional[Filters]]
+                     ) -> List[Tuple[List[int], Optional[Filters]]]:
+    """
+    依過濾條件分組：[(位置 list, 該組的 filters)]
+    """
+    groups: Dict[str, List[int]] = {}
+    for j in idx:
+        groups.setdefault(filter_key(filters[j]), []).append(j)
+    return [(js, filters[js[0]]) for js in groups.values()]
 
 
 class RetrieverPipeline:
     def __init__(self,
                  vector_db_path: str,
-                 embedder: FileEmbedder | None = None,
-                 reranker: Reranker | None = None):
+                 embedder: "FileEmbedder | None" = None,
+                 reranker: "Reranker | None" = None,
+                 cache: QueryCache | None = None,
+                 small_reranker: "Reranker | None" = None):
+
+        # VECTOR_SHARDS > 1（或既有的分片 DB）時是 ShardedVectorStore，介面相同
+        self.vector_store = open_vector_store(vector_db_path)
+        self._embedder = embedder
+        self._reranker = reranker
+        self._small_reranker = small_reranker
+        self._rerank_doc_tokenizer: DocTokenizer | None = None
+
+        # 查詢結果快取（QUERY_CACHE_SIZE=0 時關閉；也可直接把 self.cache 設成 None）
+        if cache is None and QUERY_CACHE_SIZE > 0:
+            cache = QueryCache()
+        self.cache = cache
+
+    @property
+    def embedder(self) -> "FileEmbedder":
+        if self._embedder is None:
+            from .file_embedding import FileEmbedder
+            self._embedder = FileEmbedder()
+        return self._embedder
 
-        self.vector_store = VectorStore(vector_db_path)
-        self.embedder = embedder or FileEmbedder()
-        self.reranker = reranker or Reranker()
+    @property
+    def reranker(self) -> "Reranker":
+        if self._reranker is None:
+            from .reranker import Reranker
+            self._reranker = Reranker()
+        return self._reranker
+
+    @property
+    def small_reranker(self) -> "Reranker | None":
+        """
+        cascade rerank 第一段的小模型；沒設定 RERANK_CASCADE_SMALL_MODEL 時為 None
+        """
+        if self._small_reranker is None and RERANK_CASCADE_SMALL_MODEL:
+            from .reranker import Reranker
+            self._small_reranker = Reranker(RERANK_CASCADE_SMALL_MODEL)
+        return self._small_reranker
+
+    def doc_tokenizers(self) -> List[DocTokenizer]:
+        """
+        ingest 時要預先 tokenize 的 tokenizer（embedder、reranker；內容相同的只留一個）。
+        reranker 還沒載入時只載入它的 tokenizer
+        """
+        if self._reranker is not None:
+            rerank_tok = getattr(self._reranker, "doc_tokenizer", None)
+        else:
+            if self._rerank_doc_tokenizer is None:
+                from .reranker import RERANKER_MODEL_NAME
+                self._rerank_doc_tokenizer = DocTokenizer.from_pretrained(RERANKER_MODEL_NAME,
+                                                                          RERANK_MAX_LENGTH)
+            rerank_tok = self._rerank_doc_tokenizer
+        unique = {}
+        for tok in (getattr(self.embedder, "doc_tokenizer", None), rerank_tok):
+            if tok is not None and tok.supported:
+                unique.setdefault(tok.key, tok)
+        return list(unique.values())
+
+    def pretokenize(self, texts: List[str]
+                    ) -> Tuple[List[Tuple[DocTokenizer, List[np.ndarray]]], Optional[List[np.ndarray]]]:
+        """
+        ingest 用：texts 依 doc_tokenizers() 各 tokenize 一次。
+        回傳 ([(tokenizer, token ids)], embedder 可直接用的 token ids 或 None)；TOKEN_STORE 關閉時都是空的
+        """
+        if not TOKEN_STORE or not texts:
+            return [], None
+        tokens = [(tok, tok.tokenize(texts)) for tok in self.doc_tokenizers()]
+        emb_tok = getattr(self.embedder, "doc_tokenizer", None)
+        emb_ids = next((ids for tok, ids in tokens if emb_tok is not None and tok.key == emb_tok.key), None)
+        return tokens, emb_ids
+
+    def warmup(self, rerank: bool = True):
+        """
+        預先載入模型並各跑一次（給 server 啟動時用），避免第一個請求吃到載入時間
+        """
+        embed_query(["warmup"], embedder=self.embedder)
+        if rerank:
+            from .reranker import rerank_many
+
+            rerank_many(["warmup"], [[{"text": "warmup"}]], self.reranker, top_k=1)
+            if RERANK_CASCADE and self.small_reranker is not None:
+                rerank_many(["warmup"], [[{"text": "warmup"}]], self.small_reranker, top_k=1)
 
     # ---------------------------------------------------------
     #  單次建立索引（preprocess 時用）
     # ---------------------------------------------------------
-    def index_files(self, files: List[Dict], max_chars: int = 2000):
-        abstracts = abstract_files(files, max_chars=max_chars)
-        embeddings, metadatas = embed_files(abstracts, embedder=self.embedder)
-        self.vector_store.add_embeddings(embeddings, metadatas)
+    def index_files(self, files: List[Dict], max_chars: int = 2000) -> List[int]:
+        from .file_embedding import embed_files
+
+        ids = []
+        if files:
+            abstracts = abstract_files(files, max_chars=max_chars)
+            tokens, emb_ids = self.pretokenize([a["abstract"] for a in abstracts])
+            embeddings, metadatas = embed_files(abstracts, embedder=self.embedder, token_ids=emb_ids)
+            ids = self.vector_store.add_embeddings(embeddings, metadatas)
+            for tok, token_ids in tokens:
+                self.vector_store.put_tokens(ids, tok, token_ids)
+        # 連同之前的 remove / update 一起落地
+        self.vector_store.commit()
+        return ids
 
     # ---------------------------------------------------------
     #  查詢（主功能：use_rerank 控制是否啟用重排序）
@@ -49,50 +192,348 @@ class RetrieverPipeline:
     def retrieve(self,
                  query: str,
                  top_k: int = None,
-                 use_rerank: bool = DEFAULT_USE_RERANK) -> List[Dict]:
+                 use_rerank: bool = DEFAULT_USE_RERANK,
+                 nprobe: int | None = None,
+                 ef_search: int | None = None,
+                 hybrid: bool = DEFAULT_HYBRID,
+                 filters: Optional[Filters] = None,
+                 cascade: bool | None = None,
+                 stats: Dict | None = None) -> List[Dict]:
         """
         use_rerank=True  →  similarity search → rerank
         use_rerank=False →  similarity search（直接回傳結果）
+        hybrid=True      →  similarity search + BM25，RRF 融合（條號、法規名稱等精確字串較不會漏）
+        nprobe / ef_search：IVF / HNSW index 的單次搜尋參數，用來逐次取捨 recall 與延遲
+        filters：metadata 過濾條件，例如 {"source": "特殊教育法*.pdf", "chunk_id": {"lt": 10}}
+                 （寫法見 retriever/metadata_filter.py）
+        cascade：rerank 時分批打分、提早結束（None = RERANK_CASCADE）
+        stats：傳入 dict 時填入這次查詢的統計（候選數、reranker 實際打分筆數、是否跳過 / 提早結束等）
         """
+        logger.info("retrieve mode: %s%s",
+                    "rerank" if use_rerank else "fast", " + hybrid" if hybrid else "")
 
-        final_top_k = top_k if top_k is not None else RERANK_TOPK
+        query_stats = [] if stats is not None else None
+        results = self._retrieve_batch([query], [top_k], [use_rerank],
+                                       nprobe=nprobe, ef_search=ef_search,
+                                       hybrids=[hybrid], filters=[filters],
+                                       cascades=[cascade], stats=query_stats)[0]
+        if stats is not None:
+            stats.update(query_stats[0])
+        return results
 
-        # 1. Query Expand
-        expanded_queries = expand_query(query)
-        if not expanded_queries:
-            return []
+    def retrieve_many(self,
+                      queries: List[str],
+                      top_k: int | None | List[int | None] = None,
+                      use_rerank: bool | List[bool] = DEFAULT_USE_RERANK,
+                      nprobe: int | None = None,
+                      ef_search: int | None = None,
+                      hybrid: bool | List[bool] = DEFAULT_HYBRID,
+                      filters: Optional[Filters] | List[Optional[Filters]] = None,
+                      cascade: bool | None | List[bool | None] = None,
+                      chunk_size: int | None = RETRIEVE_MANY_CHUNK,
+                      progress: Callable[[int, int], None] | None = None,
+                      stats: List[Dict] | None = None) -> List[List[Dict]]:
+        """
+        大量 query 的批次檢索（離線評估、批次 QA 用），回傳順序同 queries。
 
-        # 2. Encoding Query
-        q_vecs = embed_query(expanded_queries, embedder=self.embedder)
+        每 chunk_size 個 query 一段（None = 全部一次），段內：
+        token 數受限的 batch 一次 embedding、一次多 query 的 index.search、
+        所有 (query, 候選) pair 共用 reranker batch。
+        其餘參數同 retrieve()；top_k / use_rerank / hybrid / filters / cascade 可以是所有 query 共用的值，
+        或與 queries 一一對應的 list（API server 合併不同請求時用）。
+        progress：每段完成後呼叫 progress(已完成 query 數, 總數)
+        stats：傳入 list 時依 queries 順序填入各 query 的統計
+        """
+        total = len(queries)
+        top_ks = _per_query("top_k", top_k, total)
+        use_reranks = _per_query("use_rerank", use_rerank, total)
+        hybrids = _per_query("hybrid", hybrid, total)
+        per_filters = _per_query("filters", filters, total)
+        cascades = _per_query("cascade", cascade, total)
 
-        # 3. Similarity Search
-        candidates = similarity_search(
-            q_vecs,
-            self.vector_store,
-            top_k=SEARCH_TOPK
-        )
+        size = chunk_size or total or 1
+        logger.debug("retrieve_many: %d queries (%d rerank, %d hybrid), chunk %d", total,
+                     sum(map(bool, use_reranks)), sum(map(bool, hybrids)), size)
 
-        # 目前只用第一組 query
-        candidates = candidates[0]
+        results: List[List[Dict]] = []
+        for start in range(0, total, size):
+            end = min(start + size, total)
+            chunk_stats = [] if stats is not None else None
+            results += self._retrieve_batch(queries[start:end], top_ks[start:end],
+                                            use_reranks[start:end],
+                                            nprobe=nprobe, ef_search=ef_search,
+                                            hybrids=hybrids[start:end], filters=per_filters[start:end],
+                                            cascades=cascades[start:end], stats=chunk_stats)
+            if stats is not None:
+                stats.extend(chunk_stats)
+            if progress is not None:
+                progress(end, total)
+        return results
+
+    def _retrieve_batch(self,
+                        queries: List[str],
+                        top_ks: List[int | None],
+                        use_reranks: List[bool],
+                        nprobe: int | None = None,
+                        ef_search: int | None = None,
+                        hybrids: List[bool] | None = None,
+                        filters: List[Optional[Filters]] | None = None,
+                        cascades: List[bool | None] | None = None,
+                        stats: List[Dict] | None = None) -> List[List[Dict]]:
+        """
+        多個 query 共用一次 embedding、一次 index.search、一次（跨 query 的）rerank batch。
+        top_ks / use_reranks / hybrids / filters / cascades 與 queries 一一對應；回傳順序同 queries。
+        過濾條件不同的 query 各自一次 index.search。
+        stats：傳入 list 時依 queries 順序填入各 query 的統計
+        """
+        if hybrids is None:
+            hybrids = [DEFAULT_HYBRID] * len(queries)
+        if filters is None:
+            filters = [None] * len(queries)
+        cascades = [RERANK_CASCADE if c is None else bool(c)
+                    for c in (cascades or [None] * len(queries))]
 
+        with instrument.span("retrieve", queries=len(queries),
+                             rerank=sum(map(bool, use_reranks)), hybrid=sum(map(bool, hybrids))):
+            if self.cache is None:
+                results, query_stats = self._run_stages(queries, top_ks, use_reranks, hybrids,
+                                                        filters, cascades, nprobe, ef_search)
+            else:
+                results, query_stats = self._run_cached(queries, top_ks, use_reranks, hybrids,
+                                                        filters, cascades, nprobe, ef_search)
+        if stats is not None:
+            stats[:] = query_stats
+        return results
+
+    def _run_cached(self, queries, top_ks, use_reranks, hybrids, filters, cascades,
+                    nprobe, ef_search):
+        """
+        先查 exact tier；沒命中的 query 編碼後查 semantic tier；
+        都沒命中的才跑 _run_stages（沿用剛算好的 query 向量），結果寫回快取
+        """
+        version = self.vector_store.version
+        params = [(k if k is not None else RERANK_TOPK, bool(r), bool(h), filter_key(f),
+                   bool(c) and bool(r), nprobe, ef_search)
+                  for k, r, h, f, c in zip(top_ks, use_reranks, hybrids, filters, cascades)]
+
+        results: List[Optional[List[Dict]]] = [self.cache.get(q, p, version)
+                                                for q, p in zip(queries, params)]
+        query_stats: List[Dict] = [{"cache": "exact"} if r is not None else {} for r in results]
+        exact_hits = sum(r is not None for r in results)
+
+        rest = [i for i, r in enumerate(results) if r is None and queries[i].strip()]
+        semantic_hits = 0
+        if rest:
+            with instrument.span("embed_query", queries=len(rest)):
+                vecs = embed_query([queries[i].strip() for i in rest], embedder=self.embedder)
+            todo = []
+            for i, vec in zip(rest, vecs):
+                results[i] = self.cache.get_similar(queries[i], vec, params[i], version)
+                if results[i] is None:
+                    todo.append((i, vec))
+                else:
+                    query_stats[i] = {"cache": "semantic"}
+            semantic_hits = len(rest) - len(todo)
+
+            if todo:
+                idx = [i for i, _ in todo]
+                fresh, fresh_stats = self._run_stages(
+                    [queries[i] for i in idx], [top_ks[i] for i in idx],
+                    [use_reranks[i] for i in idx], [hybrids[i] for i in idx],
+                    [filters[i] for i in idx], [cascades[i] for i in idx], nprobe, ef_search,
+                    known_vecs={queries[i].strip(): vec for i, vec in todo})
+                for (i, vec), res, st in zip(todo, fresh, fresh_stats):
+                    self.cache.put(queries[i], vec, params[i], version, res)
+                    results[i] = res
+                    query_stats[i] = st
+
+        instrument.count("query_cache.hit", exact_hits)
+        instrument.count("query_cache.semantic_hit", semantic_hits)
+        instrument.count("query_cache.miss", len(rest) - semantic_hits)
+        return [r if r is not None else [] for r in results], query_stats
+
+    def _run_stages(self, queries, top_ks, use_reranks, hybrids, filters, cascades,
+                    nprobe, ef_search, known_vecs: Dict[str, np.ndarray] | None = None):
+        """
+        _retrieve_batch 的實際流程（各階段各自一個 span），回傳 (各 query 結果, 各 query 統計)
+        known_vecs：已經算好的 query 向量（文字 → 向量），不再重新編碼
+        """
+        final_top_ks = [k if k is not None else RERANK_TOPK for k in top_ks]
+
+        # 1. Query Expand（記錄每個擴展 query 屬於哪個原始 query；第一個擴展 query 即原始 query）
+        expanded, owners, first = [], [], {}
+        with instrument.span("expand_query"):
+            for i, q in enumerate(queries):
+                for eq in expand_query(q):
+                    first.setdefault(i, len(expanded))
+                    expanded.append(eq)
+                    owners.append(i)
+
+        results: List[List[Dict]] = [[] for _ in queries]
+        query_stats: List[Dict] = [{"candidates": 0, "scored": 0} for _ in queries]
+        if not expanded:
+            return results, query_stats
+
+        # 2. Encoding Query（所有擴展 query 一次 batch 編碼）
+        if known_vecs:
+            todo = [q for q in expanded if q not in known_vecs]
+            if todo:
+                with instrument.span("embed_query", queries=len(todo)):
+                    known_vecs = {**known_vecs,
+                                  **dict(zip(todo, embed_query(todo, embedder=self.embedder)))}
+            q_vecs = np.stack([known_vecs[q] for q in expanded])
+        else:
+            with instrument.span("embed_query", queries=len(expanded)):
+                q_vecs = embed_query(expanded, embedder=self.embedder)
+
+        # 3. Similarity Search（過濾條件相同的 query 一次 index.search）
+        exp_filters = [filters[owner] for owner in owners]
+        hits: List[List[Dict]] = [[] for _ in expanded]
+        groups = _group_by_filter(range(len(expanded)), exp_filters)
+        with instrument.span("similarity_search", queries=len(expanded), top_k=SEARCH_TOPK,
+                             filter_groups=len(groups)):
+            for idx, group_filters in groups:
+                group_hits = similarity_search(
+                    q_vecs[idx],
+                    self.vector_store,
+                    top_k=SEARCH_TOPK,
+                    nprobe=nprobe,
+                    ef_search=ef_search,
+                    filters=group_filters
+                )
+                for j, one_list in zip(idx, group_hits):
+                    hits[j] = one_list
+
+        # 3b. Hybrid：擴展 query 也各跑一次 BM25，和向量結果一起融合
+        sparse_idx = [j for j, owner in enumerate(owners) if hybrids[owner]]
+        sparse_hits: Dict[int, List[Dict]] = {}
+        if sparse_idx:
+            with instrument.span("sparse_search", queries=len(sparse_idx)):
+                for idx, group_filters in _group_by_filter(sparse_idx, exp_filters):
+                    group_hits = sparse_search([expanded[j] for j in idx], self.vector_store,
+                                               filters=group_filters)
+                    sparse_hits.update(zip(idx, group_hits))
+
+        # 4. 融合各原始 query 的擴展結果（依 chunk id 去重），之後只 rerank 一次
+        per_query: List[List[List[Dict]]] = [[] for _ in queries]
+        for owner, one_list in zip(owners, hits):
+            per_query[owner].append(one_list)
+        for j in sparse_idx:
+            per_query[owners[j]].append(sparse_hits[j])
+
+        # BM25 分數與相似度不同尺度，混合時一律用 rrf
+        with instrument.span("fuse_results"):
+            candidates = [fuse_results(lists, method="rrf" if hybrids[i] else QUERY_FUSION,
+                                       top_k=SEARCH_TOPK) if lists else []
+                          for i, lists in enumerate(per_query)]
+        if instrument.enabled():
+            instrument.count("candidates", sum(len(c) for c in candidates))
+        for st, c in zip(query_stats, candidates):
+            st["candidates"] = len(c)
+
+        # ---------------------------------------------------------
+        #  不使用 Reranker：直接依融合後的排序回傳
         # ---------------------------------------------------------
-        #  不使用 Reranker：直接依 similarity 排序後回傳
+        rerank_idx = []
+        for i, use_rerank in enumerate(use_reranks):
+            if use_rerank and candidates[i]:
+                rerank_idx.append(i)
+            else:
+                results[i] = candidates[i][:final_top_ks[i]]
+
+        # ---------------------------------------------------------
+        #  Rerank 前精簡候選：併掉近似重複、MMR 多樣化
         # ---------------------------------------------------------
-        if not use_rerank:
-            print("⚡ 使用快速模式：不執行 Reranker（依 similarity 排序）")
-            ranked = sorted(candidates, key=lambda x: x["score"], reverse=True)
-            return ranked[:final_top_k]
+        if rerank_idx and RERANK_PRUNE:
+            with instrument.span("prune_candidates", queries=len(rerank_idx)) as sp:
+                saved = self._prune(rerank_idx, candidates, q_vecs, first, final_top_ks, query_stats)
+                sp.set(saved=saved)
+            instrument.count("rerank.pruned", saved)
 
         # ---------------------------------------------------------
-        #  使用 Reranker：Cross-Encoder scoring → Sort
+        #  使用 Reranker：所有 query 的 (query, 候選) 共用 batch 打分 → Sort
+        #  cascade 的 query 依序分批打分，前 top_k 穩定就停
         # ---------------------------------------------------------
-        print("🧠 使用精準模式：啟用 Reranker 重新排序")
+        full_idx = [i for i in rerank_idx if not cascades[i]]
+        cascade_idx = [i for i in rerank_idx if cascades[i]]
+        doc_tokens = self._doc_tokens(rerank_idx, candidates) if rerank_idx else None
+        if full_idx:
+            from .reranker import rerank_many
+
+            with instrument.span("rerank", queries=len(full_idx),
+                                 pairs=sum(len(candidates[i]) for i in full_idx)):
+                reranked = rerank_many(
+                    [queries[i] for i in full_idx],
+                    [candidates[i] for i in full_idx],
+                    reranker=self.reranker,
+                    top_k=[final_top_ks[i] for i in full_idx],
+                    doc_tokens=doc_tokens
+                )
+            for i, r in zip(full_idx, reranked):
+                results[i] = r
+                query_stats[i]["scored"] = len(candidates[i])
+            instrument.count("rerank.scored", sum(len(candidates[i]) for i in full_idx))
+
+        if cascade_idx:
+            from .cascade_rerank import cascade_rerank
 
-        reranked_per_query = rerank_results(
-            query,
-            [candidates],
-            reranker=self.reranker,
-            top_k=final_top_k
-        )
+            with instrument.span("cascade_rerank", queries=len(cascade_idx),
+                                 candidates=sum(len(candidates[i]) for i in cascade_idx)) as sp:
+                reranked, cascade_stats = cascade_rerank(
+                    [queries[i] for i in cascade_idx],
+                    [candidates[i] for i in cascade_idx],
+                    reranker=self.reranker,
+                    top_k=[final_top_ks[i] for i in cascade_idx],
+                    small_reranker=self.small_reranker,
+                    doc_tokens=doc_tokens
+                )
+                sp.set(pairs=sum(st["scored"] for st in cascade_stats))
+            for i, r, st in zip(cascade_idx, reranked, cascade_stats):
+                results[i] = r
+                st.pop("candidates")
+                query_stats[i].update(st)
+            instrument.count("rerank.scored", sum(st["scored"] for st in cascade_stats))
+            instrument.count("rerank.skipped", sum(st["skipped"] for st in cascade_stats))
+            instrument.count("rerank.early_exit", sum(st["early_exit"] for st in cascade_stats))
 
-        return reranked_per_query[0] if reranked_per_query else []
\ No newline at end of file
+        return results, query_stats
+
+    def _prune(self, rerank_idx: List[int], candidates: List[List[Dict]],
+               q_vecs, first: Dict[int, int], final_top_ks: List[int],
+               query_stats: List[Dict]) -> int:
+        """
+        就地精簡 candidates[i]（i ∈ rerank_idx），所有 query 的候選向量一次從 vector DB 取回；
+        去重與 MMR 都至少留下該 query 要回傳的筆數。回傳省下的 reranker 次數（各 query 的記在 query_stats）
+        """
+        vids = sorted({c["vid"] for i in rerank_idx for c in candidates[i] if "vid" in c})
+        if not vids:
+            return 0
+        vecs = self.vector_store.get_vectors(vids)
+        row = {vid: r for r, vid in enumerate(vids)}
+
+        saved = 0
+        for i in rerank_idx:
+            if any("vid" not in c for c in candidates[i]):
+                continue
+            rows = [row[c["vid"]] for c in candidates[i]]
+            candidates[i], stats = prune_candidates(candidates[i], vecs[rows], q_vecs[first[i]],
+                                                    max_candidates=RERANK_MAX_CANDIDATES,
+                                                    min_keep=final_top_ks[i])
+            saved += stats["candidates"] - stats["kept"]
+            query_stats[i]["pruned"] = stats["candidates"] - stats["kept"]
+            logger.debug("prune candidates: %s", stats)
+        return saved
+
+    def _doc_tokens(self, rerank_idx: List[int], candidates: List[List[Dict]]
+                    ) -> Dict[int, np.ndarray] | None:
+        """
+        所有要 rerank 的候選一次從 vector DB 讀出 reranker tokenizer 的 token id（vector id → token id）
+        """
+        tokenizer = getattr(self.reranker, "doc_tokenizer", None)
+        if not TOKEN_STORE or tokenizer is None or not tokenizer.supported:
+            return None
+        vids = sorted({c["vid"] for i in rerank_idx for c in candidates[i] if "vid" in c})
+        if not vids:
+            return None
+        with instrument.span("load_doc_tokens", docs=len(vids)):
+            return dict(zip(vids, self.vector_store.get_tokens(vids, tokenizer)))
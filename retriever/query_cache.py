@@ -0,0 +1,175 @@
+# retriever/query_cache.py
+"""
+查詢結果快取（RetrieverPipeline.retrieve 前面的一層）：
+
+- exact tier：key = (正規化後的 query, 查詢參數)，命中時連 embedding 都不用跑
+- semantic tier（選用，QUERY_CACHE_SEMANTIC_THRESHOLD 預設 None = 關閉）：
+  query embedding 與快取中某個 query 的 cosine ≥ QUERY_CACHE_SEMANTIC_THRESHOLD
+  且查詢參數相同時沿用它的結果（換句話說的同一個問題）；
+  每組查詢參數各一個小的 FAISS IndexFlatIP 放過去的 query 向量。
+  法規查詢裡「第184條」和「第185條」的向量幾乎一樣，因此 query 中的數字不同時一律不算命中。
+
+查詢參數 = top_k、use_rerank、hybrid、filters、nprobe、ef_search。
+兩層共用同一份 LRU（QUERY_CACHE_SIZE 筆）與 TTL（QUERY_CACHE_TTL_S 秒），
+並記錄建立時 vector store 的 version：向量 / metadata 有任何變動（version 改變）就整個清空。
+"""
+
+from typing import Dict, Hashable, List, Optional, Tuple
+from collections import OrderedDict
+import copy
+import re
+import threading
+import time
+
+import numpy as np
+import faiss
+
+from config.settings import QUERY_CACHE_SIZE, QUERY_CACHE_TTL_S, QUERY_CACHE_SEMANTIC_THRESHOLD
+from .rerank_cache import normalize_query
+
+_NUMBER_RE = re.compile(r"\d+")
+
+
+class _Entry:
+    __slots__ = ("exact_key", "params", "numbers", "results", "expires")
+
+    def __init__(self, exact_key, params, numbers, results, expires):
+        self.exact_key = exact_key
+        self.params = params
+        self.numbers = numbers
+        self.results = results
+        self.expires = expires
+
+
+class QueryCache:
+    def __init__(self,
+                 max_entries: int = QUERY_CACHE_SIZE,
+                 ttl_s: Optional[float] = QUERY_CACHE_TTL_S,
+                 semantic_threshold: Optional[float] = QUERY_CACHE_SEMANTIC_THRESHOLD):
+        """
+        ttl_s：None = 不過期；semantic_threshold：None = 只用 exact tier
+        """
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.semantic_threshold = semantic_threshold
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()   # entry id → entry（LRU 順序）
+        self._exact: Dict[Tuple, int] = {}                           # exact key → entry id
+        self._vectors: Dict[Hashable, faiss.IndexIDMap2] = {}        # 查詢參數 → 過去 query 的向量
+        self._next_id = 0
+        self._version = None
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    # ---------- 內部 ----------
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._exact.clear()
+            self._vectors.clear()
+            self._version = version
+
+    def _drop(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        self._exact.pop(entry.exact_key, None)
+        index = self._vectors.get(entry.params)
+        if index is not None:
+            index.remove_ids(np.asarray([entry_id], dtype="int64"))
+
+    def _alive(self, entry_id: int) -> Optional[_Entry]:
+        entry = self._entries.get(entry_id)
+        if entry is None:
+            return None
+        if entry.expires is not None and entry.expires < time.monotonic():
+            self._drop(entry_id)
+            return None
+        self._entries.move_to_end(entry_id)
+        return entry
+
+    @staticmethod
+    def _copy(results: List[Dict]) -> List[Dict]:
+        # 呼叫端可能改動回傳的 dict，快取裡留一份自己的
+        return copy.deepcopy(results)
+
+    # ---------- 對外介面 ----------
+
+    def get(self, query: str, params: Hashable, version) -> Optional[List[Dict]]:
+        """
+        exact tier 查詢；沒命中回傳 None
+        """
+        with self._lock:
+            self._check_version(version)
+            entry_id = self._exact.get((normalize_query(query), params))
+            entry = self._alive(entry_id) if entry_id is not None else None
+            if entry is None:
+                return None
+            self.hits += 1
+            return self._copy(entry.results)
+
+    def get_similar(self, query: str, query_vec: np.ndarray, params: Hashable, version
+                    ) -> Optional[List[Dict]]:
+        """
+        semantic tier 查詢（query_vec 需已 L2 normalize）；沒命中回傳 None 並計一次 miss
+        """
+        with self._lock:
+            self._check_version(version)
+            index = self._vectors.get(params)
+            if self.semantic_threshold is not None and index is not None and index.ntotal:
+                numbers = _NUMBER_RE.findall(normalize_query(query))
+                scores, ids = index.search(np.asarray(query_vec, dtype="float32").reshape(1, -1),
+                                           min(4, index.ntotal))
+                for score, entry_id in zip(scores[0], ids[0]):
+                    if entry_id < 0 or score < self.semantic_threshold:
+                        break
+                    entry = self._alive(int(entry_id))
+                    if entry is not None and entry.numbers == numbers:
+                        self.semantic_hits += 1
+                        return self._copy(entry.results)
+            self.misses += 1
+            return None
+
+    def put(self, query: str, query_vec: Optional[np.ndarray], params: Hashable, version,
+            results: List[Dict]):
+        if self.max_entries <= 0:
+            return
+        normalized = normalize_query(query)
+        with self._lock:
+            self._check_version(version)
+            exact_key = (normalized, params)
+            if exact_key in self._exact:
+                self._drop(self._exact[exact_key])
+
+            entry_id = self._next_id
+            self._next_id += 1
+            expires = time.monotonic() + self.ttl_s if self.ttl_s is not None else None
+            self._entries[entry_id] = _Entry(exact_key, params, _NUMBER_RE.findall(normalized),
+                                             self._copy(results), expires)
+            self._exact[exact_key] = entry_id
+
+            if query_vec is not None and self.semantic_threshold is not None:
+                vec = np.asarray(query_vec, dtype="float32").reshape(1, -1)
+                index = self._vectors.get(params)
+                if index is None:
+                    index = self._vectors[params] = faiss.IndexIDMap2(faiss.IndexFlatIP(vec.shape[1]))
+                index.add_with_ids(vec, np.asarray([entry_id], dtype="int64"))
+
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._check_version(object())
+
+    def stats(self) -> Dict:
+        total = self.hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / total if total else 0.0,
+        }
@@ -5,15 +5,18 @@ Query Embedding 模組：
 為了一致性，沿用 FileEmbedder。
 """
 
-from typing import List
+from typing import List, TYPE_CHECKING
 import numpy as np
-from .file_embedding import FileEmbedder
 
-def embed_query(queries: List[str], embedder: FileEmbedder | None = None) -> np.ndarray:
+if TYPE_CHECKING:
+    from .file_embedding import FileEmbedder
+
+def embed_query(queries: List[str], embedder: "FileEmbedder | None" = None) -> np.ndarray:
     """
     輸入：多個 query 字串
     輸出：np.ndarray (num_queries, dim)
     """
     if embedder is None:
+        from .file_embedding import FileEmbedder
         embedder = FileEmbedder()
     return embedder.encode(queries)
@@ -0,0 +1,153 @@
+# retriever/rerank_cache.py
+"""
+Rerank 分數快取：
+key = (正規化後的 query, chunk 內容 hash, reranker model id)，value = cross-encoder 分數。
+
+兩層：
+- 記憶體 LRU（OrderedDict）
+- 可選的 SQLite 磁碟層（重啟後仍有效，多個 process 可共用）
+
+磁碟層記錄建立時的 model id，換模型後開啟時自動清空；
+記憶體層的 key 本身就含 model id，不會拿到別的模型的分數。
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+from config.settings import RERANK_CACHE_SIZE, RERANK_CACHE_PATH, RERANK_CACHE_DISK_MAX
+from utils.hashing import text_hash
+
+
+def normalize_query(query: str) -> str:
+    """
+    全形 / 半形統一、去頭尾空白與結尾問號句號、合併多重空白、英文轉小寫
+    """
+    query = unicodedata.normalize("NFKC", query).strip().lower()
+    query = re.sub(r"\s+", " ", query)
+    return query.rstrip("?？。.!！ ")
+
+
+class RerankCache:
+    def __init__(self,
+                 model_id: str,
+                 max_entries: int = RERANK_CACHE_SIZE,
+                 path: Optional[str] = RERANK_CACHE_PATH,
+                 disk_max_entries: int = RERANK_CACHE_DISK_MAX):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+
+        self._lru: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            self._open_disk(path)
+
+    # ---------- 磁碟層 ----------
+
+    def _open_disk(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS info (k TEXT PRIMARY KEY, v TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL)")
+
+        row = self._db.execute("SELECT v FROM info WHERE k = 'model_id'").fetchone()
+        if row is None or row[0] != self.model_id:
+            # 模型換了 → 舊分數全部作廢
+            self._db.execute("DELETE FROM scores")
+            self._db.execute("INSERT OR REPLACE INTO info VALUES ('model_id', ?)", (self.model_id,))
+        self._db.commit()
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, float]:
+        found = {}
+        for i in range(0, len(keys), 500):    # SQLite 參數數量有上限
+            part = keys[i:i + 500]
+            marks = ",".join("?" * len(part))
+            found.update(self._db.execute(
+                f"SELECT key, score FROM scores WHERE key IN ({marks})", part).fetchall())
+        return found
+
+    def _disk_put(self, items: List[Tuple[str, float]]):
+        self._db.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?)", items)
+        count = self._db.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        if count > self.disk_max_entries:
+            self._db.execute(
+                "DELETE FROM scores WHERE rowid IN "
+                "(SELECT rowid FROM scores ORDER BY rowid LIMIT ?)",
+                (count - self.disk_max_entries,))
+        self._db.commit()
+
+    # ---------- 對外介面 ----------
+
+    def key(self, query: str, doc: str) -> str:
+        raw = f"{self.model_id}\0{normalize_query(query)}\0{text_hash(doc)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, float]:
+        """
+        回傳有命中的 {key: score}；磁碟層命中的會放回記憶體層
+        """
+        found: Dict[str, float] = {}
+        with self._lock:
+            for k in keys:
+                if k in self._lru:
+                    self._lru.move_to_end(k)
+                    found[k] = self._lru[k]
+
+            rest = [k for k in keys if k not in found]
+            if rest and self._db is not None:
+                from_disk = self._disk_get(rest)
+                self.disk_hits += len(from_disk)
+                found.update(from_disk)
+                self._lru_put(from_disk.items())
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, float]]):
+        items = list(items)
+        with self._lock:
+            self._lru_put(items)
+            if self._db is not None and items:
+                self._disk_put(items)
+
+    def _lru_put(self, items: Iterable[Tuple[str, float]]):
+        for k, v in items:
+            self._lru[k] = v
+            self._lru.move_to_end(k)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "entries": len(self._lru),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM scores")
+                self._db.commit()
@@ -3,17 +3,47 @@
 Files Reranking 模組：
 使用 Cross-Encoder / Reranker (例如 Qwen3-Reranker) 重新排序候選文件，
 讓與 query 最相關的文件排在前面。
+RERANK_BACKEND = "onnx" 時 forward 改用 ONNX Runtime（見 retriever/onnx_backend.py）。
+有候選文件預先 tokenize 好的 token id 時（retriever/token_store.py），直接與 query 的 token id 接起來，不再 tokenize 原文。
 """
 
-from typing import List, Dict
+from typing import List, Dict, Optional
+import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
+from config.settings import (
+    RERANK_MAX_LENGTH, RERANK_BATCH_TOKENS, RERANK_CACHE_SIZE,
+    RERANK_BACKEND, ONNX_QUANTIZE,
+)
+from utils.batching import token_budget_batches
+from utils import instrument
+from .onnx_backend import BACKENDS, load_onnx_model
+from .rerank_cache import RerankCache
+from .token_store import DocTokenizer
+
 RERANKER_MODEL_NAME = "Qwen/Qwen3-Reranker-4B"
 
 class Reranker:
-    def __init__(self, model_name: str = RERANKER_MODEL_NAME):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, model_name: str = RERANKER_MODEL_NAME,
+                 cache: RerankCache | None = None,
+                 backend: str = RERANK_BACKEND,
+                 quantize: bool = ONNX_QUANTIZE):
+        """
+        backend："torch"（HF 模型）/ "onnx"（ONNX Runtime CPU；quantize → int8）
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的 backend：{backend}（可用：{', '.join(BACKENDS)}）")
+        self.backend = backend
+        self.device = "cuda" if torch.cuda.is_available() and backend == "torch" else "cpu"
+        self.model_name = model_name
+
+        # 分數快取：只有 cache miss 才跑模型（RERANK_CACHE_SIZE=0 時關閉）
+        # int8 的分數和原模型略有不同，快取要分開
+        if cache is None and RERANK_CACHE_SIZE > 0:
+            model_id = model_name if backend == "torch" else f"{model_name}@onnx{'-int8' if quantize else ''}"
+            cache = RerankCache(model_id)
+        self.cache = cache
 
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
 
@@ -22,38 +52,135 @@ class Reranker:
             print("⚠️  Reranker tokenizer 沒有 pad_token，自動設定為 eos_token")
             self.tokenizer.pad_token = self.tokenizer.eos_token
 
+        # 左側 padding：每一列真正的最後一個 token 都在位置 -1，
+        # 模型取「最後一個非 pad token」的 logit 時不會讀到 pad 位置
+        self.tokenizer.padding_side = "left"
+        self.doc_tokenizer = DocTokenizer(self.tokenizer, RERANK_MAX_LENGTH)
+
+        if backend == "onnx":
+            self.model = load_onnx_model(model_name, "reranker", quantize=quantize,
+                                         pad_token_id=self.tokenizer.pad_token_id)
+            return
+
+        # float16 只在 GPU 上划算，CPU 上多半更慢（部分運算不支援）
         self.model = AutoModelForSequenceClassification.from_pretrained(
             model_name,
-            torch_dtype=torch.float16,
+            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
             device_map="auto"
         )
+        # 沒設 pad_token_id 時 HF 的 sequence classification 不接受 batch > 1
+        self.model.config.pad_token_id = self.tokenizer.pad_token_id
         self.model.eval()
 
+    def _forward(self, inputs) -> torch.Tensor:
+        """
+        回傳 logits (batch, num_labels)
+        """
+        if self.backend == "onnx":
+            return torch.from_numpy(self.model(inputs["input_ids"].numpy(),
+                                               inputs["attention_mask"].numpy()))
+        return self.model(**inputs).logits
+
+    def score(self, query: str, docs: List[str],
+              batch_tokens: int = RERANK_BATCH_TOKENS) -> List[float]:
+        """
+        同一個 query 對多份文件打分
+        """
+        return self.score_pairs([query] * len(docs), docs, batch_tokens)
+
+    def score_pairs(self, queries: List[str], docs: List[str],
+                    batch_tokens: int = RERANK_BATCH_TOKENS,
+                    doc_tokens: Optional[List[Optional[np.ndarray]]] = None) -> List[float]:
+        """
+        對 (queries[i], docs[i]) 逐對打分，不同 query 的 pair 共用同一批 batch。
+        先查快取，只對 cache miss 的 pair 跑模型，新分數再寫回快取
+        doc_tokens：與 docs 對應、用 self.doc_tokenizer 預先 tokenize 的 token id（None = 沒有，照常 tokenize）
+        """
+        if self.cache is None or not docs:
+            return self._score_batched(queries, docs, batch_tokens, doc_tokens)
+
+        keys = [self.cache.key(q, d) for q, d in zip(queries, docs)]
+        cached = self.cache.get_many(keys)
+
+        miss = [i for i, k in enumerate(keys) if k not in cached]
+        instrument.count("rerank_cache.hit", len(keys) - len(miss))
+        instrument.count("rerank_cache.miss", len(miss))
+        if miss:
+            new_scores = self._score_batched([queries[i] for i in miss],
+                                             [docs[i] for i in miss], batch_tokens,
+                                             [doc_tokens[i] for i in miss] if doc_tokens else None)
+            fresh = {keys[i]: s for i, s in zip(miss, new_scores)}
+            self.cache.put_many(fresh.items())
+            cached.update(fresh)
+
+        return [cached[k] for k in keys]
+
+    def _join_tokens(self, queries: List[str], docs: List[str],
+                     doc_tokens: List[Optional[np.ndarray]]) -> List[np.ndarray]:
+        """
+        query 的 token id（每個不同的 query 只 tokenize 一次）+ 候選的 token id → 完整輸入序列；
+        沒有預先 tokenize 的候選在這裡補 tokenize，query 與文件都超長（截斷結果無法還原）的 pair 直接 tokenize 原文
+        """
+        unique = list(dict.fromkeys(queries))
+        q_ids = dict(zip(unique, self.doc_tokenizer.tokenize(unique, truncate=False)))
+        missing = [i for i, ids in enumerate(doc_tokens) if ids is None]
+        if missing:
+            doc_tokens = list(doc_tokens)
+            for i, ids in zip(missing, self.doc_tokenizer.tokenize([docs[i] for i in missing])):
+                doc_tokens[i] = ids
+
+        seqs = self.doc_tokenizer.pair([q_ids[q] for q in queries], doc_tokens)
+        for i, (q, ids) in enumerate(zip(queries, doc_tokens)):
+            if not self.doc_tokenizer.exact(q_ids[q], ids):
+                seqs[i] = np.asarray(self.tokenizer(q, docs[i], truncation=True,
+                                                    max_length=RERANK_MAX_LENGTH)["input_ids"])
+        return seqs
+
     @torch.no_grad()
-    def score(self, query: str, docs: List[str]):
+    def _score_batched(self, queries: List[str], docs: List[str],
+                       batch_tokens: int = RERANK_BATCH_TOKENS,
+                       doc_tokens: Optional[List[Optional[np.ndarray]]] = None) -> List[float]:
         """
-        逐筆 scoring：避免 batch > 1 的 padding 問題。
-        並且 Qwen3-Reranker 輸出 logits=[neg, pos]，要取 pos 作為最佳相關分數。
+        批次 scoring：
+        1. 先不 padding 地 tokenize 全部 (query, doc)，取得各自長度
+           （有 doc_tokens 時改成只 tokenize query，再用 NumPy 接上候選的 token id）
+        2. 依長度分桶，每個 batch padding 後不超過 batch_tokens 個 token
+        3. 左側 padding 後一次 forward，分數依原順序放回
+
+        Qwen3-Reranker 輸出 logits=[neg, pos]，取最後一維（pos）作為相關分數。
         """
-        scores = []
+        if not docs:
+            return []
 
-        for doc in docs:
-            enc = self.tokenizer(
-                query,
-                doc,
+        if doc_tokens is not None and self.doc_tokenizer.supported:
+            with instrument.span("rerank.join_tokens", pairs=len(docs)):
+                seqs = self._join_tokens(queries, docs, doc_tokens)
+            lengths = [len(ids) for ids in seqs]
+            make_inputs = lambda batch: self.doc_tokenizer.pad([seqs[i] for i in batch])
+        else:
+            with instrument.span("rerank.tokenize", pairs=len(docs)):
+                enc = self.tokenizer(
+                    list(queries),
+                    list(docs),
+                    truncation=True,
+                    max_length=RERANK_MAX_LENGTH,
+                )
+            lengths = [len(ids) for ids in enc["input_ids"]]
+            make_inputs = lambda batch: self.tokenizer.pad(
+                [{k: enc[k][i] for k in enc.keys()} for i in batch],
                 padding=True,
-                truncation=True,
-                max_length=512,
                 return_tensors="pt"
-            ).to(self.model.device)
+            )
 
-            out = self.model(**enc)
+        scores = [0.0] * len(docs)
+        for batch in token_budget_batches(lengths, batch_tokens):
+            inputs = make_inputs(batch).to(self.device if self.backend == "onnx" else self.model.device)
 
-            # logits shape: [1, 2]
-            #    logits[0][1] = positive relevance score
-            logit = out.logits[0][1].item()  # <--- 修正重點在這一行！
-
-            scores.append(float(logit))
+            with instrument.span("rerank.forward", batch=len(batch),
+                                 padded_tokens=int(inputs["input_ids"].numel())):
+                logits = self._forward(inputs)
+                for i, s in zip(batch, logits[:, -1].float().tolist()):
+                    scores[i] = s
 
         return scores
 
@@ -67,27 +194,68 @@ def rerank_results(query: str,
     對 similarity_search 回傳的候選文件進行 rerank。
 
     輸入：
-        query: 原始 query（這裡假設只有一個 query，若未來支援多個可再改）
+        query: 原始 query（一律用原始問句對候選打分）
         candidates_per_query: List[ List[{"score": float, "abstract": str, ...}] ]
-                - 目前 pipeline 會只用第一個 query 的候選，所以取 index 0。
+                - pipeline 會先用 fuse_results() 把擴展 query 的結果合併成一份，
+                  所以通常只有一組，reranker 對每個候選只跑一次。
     輸出：
-        reranked: List[ List[dict] ]
+        reranked: List[ List[dict] ]（與輸入一一對應）
     """
+    if not candidates_per_query:
+        return []
+
     if reranker is None:
         reranker = Reranker()
 
-    if not candidates_per_query:
-        return []
+    results = []
+    for candidates in candidates_per_query:
+        if not candidates:
+            results.append([])
+            continue
+
+        docs = [c.get("abstract") or c.get("text") for c in candidates]
+        scores = reranker.score(query, docs)
+
+        for c, s in zip(candidates, scores):
+            c["rerank_score"] = s
+
+        reranked = sorted(candidates, key=lambda x: x["rerank_score"], reverse=True)
+        results.append(reranked[:top_k])
 
-    candidates = candidates_per_query[0]
-    if not candidates:
-        return [[]]
+    return results
+
+
+def rerank_many(queries: List[str],
+                candidates_per_query: List[List[Dict]],
+                reranker: Reranker,
+                top_k: int | List[int] = 10,
+                doc_tokens: Dict[int, np.ndarray] | None = None
+                ) -> List[List[Dict]]:
+    """
+    多個 query 一起 rerank：所有 (query, 候選) pair 攤平後一起分桶打分，
+    不同 query 的 pair 共用 batch，結果依 query 拆回並各自排序。
+    top_k 可以是單一數字或每個 query 各自的數字。
+    doc_tokens：vector id → 預先 tokenize 的 token id（依候選的 "vid" 查）
+    """
+    top_ks = top_k if isinstance(top_k, list) else [top_k] * len(queries)
 
-    docs = [c.get("abstract") or c.get("text") for c in candidates]
-    scores = reranker.score(query, docs)
+    pair_queries, pair_docs = [], []
+    for q, candidates in zip(queries, candidates_per_query):
+        for c in candidates:
+            pair_queries.append(q)
+            pair_docs.append(c.get("abstract") or c.get("text"))
 
-    for c, s in zip(candidates, scores):
-        c["rerank_score"] = s
+    pair_tokens = None
+    if doc_tokens is not None:
+        pair_tokens = [doc_tokens.get(c.get("vid")) for candidates in candidates_per_query
+                       for c in candidates]
+    scores = iter(reranker.score_pairs(pair_queries, pair_docs, doc_tokens=pair_tokens)
+                  if pair_docs else [])
 
-    reranked = sorted(candidates, key=lambda x: x["rerank_score"], reverse=True)
-    return [reranked[:top_k]]
+    results = []
+    for candidates, k in zip(candidates_per_query, top_ks):
+        for c in candidates:
+            c["rerank_score"] = next(scores)
+        reranked = sorted(candidates, key=lambda x: x["rerank_score"], reverse=True)
+        results.append(reranked[:k])
+    return results
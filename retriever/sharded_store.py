@@ -0,0 +1,432 @@
+# retriever/sharded_store.py
+"""
+Sharded Vector Store：
+把向量分散到 N 個 shard，每個 shard 是一個獨立的 VectorStore（各自的 index / meta / WAL），
+查詢時用 thread pool 平行搜尋所有 shard（FAISS 搜尋時會釋放 GIL），再以 heap 合併各 shard 的 top-k。
+
+檔案配置（以 index_path = data/vector_db/index.faiss 為例）：
+    index.faiss.shards.json     shard 數與放置方式
+    index.faiss.shard0 ...      各 shard 的 VectorStore（連同 .meta.json / .wal / .f32）
+    index.faiss.bm25.npz        全域 BM25（跨 shard 統一 IDF，分數才可比較）
+
+放置方式（placement）：
+- "source"：依 metadata 的 source（文件）分配，同一份文件的 chunk 都在同一個 shard，
+            刪除 / 同步某份文件只會動到一個 shard
+- "hash"  ：依 chunk id 分配，分布最平均
+
+全域 vector id = shard 內的 id × N + shard 編號，id 在各 shard 內本來就穩定，不需要額外的對照表；
+每個 shard 也因此可以單獨開啟、由不同 process 各自建立（見 open_shard() / shard_of()）。
+
+shards.json 在第一次寫入時才建立（只開啟不寫入不會留下檔案）。
+既有未分片的 vector DB（index.faiss.meta.json）在第一次以分片方式開啟時會搬進各 shard：
+各 shard commit 之後才寫 shards.json、再刪除原本的檔案（先刪 meta.json）；
+中途中斷時 meta.json 還在，下次開啟會清空 shard 重新搬。
+
+對外介面與 VectorStore 相同，similarity_search() / RetrieverPipeline 不需要修改。
+"""
+
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import json
+import logging
+import os
+import shutil
+import zlib
+
+import numpy as np
+
+from config.settings import (
+    VECTOR_SHARDS, SHARD_PLACEMENT, SHARD_SEARCH_WORKERS, SPARSE_TOPK, VECTOR_STORE_FLUSH_ROWS,
+)
+from .bm25 import BM25Index
+from .metadata_filter import Filters
+from .token_store import DocTokenizer
+from .vector_store import VectorStore
+
+PLACEMENTS = ("source", "hash")
+
+logger = logging.getLogger(__name__)
+
+
+def shards_config_path(index_path: str) -> str:
+    return index_path + ".shards.json"
+
+
+def shard_path(index_path: str, shard: int) -> str:
+    return f"{index_path}.shard{shard}"
+
+
+def is_sharded(index_path: str) -> bool:
+    """
+    open_vector_store() 是否會開成 ShardedVectorStore：已有 shards.json 或 VECTOR_SHARDS > 1
+    """
+    return os.path.exists(shards_config_path(index_path)) or VECTOR_SHARDS > 1
+
+
+def open_vector_store(index_path: str, **kwargs):
+    """
+    依設定 / 既有檔案開啟 vector store：is_sharded() → ShardedVectorStore，否則是單一 VectorStore
+    """
+    if is_sharded(index_path):
+        return ShardedVectorStore(index_path, **kwargs)
+    return VectorStore(index_path, **kwargs)
+
+
+def drop_unsharded(index_path: str):
+    """
+    刪除同一路徑上未分片 VectorStore 的檔案（搬移完成後，或 full rebuild 不需要搬移時）。
+    meta.json 最先刪：它是「還有未搬的舊資料」的標記，其餘檔案刪到一半中斷也不會再被讀取
+    """
+    for suffix in (".meta.json", "", ".wal", ".f32"):
+        if os.path.exists(index_path + suffix):
+            os.remove(index_path + suffix)
+    if os.path.isdir(index_path + ".tok"):
+        shutil.rmtree(index_path + ".tok")
+
+
+class _MergedMetadatas(Mapping):
+    """
+    全域 vector id → metadata 的唯讀視圖（直接查各 shard，不另外複製一份）
+    """
+
+    def __init__(self, store: "ShardedVectorStore"):
+        self._store = store
+
+    def __getitem__(self, gid: int) -> Dict:
+        shard, local = self._store._split_id(gid)
+        return self._store.shards[shard].metadatas[local]
+
+    def __contains__(self, gid) -> bool:
+        shard, local = self._store._split_id(gid)
+        return local in self._store.shards[shard].metadatas
+
+    def __iter__(self) -> Iterator[int]:
+        for s, shard in enumerate(self._store.shards):
+            for local in shard.metadatas:
+                yield self._store._join_id(s, local)
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._store.shards)
+
+
+class _ShardWriter:
+    """
+    open_shard() 回傳的 shard：其餘操作直接交給該 shard 的 VectorStore，
+    add_embeddings() 先檢查每筆 metadata 確實屬於這個 shard（shard_of）
+    """
+
+    def __init__(self, store: "ShardedVectorStore", shard: int):
+        self._store = store
+        self._shard = shard
+        self._target = store.shards[shard]
+
+    def add_embeddings(self, embeddings: np.ndarray, metadatas: List[Dict]) -> List[int]:
+        wrong = [m.get("id") for m in metadatas if self._store.shard_of(m) != self._shard]
+        if wrong:
+            raise ValueError(f"{len(wrong)} 筆 chunk 不屬於 shard {self._shard}"
+                             f"（例如 {wrong[0]}），請依 shard_of() 分配")
+        return self._target.add_embeddings(embeddings, metadatas)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def __len__(self) -> int:
+        return len(self._target)
+
+
+class ShardedVectorStore:
+    def __init__(self, index_path: str,
+                 num_shards: int = VECTOR_SHARDS,
+                 placement: str = SHARD_PLACEMENT,
+                 search_workers: Optional[int] = SHARD_SEARCH_WORKERS,
+                 **store_kwargs):
+        """
+        num_shards / placement：建立新 store 時使用；已存在的以 shards.json 為準
+        store_kwargs：傳給每個 shard 的 VectorStore（index_type、storage 等）
+        """
+        self.index_path = index_path
+        self.config_path = shards_config_path(index_path)
+        self.bm25_path = index_path + ".bm25.npz"
+
+        self._config_saved = os.path.exists(self.config_path)
+        self._migrating = False
+        if self._config_saved:
+            with open(self.config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+            num_shards, placement = config["num_shards"], config["placement"]
+        else:
+            if placement not in PLACEMENTS:
+                raise ValueError(f"未知的 placement：{placement}（可用：{', '.join(PLACEMENTS)}）")
+            if num_shards < 1:
+                raise ValueError("num_shards 至少為 1")
+
+        self.num_shards = num_shards
+        self.placement = placement
+        self.shards = [VectorStore(shard_path(index_path, i), **store_kwargs)
+                       for i in range(num_shards)]
+        self.metadatas = _MergedMetadatas(self)
+        self._pool = ThreadPoolExecutor(max_workers=search_workers or num_shards,
+                                        thread_name_prefix="shard-search")
+
+        self.bm25: Optional[BM25Index] = None
+        self._bm25_stale = True
+        if os.path.exists(self.bm25_path):
+            self.bm25 = BM25Index.load(self.bm25_path)
+            self._bm25_stale = set(self.bm25.doc_ids.tolist()) != set(self.metadatas)
+
+        # shards.json 已在但舊 meta.json 還沒刪 = 上次搬移中斷，重新搬
+        if os.path.exists(index_path + ".meta.json"):
+            self._migrate_unsharded(store_kwargs)
+
+    def __len__(self) -> int:
+        return len(self.metadatas)
+
+    def _save_config(self):
+        """
+        第一次寫入任何 shard 前才建立 shards.json（搬移舊資料時等全部 commit 後才寫）
+        """
+        if self._config_saved or self._migrating:
+            return
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        tmp = self.config_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"num_shards": self.num_shards, "placement": self.placement}, f)
+        os.replace(tmp, self.config_path)
+        self._config_saved = True
+
+    def _migrate_unsharded(self, store_kwargs: Dict, batch_rows: int = VECTOR_STORE_FLUSH_ROWS):
+        """
+        同一路徑已有未分片的 VectorStore：依 shard_of() 把向量與 metadata 搬進各 shard。
+        順序：清空 shard → 搬移 → commit → 寫 shards.json → 刪舊檔；
+        任何一步中斷時舊的 meta.json 都還在，下次開啟會從頭重搬。
+        向量用 get_vectors() 取回（IVF-PQ 是量化後的近似值）；token id 不搬，查詢時會重新 tokenize 補上。
+        """
+        legacy = VectorStore(self.index_path, **store_kwargs)
+        if legacy.index is None and len(legacy):
+            raise ValueError(f"{self.index_path} 只有 metadata、沒有向量，無法搬進 shard；"
+                             f"請執行 python preprocess_data.py 重新建立 vector DB")
+        logger.info("migrating unsharded vector DB %s (%d vectors) into %d shards",
+                    self.index_path, len(legacy), self.num_shards)
+
+        self._migrating = True
+        try:
+            for shard in self.shards:
+                shard.reset()
+            ids = list(legacy.metadatas)
+            for start in range(0, len(ids), batch_rows):
+                batch = ids[start:start + batch_rows]
+                self.add_embeddings(legacy.get_vectors(batch), [legacy.metadatas[i] for i in batch])
+            self.commit(compact=True)
+        finally:
+            self._migrating = False
+        self._save_config()
+
+        drop_unsharded(self.index_path)
+        # 同路徑的 BM25 是舊的 id，用新的全域 id 重建
+        if legacy.bm25 is not None or self.bm25 is not None:
+            self.build_bm25()
+
+    @property
+    def version(self) -> int:
+        # 各 shard 的 version 只會遞增，總和改變 ⇔ 某個 shard 有變動
+        return sum(shard.version for shard in self.shards)
+
+    # ---------- id / 放置 ----------
+
+    def _split_id(self, gid: int) -> Tuple[int, int]:
+        return gid % self.num_shards, gid // self.num_shards
+
+    def _join_id(self, shard: int, local: int) -> int:
+        return local * self.num_shards + shard
+
+    def shard_of(self, meta: Dict) -> int:
+        """
+        這筆 metadata 應該放在哪個 shard（crc32，跨 process / 重啟都穩定）
+        """
+        key = meta.get("source") if self.placement == "source" else None
+        key = key if key is not None else meta.get("id", "")
+        return zlib.crc32(str(key).encode("utf-8")) % self.num_shards
+
+    def open_shard(self, shard: int) -> VectorStore:
+        """
+        單獨建立某個 shard 用（例如每個 shard 由不同 process 平行 ingest）。
+        直接寫入 shard 時不經過 shard_of()：呼叫端必須只寫入 shard_of(meta) == shard 的 chunk，
+        否則 placement="source" 的「同一文件在同一 shard」不成立；寫入時會檢查，放錯 shard 直接報錯。
+        回傳的 VectorStore 用的是 shard 內的 id，全域 id = shard 內 id × num_shards + shard。
+        """
+        self._save_config()
+        return _ShardWriter(self, shard)
+
+    def _group(self, gids: Iterable[int]) -> Dict[int, List[int]]:
+        """
+        全域 id → {shard: [shard 內 id]}
+        """
+        groups: Dict[int, List[int]] = {}
+        for gid in gids:
+            shard, local = self._split_id(gid)
+            groups.setdefault(shard, []).append(local)
+        return groups
+
+    # ---------- 寫入 ----------
+
+    def add_embeddings(self, embeddings: np.ndarray, metadatas: List[Dict]) -> List[int]:
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        metadatas = list(metadatas)
+        if len(metadatas) == 0:
+            return []
+        # shard 累積到 flush_rows 時會自己寫入 log，shards.json 要先落地
+        self._save_config()
+
+        placement = np.fromiter((self.shard_of(m) for m in metadatas), dtype="int64",
+                                count=len(metadatas))
+        gids = [0] * len(metadatas)
+        for s in np.unique(placement):
+            rows = np.flatnonzero(placement == s)
+            local_ids = self.shards[s].add_embeddings(embeddings[rows], [metadatas[i] for i in rows])
+            for i, local in zip(rows, local_ids):
+                gids[i] = self._join_id(int(s), local)
+        self._bm25_stale = True
+        return gids
+
+    def remove_ids(self, ids: Iterable[int]) -> int:
+        removed = sum(self.shards[s].remove_ids(local) for s, local in self._group(ids).items())
+        if removed:
+            self._bm25_stale = True
+        return removed
+
+    def update_metadata(self, updates: Dict[int, Dict]):
+        per_shard: Dict[int, Dict[int, Dict]] = {}
+        for gid, meta in updates.items():
+            shard, local = self._split_id(gid)
+            per_shard.setdefault(shard, {})[local] = meta
+        for s, shard_updates in per_shard.items():
+            self.shards[s].update_metadata(shard_updates)
+
+    def find_ids(self, **match) -> List[int]:
+        return [self._join_id(s, local)
+                for s, shard in enumerate(self.shards) for local in shard.find_ids(**match)]
+
+    def get_vectors(self, ids: Iterable[int]) -> np.ndarray:
+        ids = list(ids)
+        dim = next((s.dim for s in self.shards if s.dim), None) or 0
+        out = np.zeros((len(ids), dim), dtype="float32")
+        positions: Dict[int, List[int]] = {}
+        for pos, gid in enumerate(ids):
+            positions.setdefault(self._split_id(gid)[0], []).append(pos)
+        for s, local in self._group(ids).items():
+            out[positions[s]] = self.shards[s].get_vectors(local)
+        return out
+
+    def put_tokens(self, ids: List[int], tokenizer: DocTokenizer, token_ids: List[np.ndarray]):
+        by_shard: Dict[int, Tuple[List[int], List[np.ndarray]]] = {}
+        for gid, tokens in zip(ids, token_ids):
+            s, local = self._split_id(gid)
+            shard_ids, shard_tokens = by_shard.setdefault(s, ([], []))
+            shard_ids.append(local)
+            shard_tokens.append(tokens)
+        for s, (local, tokens) in by_shard.items():
+            self.shards[s].put_tokens(local, tokenizer, tokens)
+
+    def get_tokens(self, ids: Iterable[int], tokenizer: DocTokenizer) -> List[np.ndarray]:
+        ids = list(ids)
+        out: List[Optional[np.ndarray]] = [None] * len(ids)
+        positions: Dict[int, List[int]] = {}
+        for pos, gid in enumerate(ids):
+            positions.setdefault(self._split_id(gid)[0], []).append(pos)
+        for s, local in self._group(ids).items():
+            for pos, tokens in zip(positions[s], self.shards[s].get_tokens(local, tokenizer)):
+                out[pos] = tokens
+        return out
+
+    def train(self, vecs: np.ndarray):
+        for shard in self.shards:
+            shard.train(vecs)
+
+    def flush(self):
+        self._save_config()
+        for shard in self.shards:
+            shard.flush()
+
+    def commit(self, compact: bool = False):
+        self._save_config()
+        for shard in self.shards:
+            shard.commit(compact=compact)
+
+    def compact(self):
+        self._save_config()
+        for shard in self.shards:
+            shard.compact()
+
+    def reset(self):
+        for shard in self.shards:
+            shard.reset()
+        self.bm25 = None
+        self._bm25_stale = True
+        if os.path.exists(self.bm25_path):
+            os.remove(self.bm25_path)
+
+    # ---------- 搜尋 ----------
+
+    def resolve_filters(self, filters: Filters) -> np.ndarray:
+        """
+        過濾條件 → 符合的全域 vector id（各 shard 用自己的欄位索引解析）
+        """
+        parts = [shard.resolve_filters(filters) * self.num_shards + s
+                 for s, shard in enumerate(self.shards)]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype="int64")
+
+    def search(self, query_vecs: np.ndarray, top_k: int = 10,
+               nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None,
+               filters: Optional[Filters] = None,
+               with_ids: bool = False
+               ) -> List[List[Tuple]]:
+        """
+        所有 shard 平行搜尋（各取 top_k），每個 query 再用 heap 合併成全域 top_k。
+        filters 由各 shard 各自解析、在各自的 index 內過濾。
+        回傳格式同 VectorStore.search()（with_ids=True 時帶的是全域 vector id）
+        """
+        query_vecs = np.ascontiguousarray(query_vecs, dtype="float32")
+        futures = {s: self._pool.submit(shard.search, query_vecs, top_k, nprobe, ef_search,
+                                        filters, with_ids)
+                   for s, shard in enumerate(self.shards) if len(shard)}
+        per_shard = []
+        for s, f in futures.items():
+            res = f.result()
+            if with_ids:
+                res = [[(score, meta, self._join_id(s, local)) for score, meta, local in q_res]
+                       for q_res in res]
+            per_shard.append(res)
+        if not per_shard:
+            return [[] for _ in range(len(query_vecs))]
+
+        # 各 shard 的結果已依分數由高到低排序 → heapq.merge 只需看每個 shard 的開頭
+        return [list(itertools.islice(
+                    heapq.merge(*(res[q] for res in per_shard), key=lambda x: x[0], reverse=True),
+                    top_k))
+                for q in range(len(query_vecs))]
+
+    # ---------- BM25（全域一份，IDF 跨 shard 一致）----------
+
+    def build_bm25(self, save: bool = True):
+        self.bm25 = BM25Index.build({gid: meta.get("text") or meta.get("abstract") or ""
+                                     for gid, meta in self.metadatas.items()})
+        self._bm25_stale = False
+        if save:
+            self.bm25.save(self.bm25_path)
+
+    def sparse_search(self, queries: List[str], top_k: int = SPARSE_TOPK,
+                      filters: Optional[Filters] = None,
+                      with_ids: bool = False
+                      ) -> List[List[Tuple]]:
+        if self._bm25_stale:
+            self.build_bm25(save=False)
+
+        allowed = self.resolve_filters(filters) if filters else None
+        all_results: List[List[Tuple]] = []
+        for q_res in self.bm25.search(queries, top_k=top_k, allowed=allowed):
+            all_results.append([(s, self.metadatas[i], i) if with_ids else (s, self.metadatas[i])
+                                for s, i in q_res if i in self.metadatas])
+        return all_results
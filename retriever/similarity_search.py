@@ -2,33 +2,111 @@
 """
 Similarity Search 模組：
 包一層，方便之後想換成其他 vector DB (Milvus / pgvector 等)。
+
+sparse_search() 是 BM25 關鍵字檢索（hybrid 模式用）。
+fuse_results() 把多個 query（query expansion）/ 多種檢索的結果合併成一份候選清單。
 """
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 import numpy as np
 
+from config.settings import QUERY_FUSION, RRF_K, SPARSE_TOPK
+from .metadata_filter import Filters
 from .vector_store import VectorStore
 
 def similarity_search(query_vecs: np.ndarray,
                       vector_store: VectorStore,
-                      top_k: int = 10
+                      top_k: int = 10,
+                      nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None,
+                      filters: Optional[Filters] = None
                       ) -> List[List[Dict]]:
     """
     將 VectorStore.search() 的結果整理成 list[dict] 格式。
 
     輸入：
         query_vecs: (num_queries, dim)
+        nprobe / ef_search: ANN index 的單次搜尋參數（None = index 預設值）
+        filters: metadata 過濾條件，例如 {"source": "特殊教育法*.pdf", "chunk_id": {"lt": 10}}
+                 （寫法見 retriever/metadata_filter.py；在 index 內過濾，不是撈回來再篩）
     輸出：
-        results: List[ List[ {"score": float, **metadata} ] ]
+        results: List[ List[ {"score": float, "vid": vector id, **metadata} ] ]
     """
-    raw = vector_store.search(query_vecs, top_k=top_k)
+    raw = vector_store.search(query_vecs, top_k=top_k,
+                              nprobe=nprobe, ef_search=ef_search, filters=filters, with_ids=True)
     all_results: List[List[Dict]] = []
     for q_res in raw:
         one_list = []
-        for score, meta in q_res:
+        for score, meta, vid in q_res:
             item = dict(meta)
             item["score"] = score
+            item["vid"] = vid
             one_list.append(item)
         all_results.append(one_list)
     return all_results
 
+
+def sparse_search(queries: List[str],
+                  vector_store: VectorStore,
+                  top_k: int = SPARSE_TOPK,
+                  filters: Optional[Filters] = None
+                  ) -> List[List[Dict]]:
+    """
+    BM25 檢索，輸出格式同 similarity_search()，
+    但分數放在 "bm25_score"（與相似度不同尺度，不寫進 "score"）。
+    """
+    raw = vector_store.sparse_search(queries, top_k=top_k, filters=filters, with_ids=True)
+    all_results: List[List[Dict]] = []
+    for q_res in raw:
+        one_list = []
+        for score, meta, vid in q_res:
+            item = dict(meta)
+            item["bm25_score"] = score
+            item["vid"] = vid
+            one_list.append(item)
+        all_results.append(one_list)
+    return all_results
+
+
+def fuse_results(results_per_query: List[List[Dict]],
+                 method: str = QUERY_FUSION,
+                 rrf_k: int = RRF_K,
+                 top_k: Optional[int] = None
+                 ) -> List[Dict]:
+    """
+    合併多個 query 的候選文件，依 chunk id 去重。
+
+    method:
+        "rrf" → fusion_score = Σ 1 / (rrf_k + rank)（rank 從 1 起算）
+        "max" → fusion_score = 各 query 中最高的相似度
+    每筆的 "score" 保留該 chunk 在各 query 中最高的相似度（"bm25_score" 同理）；
+    只被 BM25 找到的 chunk 沒有 "score"，因此混合 sparse 結果時只能用 rrf。
+
+    輸出：依 fusion_score 由高到低排序的 list[dict]
+    """
+    if method not in ("rrf", "max"):
+        raise ValueError(f"未知的融合方式：{method}（可用：rrf / max）")
+
+    fused: Dict[str, Dict] = {}
+    for one_list in results_per_query:
+        for rank, item in enumerate(one_list, 1):
+            key = item.get("id")
+            gain = 1.0 / (rrf_k + rank) if method == "rrf" else item["score"]
+
+            hit = fused.get(key)
+            if hit is None:
+                hit = dict(item)
+                hit["fusion_score"] = gain
+                fused[key] = hit
+                continue
+
+            for field in ("score", "bm25_score"):
+                if field in item:
+                    hit[field] = max(hit.get(field, item[field]), item[field])
+            if method == "rrf":
+                hit["fusion_score"] += gain
+            else:
+                hit["fusion_score"] = max(hit["fusion_score"], gain)
+
+    merged = sorted(fused.values(), key=lambda x: x["fusion_score"], reverse=True)
+    return merged[:top_k] if top_k is not None else merged
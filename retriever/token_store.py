@@ -0,0 +1,275 @@
+# retriever/token_store.py
+"""
+預先 tokenize 的 chunk token 存檔：
+reranker 每次查詢都要把 50 個候選的原文重新 tokenize，重新 embedding 時也一樣；
+這裡在 ingest 時就把每個 chunk 的 token id 存起來，查詢時直接讀，再用 NumPy 接上 query 的 token id。
+
+- DocTokenizer：包一個 HF tokenizer，負責
+    tokenize(文件)          → 不含特殊 token 的 token id（最多 max_length + 1 個：
+                               多留一個才分得出「剛好 max_length」與「更長」，截斷規則才會與 HF 相同）
+    single(ids) / pair(q, d) → 依 tokenizer 的模板補上特殊 token、照 HF 的 longest_first 規則截斷，
+                               結果與 tokenizer(text) / tokenizer(query, doc) 相同
+    pad(seqs)               → padding 成 batch（padding_side 同 tokenizer）
+- TokenStore：每個 tokenizer 一組檔案（放在 <index>.tok/ 底下，檔名即 DocTokenizer.key）
+    <key>.ids    uint32，所有 chunk 的 token id 依寫入順序串接（只會 append）
+    <key>.rows   每個 vector id 一列 (start, length, crc)，列號 = vector id，讀取走 np.memmap
+  crc 是寫入時文字的 crc32，讀取時與目前 metadata 的文字比對：
+  不一致（metadata 改過、reset 後 id 重用）或沒有這一列時重新 tokenize 並 append 寫回。
+
+key = tokenizer 內容（vocab / 規則）的 hash + max_length，
+embedder 與 reranker 用的是同一份 tokenizer 時共用同一組檔案。
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import os
+import shutil
+import zlib
+
+import numpy as np
+
+_ROW = np.dtype([("start", "<i8"), ("length", "<i4"), ("crc", "<u4")])
+_ID_DTYPE = np.dtype("<u4")
+# 用來從 tokenizer 輸出切出特殊 token 模板的兩段文字（各自只會是 1 個以上的一般 token）
+_PROBE_A, _PROBE_B = "a", "b"
+
+
+def doc_text(meta: Dict) -> str:
+    """
+    chunk 要 tokenize 的文字（與 reranker / embedding 用的欄位相同）
+    """
+    return meta.get("abstract") or meta.get("text") or ""
+
+
+def text_crc(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def truncate_pair(len_a: int, len_b: int, budget: int) -> Tuple[int, int]:
+    """
+    HF fast tokenizer 的 longest_first：總長超過 budget 時先截較長的一段，
+    兩段都超過一半時各留一半（奇數多的一個 token 給第二段）
+    """
+    if len_a + len_b <= budget:
+        return len_a, len_b
+    swap = len_a > len_b
+    n1, n2 = (len_b, len_a) if swap else (len_a, len_b)
+    n2 = n1 if n1 > budget else max(n1, budget - n1)
+    if n1 + n2 > budget:
+        n1 = budget // 2
+        n2 = n1 + budget % 2
+    n1, n2 = (n2, n1) if swap else (n1, n2)
+    return min(len_a, n1), min(len_b, n2)
+
+
+class DocTokenizer:
+    def __init__(self, tokenizer, max_length: int):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self._key = None
+        self._single = None
+        self._pair = None
+
+    @classmethod
+    def from_pretrained(cls, model_name: str, max_length: int) -> "DocTokenizer":
+        """
+        只載入 tokenizer（ingest 時替 reranker 預先 tokenize，不必載入 4B 模型）
+        """
+        from transformers import AutoTokenizer
+
+        return cls(AutoTokenizer.from_pretrained(model_name), max_length)
+
+    @property
+    def supported(self) -> bool:
+        # 需要 token_type_ids 等額外輸入的模型（BERT 類 cross-encoder）仍走原本的 tokenizer 流程
+        return set(self.tokenizer.model_input_names) <= {"input_ids", "attention_mask"}
+
+    @property
+    def key(self) -> str:
+        if self._key is None:
+            backend = getattr(self.tokenizer, "backend_tokenizer", None)
+            if backend is not None:
+                spec = json.loads(backend.to_str())
+                spec.pop("truncation", None)
+                spec.pop("padding", None)
+            else:
+                spec = self.tokenizer.get_vocab()
+            raw = json.dumps(spec, sort_keys=True, ensure_ascii=False)
+            self._key = f"{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]}-{self.max_length}"
+        return self._key
+
+    # ---------- 特殊 token 模板 ----------
+
+    def _ids(self, text: str, special: bool, pair: Optional[str] = None) -> List[int]:
+        return self.tokenizer(text, pair, add_special_tokens=special)["input_ids"]
+
+    @staticmethod
+    def _split(full: List[int], parts: List[List[int]]) -> List[np.ndarray]:
+        """
+        full = 模板[0] + parts[0] + 模板[1] + parts[1] + ...，切出各段模板
+        """
+        pieces, pos = [], 0
+        for part in parts:
+            for start in range(pos, len(full) - len(part) + 1):
+                if full[start:start + len(part)] == part:
+                    break
+            else:
+                raise ValueError("無法從 tokenizer 輸出找出特殊 token 模板")
+            pieces.append(np.asarray(full[pos:start], dtype="int64"))
+            pos = start + len(part)
+        pieces.append(np.asarray(full[pos:], dtype="int64"))
+        return pieces
+
+    @property
+    def single_template(self) -> List[np.ndarray]:
+        if self._single is None:
+            self._single = self._split(self._ids(_PROBE_A, True), [self._ids(_PROBE_A, False)])
+        return self._single
+
+    @property
+    def pair_template(self) -> List[np.ndarray]:
+        if self._pair is None:
+            self._pair = self._split(self._ids(_PROBE_A, True, _PROBE_B),
+                                     [self._ids(_PROBE_A, False), self._ids(_PROBE_B, False)])
+        return self._pair
+
+    # ---------- tokenize / 組合 / padding ----------
+
+    @property
+    def cap(self) -> int:
+        return self.max_length + 1
+
+    def tokenize(self, texts: Sequence[str], truncate: bool = True) -> List[np.ndarray]:
+        """
+        truncate=False 給 query 用（query 不存檔，長度不設上限）
+        """
+        if not texts:
+            return []
+        if truncate:
+            enc = self.tokenizer(list(texts), add_special_tokens=False,
+                                 truncation=True, max_length=self.cap)
+        else:
+            enc = self.tokenizer(list(texts), add_special_tokens=False)
+        return [np.asarray(ids, dtype=_ID_DTYPE) for ids in enc["input_ids"]]
+
+    def exact(self, query_ids: np.ndarray, doc_ids: np.ndarray) -> bool:
+        """
+        pair() 的結果是否保證與 HF 相同：
+        query 與截到 cap 的文件兩段都不短於 cap 時分不出誰比較長；
+        任一段是空的時 HF 當成單段文字（不套 pair 模板）
+        """
+        if len(query_ids) == 0 or len(doc_ids) == 0:
+            return False
+        return len(query_ids) < self.cap or len(doc_ids) < self.cap
+
+    def single(self, seqs: Iterable[np.ndarray]) -> List[np.ndarray]:
+        head, tail = self.single_template
+        budget = self.max_length - len(head) - len(tail)
+        return [np.concatenate([head, np.asarray(s[:budget], dtype="int64"), tail]) for s in seqs]
+
+    def pair(self, queries: Iterable[np.ndarray], docs: Iterable[np.ndarray]) -> List[np.ndarray]:
+        """
+        queries 需是 tokenize(..., truncate=False) 的結果；docs 是 tokenize() 的結果
+        """
+        head, mid, tail = self.pair_template
+        budget = self.max_length - len(head) - len(mid) - len(tail)
+        out = []
+        for q, d in zip(queries, docs):
+            nq, nd = truncate_pair(len(q), len(d), budget)
+            out.append(np.concatenate([head, np.asarray(q[:nq], dtype="int64"), mid,
+                                       np.asarray(d[:nd], dtype="int64"), tail]))
+        return out
+
+    def pad(self, seqs: List[np.ndarray]):
+        from transformers import BatchEncoding
+
+        width = max(len(s) for s in seqs)
+        input_ids = np.full((len(seqs), width), self.tokenizer.pad_token_id, dtype="int64")
+        attention_mask = np.zeros((len(seqs), width), dtype="int64")
+        left = self.tokenizer.padding_side == "left"
+        for row, s in enumerate(seqs):
+            span = slice(width - len(s), width) if left else slice(0, len(s))
+            input_ids[row, span] = s
+            attention_mask[row, span] = 1
+        return BatchEncoding({"input_ids": input_ids, "attention_mask": attention_mask},
+                             tensor_type="pt")
+
+
+class TokenStore:
+    def __init__(self, folder: str, key: str):
+        self.folder = folder
+        self.key = key
+        self.ids_path = os.path.join(folder, f"{key}.ids")
+        self.rows_path = os.path.join(folder, f"{key}.rows")
+        self._ids_mm = None
+        self._rows_mm = None
+
+    def _rows(self) -> np.ndarray:
+        if self._rows_mm is None:
+            n = os.path.getsize(self.rows_path) // _ROW.itemsize if os.path.exists(self.rows_path) else 0
+            self._rows_mm = (np.memmap(self.rows_path, dtype=_ROW, mode="r", shape=(n,))
+                             if n else np.zeros(0, dtype=_ROW))
+        return self._rows_mm
+
+    def _ids(self) -> np.ndarray:
+        if self._ids_mm is None:
+            n = os.path.getsize(self.ids_path) // _ID_DTYPE.itemsize if os.path.exists(self.ids_path) else 0
+            self._ids_mm = (np.memmap(self.ids_path, dtype=_ID_DTYPE, mode="r", shape=(n,))
+                            if n else np.zeros(0, dtype=_ID_DTYPE))
+        return self._ids_mm
+
+    def lookup(self, vids: Sequence[int], texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        依 vector id 讀回 token id；沒存過或文字已變動的回傳 None
+        """
+        rows, ids = self._rows(), self._ids()
+        out: List[Optional[np.ndarray]] = []
+        for vid, text in zip(vids, texts):
+            if vid >= len(rows):
+                out.append(None)
+                continue
+            start, length, crc = rows[vid]
+            if crc != text_crc(text) or start + length > len(ids):
+                out.append(None)
+            else:
+                out.append(ids[start:start + length])
+        return out
+
+    def put(self, vids: Sequence[int], texts: Sequence[str], token_ids: Sequence[np.ndarray]):
+        if len(vids) == 0:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        rows = np.zeros(len(vids), dtype=_ROW)
+        with open(self.ids_path, "ab") as f:
+            start = f.tell() // _ID_DTYPE.itemsize
+            for r, (text, ids) in enumerate(zip(texts, token_ids)):
+                rows[r] = (start, len(ids), text_crc(text))
+                f.write(np.asarray(ids, dtype=_ID_DTYPE).tobytes())
+                start += len(ids)
+
+        # 先寫 token 再寫列：中斷時最多留下沒有列指向的 token
+        with open(self.rows_path, "r+b" if os.path.exists(self.rows_path) else "wb") as f:
+            for vid, row in zip(vids, rows):
+                f.seek(int(vid) * _ROW.itemsize)
+                f.write(row.tobytes())
+        self._ids_mm = self._rows_mm = None
+
+    def get(self, vids: Sequence[int], texts: Sequence[str],
+            tokenize: Callable[[List[str]], List[np.ndarray]]) -> List[np.ndarray]:
+        """
+        lookup，缺的當場 tokenize 並寫回
+        """
+        out = self.lookup(vids, texts)
+        miss = [i for i, ids in enumerate(out) if ids is None]
+        if miss:
+            fresh = tokenize([texts[i] for i in miss])
+            self.put([vids[i] for i in miss], [texts[i] for i in miss], fresh)
+            for i, ids in zip(miss, fresh):
+                out[i] = ids
+        return out
+
+
+def remove_token_stores(folder: str):
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
@@ -0,0 +1,58 @@
+# retriever/vector_file.py
+"""
+Full-precision 向量檔：
+壓縮 / 截斷的 index 只負責第一輪搜尋，重新打分需要的 float32 原向量放在這裡。
+
+檔案就是 (列數, dim) 的 float32 陣列，列號 = vector id（id 只增不減，刪除留下的空列不會被讀到），
+讀取走 np.memmap，不佔常駐記憶體；寫入是對固定位置覆寫，WAL replay 重寫同一列也不會出錯。
+"""
+
+from typing import Iterable
+import os
+
+import numpy as np
+
+
+class FullVectorFile:
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self._mm = None
+
+    def write(self, ids: Iterable[int], vecs: np.ndarray):
+        ids = np.asarray(list(ids), dtype="int64")
+        vecs = np.ascontiguousarray(vecs, dtype="float32")
+        if len(ids) == 0:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "r+b" if os.path.exists(self.path) else "wb") as f:
+            if ids[-1] - ids[0] + 1 == len(ids) and np.all(np.diff(ids) == 1):
+                # add_embeddings 給的 id 是連續的 → 一次寫完
+                f.seek(int(ids[0]) * self.row_bytes)
+                f.write(vecs.tobytes())
+            else:
+                for i, v in zip(ids, vecs):
+                    f.seek(int(i) * self.row_bytes)
+                    f.write(v.tobytes())
+        self._mm = None
+
+    def read(self, ids: Iterable[int]) -> np.ndarray:
+        ids = np.asarray(list(ids), dtype="int64")
+        if len(ids) == 0:
+            return np.zeros((0, self.dim), dtype="float32")
+        if self._mm is None:
+            rows = os.path.getsize(self.path) // self.row_bytes
+            self._mm = np.memmap(self.path, dtype="float32", mode="r", shape=(rows, self.dim))
+        return np.asarray(self._mm[ids])
+
+    def sync(self):
+        if os.path.exists(self.path):
+            with open(self.path, "rb+") as f:
+                os.fsync(f.fileno())
+
+    def remove(self):
+        self._mm = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
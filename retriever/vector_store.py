@@ -2,89 +2,779 @@
 """
 Vector Store 模組：
 使用 FAISS 作為向量資料庫，負責：
-- 新增文件向量
+- 新增 / 刪除文件向量
 - 儲存 / 載入 index
 - 依 query 向量做 kNN 搜尋
+
+每個向量都有一個穩定的整數 id（vector id），
+刪除某些向量後其他向量的 id 不會改變，增量同步（sync）才有辦法只動到變更的 chunk。
+
+持久化分兩層：
+- snapshot：index.faiss + index.faiss.meta.json（帶 generation 編號）
+- append-only log：index.faiss.wal，記錄 snapshot 之後的 add / remove / update
+
+add_embeddings() 只寫進記憶體的 pending buffer，
+flush() 把 pending 追加到 log（只寫新資料），
+commit() = flush() + 視 log 大小做 compaction（重寫 snapshot、清空 log）。
+snapshot 先寫 .tmp 再用 os.replace 換上，載入時依 .tmp 是否存在決定 roll back / roll forward，
+ingest 中途被砍掉也不會讓 index 與 metadata 對不上。
+
+Index 類型由 config/settings.py 的 VECTOR_INDEX_TYPE 決定（flat / ivf_flat / hnsw / ivf_pq），
+IVF 類會在第一批向量（或 train() 給的樣本）上訓練；nprobe / efSearch 可於 search() 逐次覆寫。
+
+VECTOR_STORAGE / VECTOR_SEARCH_DIM 可讓 index 只存 fp16 / int8 / binary code、只用前 N 維：
+第一輪在壓縮的 index 上取 top_k × RESCORE_FACTOR 筆，
+再用 memmap 的 float32 原向量（index.faiss.f32，見 retriever/vector_file.py）重新打分。
+
+另外可選一份 BM25 倒排索引（index.faiss.bm25.npz，見 retriever/bm25.py），
+由 build_bm25() 從 metadata 的原文重建（ingest 結束時呼叫），以 vector id 對應；
+它是衍生資料、不進 log，向量有增刪而尚未重建時 sparse_search() 會先在記憶體內重建。
+
+search() / sparse_search() 可帶 metadata 過濾條件（見 retriever/metadata_filter.py）：
+條件先經由 欄位值 → vector id 索引解析成 id 集合，
+剩下不多時直接對這些向量算精確內積（FILTER_EXACT_MAX），否則以 IDSelector 交給 FAISS 在搜尋時過濾。
+
+每個 chunk 預先 tokenize 的 token id 存在 index.faiss.tok/（見 retriever/token_store.py），
+依 tokenizer 分檔、以 vector id 對應；同樣是衍生資料、不進 log，缺的或文字已變動的在讀取時補上。
 """
 
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterable
 import os
 import json
+import struct
+import zlib
 
 import numpy as np
 import faiss
 
+from config.settings import (
+    SPARSE_TOPK, FILTER_EXACT_MAX,
+    VECTOR_STORE_FLUSH_ROWS, VECTOR_STORE_COMPACT_RATIO,
+    VECTOR_INDEX_TYPE, INDEX_TRAIN_SAMPLE,
+    VECTOR_STORAGE, VECTOR_SEARCH_DIM, RESCORE_FACTOR,
+    IVF_NLIST, IVF_NPROBE, PQ_M, PQ_NBITS,
+    HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+)
+from .bm25 import BM25Index
+from .metadata_filter import Filters, MetadataIndex
+from .token_store import DocTokenizer, TokenStore, doc_text, remove_token_stores
+from .vector_file import FullVectorFile
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+STORAGE_TYPES = ("float32", "fp16", "int8", "binary")
+
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# log record：magic, header 長度, payload 長度, crc32(header + payload)
+_WAL_MAGIC = b"VWAL"
+_WAL_RECORD = struct.Struct("<4sIII")
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# ---------- Index 建立 ----------
+
+def build_index(index_type: str, dim: int, num_train: int = 0,
+                storage: str = "float32") -> faiss.Index:
+    """
+    建立空的 index（一律使用內積相似度，向量請先 L2 normalize）。
+    IVF 類 / int8 回傳的 index 尚未訓練；num_train 用來在樣本不足時調小 nlist。
+    storage="binary" 時 dim 是 bit 數，回傳的是 IndexBinary（漢明距離，只能當第一輪用）。
+
+    flat / hnsw 外面包 IndexIDMap2 來支援自訂 id；
+    IVF 本身就支援 add_with_ids / remove_ids，另外開 hashtable direct map 以便依 id 取回向量。
+    """
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"未知的 storage：{storage}（可用：{', '.join(STORAGE_TYPES)}）")
+    sq = _SQ_TYPES.get(storage)
+
+    if storage == "binary":
+        if index_type != "flat":
+            raise ValueError("binary storage 只支援 flat index")
+        if dim % 8 != 0:
+            raise ValueError(f"binary storage 的維度須為 8 的倍數（目前 {dim}）")
+        return faiss.IndexBinaryIDMap2(faiss.IndexBinaryFlat(dim))
+
+    if index_type == "flat":
+        if sq is not None:
+            return faiss.IndexIDMap2(faiss.IndexScalarQuantizer(dim, sq, faiss.METRIC_INNER_PRODUCT))
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+    if index_type == "hnsw":
+        if sq is not None:
+            hnsw = faiss.IndexHNSWSQ(dim, sq, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            hnsw = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        hnsw.hnsw.efSearch = HNSW_EF_SEARCH
+        return faiss.IndexIDMap2(hnsw)
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # k-means 每個分群至少需要 ~39 筆訓練資料
+        nlist = IVF_NLIST if num_train <= 0 else max(1, min(IVF_NLIST, num_train // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+
+        if index_type == "ivf_flat" and sq is not None:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, sq,
+                                                  faiss.METRIC_INNER_PRODUCT)
+        elif index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if sq is not None:
+                raise ValueError("ivf_pq 本身就是壓縮格式，storage 請用 float32")
+            if dim % PQ_M != 0:
+                raise ValueError(f"PQ_M={PQ_M} 無法整除向量維度 {dim}")
+            if 0 < num_train < 2 ** PQ_NBITS:
+                raise ValueError(f"IVF-PQ 至少需要 {2 ** PQ_NBITS} 筆向量訓練，"
+                                 f"目前只有 {num_train} 筆，請先用 train() 提供樣本")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS,
+                                     faiss.METRIC_INNER_PRODUCT)
+
+        index.nprobe = min(IVF_NPROBE, nlist)
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+
+    raise ValueError(f"未知的 index 類型：{index_type}（可用：{', '.join(INDEX_TYPES)}）")
+
+
+def train_sample(vecs: np.ndarray, max_rows: int = INDEX_TRAIN_SAMPLE) -> np.ndarray:
+    """
+    訓練用的隨機取樣（固定 seed，WAL replay 時重建的 index 才會一致）
+    """
+    if len(vecs) <= max_rows:
+        return vecs
+    rng = np.random.default_rng(0)
+    return vecs[np.sort(rng.choice(len(vecs), max_rows, replace=False))]
+
+
+def search_params(index: faiss.Index,
+                  nprobe: Optional[int] = None,
+                  ef_search: Optional[int] = None,
+                  sel: Optional[faiss.IDSelector] = None):
+    """
+    依 index 類型組出單次搜尋用的 SearchParameters（沒有要覆寫就回傳 None）。
+    sel：只搜尋這些 id（IndexIDMap2 會自行把 id 轉成內部位置）；
+    呼叫端要持有 sel 直到搜尋結束，params 不會幫忙保留參照。
+    """
+    extra = {"sel": sel} if sel is not None else {}
+
+    if isinstance(index, faiss.IndexIVF):
+        if nprobe or extra:
+            return faiss.SearchParametersIVF(nprobe=nprobe or index.nprobe, **extra)
+        return None
+
+    if isinstance(index, faiss.IndexIDMap2) and (ef_search or extra):
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(efSearch=ef_search or inner.hnsw.efSearch, **extra)
+    return faiss.SearchParameters(**extra) if extra else None
+
+
 class VectorStore:
-    def __init__(self, index_path: str):
+    def __init__(self, index_path: str,
+                 flush_rows: int = VECTOR_STORE_FLUSH_ROWS,
+                 compact_ratio: float = VECTOR_STORE_COMPACT_RATIO,
+                 index_type: str = VECTOR_INDEX_TYPE,
+                 storage: str = VECTOR_STORAGE,
+                 search_dim: Optional[int] = VECTOR_SEARCH_DIM,
+                 rescore_factor: int = RESCORE_FACTOR):
         """
         index_path: 存放向量索引的檔案路徑（例如 data/vector_db/index.faiss）
-        會另外在同資料夾存一份 meta.json 紀錄文件 metadata。
+        會另外在同資料夾存一份 meta.json 紀錄文件 metadata，以及一份 .wal 增量 log。
+        index_type / storage / search_dim: 建立新 index 時使用的設定；已存在的 index 以檔案內容為準
         """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"未知的 index 類型：{index_type}（可用：{', '.join(INDEX_TYPES)}）")
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"未知的 storage：{storage}（可用：{', '.join(STORAGE_TYPES)}）")
+
         self.index_path = index_path
         self.meta_path = index_path + ".meta.json"
+        self.wal_path = index_path + ".wal"
+        self.bm25_path = index_path + ".bm25.npz"
+        self.vectors_path = index_path + ".f32"
+        self.tokens_dir = index_path + ".tok"
+        self.flush_rows = flush_rows
+        self.compact_ratio = compact_ratio
+        self.index_type = index_type
+        self._new_index_config = (storage, search_dim)
+        self.storage = storage
+        self.search_dim = search_dim
+        self.rescore_factor = rescore_factor
+
         self.index: Optional[faiss.Index] = None
-        self.metadatas: List[Dict] = []
+        self.dim: Optional[int] = None                  # 原始（未截斷）向量維度
+        self.vectors: Optional[FullVectorFile] = None   # 壓縮時才有：float32 原向量
+        self.metadatas: Dict[int, Dict] = {}    # vector id → metadata
+        self.fields = MetadataIndex()           # 過濾用：欄位值 → vector id
+        self.next_id = 0
+        self.generation = 0
+        self.version = 0        # 內容（向量 / metadata）每變動一次 +1，查詢結果快取用來判斷是否過期
+
+        self.bm25: Optional[BM25Index] = None
+        self._bm25_stale = True
+        self._token_stores: Dict[str, TokenStore] = {}
+
+        self._pending: List[Tuple[Dict, Optional[np.ndarray]]] = []
+        self._pending_rows = 0
 
         self._load_if_exists()
 
+    def __len__(self) -> int:
+        return len(self.metadatas)
+
+    @property
+    def compressed(self) -> bool:
+        """
+        index 存的不是完整 float32 向量 → 搜尋要經過 float32 重新打分
+        """
+        return self.storage != "float32" or self.search_dim is not None
+
+    def _project(self, vecs: np.ndarray) -> np.ndarray:
+        """
+        Matryoshka 截斷：取前 search_dim 維並重新 L2 normalize
+        """
+        if self.search_dim is not None and self.search_dim < vecs.shape[1]:
+            vecs = vecs[:, :self.search_dim]
+            vecs = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+        return np.ascontiguousarray(vecs, dtype="float32")
+
+    def _encode(self, vecs: np.ndarray) -> np.ndarray:
+        """
+        完整 float32 向量 → index 吃的輸入（截斷；binary 再轉成 sign bit）
+        """
+        vecs = self._project(vecs)
+        return np.packbits(vecs > 0, axis=1) if self.storage == "binary" else vecs
+
     # ---------- Index 讀寫 ----------
 
+    def _recover_snapshot(self):
+        """
+        處理上次 compaction 中斷留下的 .tmp：
+        - index.tmp 還在 → index 尚未換上，整個 snapshot 作廢（roll back）
+        - 只剩 meta.tmp → index 已換上，補完 meta 的 rename（roll forward）
+        """
+        index_tmp, meta_tmp = self.index_path + ".tmp", self.meta_path + ".tmp"
+        if os.path.exists(index_tmp):
+            os.remove(index_tmp)
+            if os.path.exists(meta_tmp):
+                os.remove(meta_tmp)
+        elif os.path.exists(meta_tmp):
+            os.replace(meta_tmp, self.meta_path)
+            _fsync_dir(self.meta_path)
+
     def _load_if_exists(self):
-        if os.path.exists(self.index_path):
-            self.index = faiss.read_index(self.index_path)
+        self._recover_snapshot()
+
         if os.path.exists(self.meta_path):
             with open(self.meta_path, "r", encoding="utf-8") as f:
-                self.metadatas = json.load(f)
+                data = json.load(f)
+
+            if isinstance(data, list):
+                # 舊版格式：metadata list，位置即 vector id
+                self.metadatas = dict(enumerate(data))
+                self.next_id = len(data)
+                self.storage, self.search_dim = "float32", None
+            else:
+                self.metadatas = dict(zip(data["ids"], data["metadatas"]))
+                self.next_id = data.get("next_id", max(self.metadatas, default=-1) + 1)
+                self.generation = data.get("generation", 0)
+                self.storage = data.get("storage", "float32")
+                self.search_dim = data.get("search_dim")
+                self.dim = data.get("dim")
+
+        self.fields = MetadataIndex.build(self.metadatas)
+
+        if os.path.exists(self.index_path):
+            if self.storage == "binary":
+                self.index = faiss.read_index_binary(self.index_path)
+            else:
+                self.index = faiss.read_index(self.index_path)
+            if self.dim is None:
+                self.dim = self.index.d
+        if self.compressed and self.dim is not None:
+            self.vectors = FullVectorFile(self.vectors_path, self.dim)
+
+        if isinstance(self.index, faiss.IndexFlat):
+            self.index = self._wrap_legacy_index(self.index)
+
+        self._replay_wal()
 
-    def _save(self):
+        if os.path.exists(self.bm25_path):
+            self.bm25 = BM25Index.load(self.bm25_path)
+            self._bm25_stale = set(self.bm25.doc_ids.tolist()) != self.metadatas.keys()
+
+    @staticmethod
+    def _wrap_legacy_index(index: faiss.Index) -> faiss.Index:
+        """
+        舊版 index 是單純的 IndexFlatIP（位置 = id），
+        轉成 IndexIDMap2 才能依 id 刪除向量。
+        """
+        wrapped = faiss.IndexIDMap2(faiss.IndexFlatIP(index.d))
+        if index.ntotal > 0:
+            vecs = index.reconstruct_n(0, index.ntotal)
+            wrapped.add_with_ids(vecs, np.arange(index.ntotal, dtype="int64"))
+        return wrapped
+
+    # ---------- Append-only log ----------
+
+    @staticmethod
+    def _encode_record(header: Dict, payload: bytes = b"") -> bytes:
+        head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        crc = zlib.crc32(payload, zlib.crc32(head))
+        return _WAL_RECORD.pack(_WAL_MAGIC, len(head), len(payload), crc) + head + payload
+
+    def _read_wal(self):
+        """
+        逐筆讀出 log record；遇到寫到一半的尾巴（長度不足 / crc 不符）就停，
+        回傳 (records, 最後一筆完整 record 的結尾位置)
+        """
+        records, valid_end = [], 0
+        with open(self.wal_path, "rb") as f:
+            data = f.read()
+
+        pos = 0
+        while pos + _WAL_RECORD.size <= len(data):
+            magic, head_len, payload_len, crc = _WAL_RECORD.unpack_from(data, pos)
+            start = pos + _WAL_RECORD.size
+            end = start + head_len + payload_len
+            if magic != _WAL_MAGIC or end > len(data):
+                break
+            head = data[start:start + head_len]
+            payload = data[start + head_len:end]
+            if zlib.crc32(payload, zlib.crc32(head)) != crc:
+                break
+            records.append((json.loads(head.decode("utf-8")), payload))
+            pos = valid_end = end
+
+        return records, valid_end
+
+    def _replay_wal(self):
+        if not os.path.exists(self.wal_path):
+            return
+
+        records, valid_end = self._read_wal()
+        if not records or records[0][0].get("generation") != self.generation:
+            # 上一輪 compaction 已經把 log 併進 snapshot（或 log 損毀）→ 捨棄
+            self._reset_wal()
+            return
+
+        for header, payload in records[1:]:
+            if header["op"] == "add":
+                vecs = np.frombuffer(payload, dtype="float32").reshape(-1, header["dim"])
+                self._apply_add(vecs, header["ids"], header["metas"])
+            elif header["op"] == "remove":
+                self._apply_remove(header["ids"])
+            elif header["op"] == "update":
+                self._apply_update({int(k): v for k, v in header["metas"].items()})
+
+        # 截掉寫到一半的尾巴，之後的 append 才會接在完整 record 後面
+        if valid_end < os.path.getsize(self.wal_path):
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(valid_end)
+
+    def _reset_wal(self):
+        """
+        開一份新的 log（開頭記錄對應的 snapshot generation），原子換上
+        """
+        os.makedirs(os.path.dirname(self.wal_path) or ".", exist_ok=True)
+        tmp = self.wal_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(self._encode_record({"op": "begin", "generation": self.generation}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.wal_path)
+        _fsync_dir(self.wal_path)
+
+    def flush(self):
+        """
+        把 pending 的操作追加到 log 並 fsync（只寫新增的部分）
+        """
+        if not self._pending:
+            return
+        if not os.path.exists(self.wal_path):
+            self._reset_wal()
+
+        with open(self.wal_path, "ab") as f:
+            for header, vecs in self._pending:
+                payload = vecs.tobytes() if vecs is not None else b""
+                f.write(self._encode_record(header, payload))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._pending = []
+        self._pending_rows = 0
+
+    def commit(self, compact: bool = False):
+        """
+        flush() 之後，若 log 相對 snapshot 太大（或 compact=True）就做 compaction
+        """
+        self.flush()
+        if compact or self._should_compact():
+            self.compact()
+
+    def _should_compact(self) -> bool:
+        if not os.path.exists(self.wal_path):
+            return False
+        wal_size = os.path.getsize(self.wal_path)
+        snapshot_size = sum(os.path.getsize(p) for p in (self.index_path, self.meta_path)
+                            if os.path.exists(p))
+        return wal_size > _WAL_RECORD.size * 64 and wal_size > self.compact_ratio * snapshot_size
+
+    def compact(self):
+        """
+        重寫 snapshot 並清空 log。
+        寫入順序：index.tmp → meta.tmp → replace index → replace meta → 新 log，
+        任何一步中斷都能在載入時由 _recover_snapshot() + generation 比對還原。
+        """
+        self._pending = []
+        self._pending_rows = 0
+        generation = self.generation + 1
+
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        index_tmp, meta_tmp = self.index_path + ".tmp", self.meta_path + ".tmp"
+
+        if self.vectors is not None:
+            # snapshot 之後 log 會被清空，原向量必須先落地
+            self.vectors.sync()
+
+        if self.index is not None:
+            if self.storage == "binary":
+                faiss.write_index_binary(self.index, index_tmp)
+            else:
+                faiss.write_index(self.index, index_tmp)
+            with open(index_tmp, "rb+") as f:
+                os.fsync(f.fileno())
+
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "generation": generation,
+                "next_id": self.next_id,
+                "storage": self.storage,
+                "search_dim": self.search_dim,
+                "dim": self.dim,
+                "ids": list(self.metadatas.keys()),
+                "metadatas": list(self.metadatas.values()),
+            }, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self.index is not None:
+            os.replace(index_tmp, self.index_path)
+        elif os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        _fsync_dir(self.index_path)
+
+        os.replace(meta_tmp, self.meta_path)
+        _fsync_dir(self.meta_path)
+
+        self.generation = generation
+        self._reset_wal()
+
+    def _log(self, header: Dict, vecs: Optional[np.ndarray] = None):
+        self._pending.append((header, vecs))
+        self._pending_rows += 0 if vecs is None else len(vecs)
+        if self._pending_rows >= self.flush_rows:
+            self.flush()
+
+    # ---------- 新增 / 刪除向量 ----------
+
+    def _create_index(self, vecs: np.ndarray, index_type: Optional[str] = None):
+        """
+        vecs：完整 float32 向量（截斷 / 編碼在這裡做）
+        """
+        self.dim = vecs.shape[1]
+        if self.compressed and self.vectors is None:
+            self.vectors = FullVectorFile(self.vectors_path, self.dim)
+
+        sample = self._encode(train_sample(vecs))
+        dim = sample.shape[1] * 8 if self.storage == "binary" else sample.shape[1]
+        self.index = build_index(index_type or self.index_type, dim,
+                                 num_train=len(sample), storage=self.storage)
+        if not self.index.is_trained:
+            self.index.train(sample)
+
+    def train(self, vecs: np.ndarray):
+        """
+        用代表性樣本建立並訓練 IVF / PQ index（在第一批 add 之前呼叫），
+        訓練好的空 index 會立刻寫成 snapshot。
+        """
         if self.index is not None:
-            faiss.write_index(self.index, self.index_path)
-        with open(self.meta_path, "w", encoding="utf-8") as f:
-            json.dump(self.metadatas, f, ensure_ascii=False, indent=2)
+            raise ValueError("index 已存在，若要換 index 類型請先 reset()")
+        self._create_index(np.ascontiguousarray(vecs, dtype="float32"))
+        self.compact()
 
-    # ---------- 新增向量 ----------
+    def get_vectors(self, ids: Iterable[int]) -> np.ndarray:
+        """
+        依 vector id 取回向量 (N, dim)；IVF-PQ 取回的是量化後的近似值，
+        壓縮儲存時從 float32 原向量檔讀（完整維度）
+        """
+        ids = np.asarray(list(ids), dtype="int64")
+        if self.index is None or len(ids) == 0:
+            return np.zeros((0, self.dim or 0), dtype="float32")
+        if self.vectors is not None:
+            return self.vectors.read(ids)
+        return self.index.reconstruct_batch(ids)
+
+    def _apply_add(self, embeddings: np.ndarray, ids: List[int], metadatas: List[Dict]):
+        if self.index is None:
+            self._create_index(embeddings)
+        if self.vectors is not None:
+            self.vectors.write(ids, embeddings)
+        self.index.add_with_ids(self._encode(embeddings), np.asarray(ids, dtype="int64"))
+        self.metadatas.update(zip(ids, metadatas))
+        self.fields.add(ids, metadatas)
+        self.next_id = max(self.next_id, max(ids) + 1)
+        self.version += 1
+        self._bm25_stale = True
+
+    def _apply_remove(self, ids: List[int]):
+        try:
+            self.index.remove_ids(np.asarray(ids, dtype="int64"))
+        except RuntimeError:
+            # HNSW 不支援刪除 → 用剩下的向量重建
+            removed = set(ids)
+            keep = [i for i in self.metadatas if i not in removed]
+            vecs = self.get_vectors(keep)
+            self.index = None
+            if keep:
+                self._create_index(vecs, index_type="hnsw")
+                self.index.add_with_ids(self._encode(vecs), np.asarray(keep, dtype="int64"))
+        for i in ids:
+            self.fields.remove([i], [self.metadatas.pop(i)])
+        self.version += 1
+        self._bm25_stale = True
+
+    def _apply_update(self, updates: Dict[int, Dict]):
+        for i, meta in updates.items():
+            if i in self.metadatas:
+                self.fields.remove([i], [self.metadatas[i]])
+                self.fields.add([i], [meta])
+                self.metadatas[i] = meta
+        self.version += 1
 
-    def add_embeddings(self, embeddings: np.ndarray, metadatas: List[Dict]):
+    def add_embeddings(self, embeddings: np.ndarray, metadatas: List[Dict]) -> List[int]:
         """
         embeddings: (N, dim) float32
         metadatas:  list[dict] 長度 N
+        回傳：新向量的 vector id
+
+        新增的向量立即可搜尋，但要 flush() / commit() 後才會落地。
         """
-        embeddings = embeddings.astype("float32")
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
         n, dim = embeddings.shape
+        if n == 0:
+            return []
 
-        if self.index is None:
-            # 使用內積相似度，可搭配向量先做 L2 normalize
-            self.index = faiss.IndexFlatIP(dim)
+        ids = list(range(self.next_id, self.next_id + n))
+        self._apply_add(embeddings, ids, list(metadatas))
+        self._log({"op": "add", "dim": dim, "ids": ids, "metas": list(metadatas)}, embeddings)
+        return ids
 
-        self.index.add(embeddings)
-        self.metadatas.extend(metadatas)
-        self._save()
+    def remove_ids(self, ids: Iterable[int]) -> int:
+        """
+        依 vector id 刪除向量與 metadata，回傳實際刪除的數量
+        """
+        ids = [i for i in ids if i in self.metadatas]
+        if not ids:
+            return 0
+
+        self._apply_remove(ids)
+        self._log({"op": "remove", "ids": ids})
+        return len(ids)
+
+    def update_metadata(self, updates: Dict[int, Dict]):
+        """
+        只更新 metadata（向量不變），例如 chunk 位置改變但內容沒變
+        """
+        updates = {i: meta for i, meta in updates.items() if i in self.metadatas}
+        if not updates:
+            return
+        self._apply_update(updates)
+        self._log({"op": "update", "metas": {str(i): m for i, m in updates.items()}})
+
+    def find_ids(self, **match) -> List[int]:
+        """
+        找出 metadata 欄位完全符合的 vector id，例如 find_ids(source="xxx.pdf")
+        """
+        return [i for i, meta in self.metadatas.items()
+                if all(meta.get(k) == v for k, v in match.items())]
+
+    def reset(self):
+        """
+        清空整個向量資料庫（full rebuild 前使用，避免重複 append）
+        """
+        self.index = None
+        self.metadatas = {}
+        self.fields = MetadataIndex()
+        self.version += 1
+        self.next_id = 0
+        if self.vectors is not None:
+            self.vectors.remove()
+            self.vectors = None
+        self.dim = None
+        # 重建時改用建構時指定的壓縮設定
+        self.storage, self.search_dim = self._new_index_config
+        self.bm25 = None
+        self._bm25_stale = True
+        if os.path.exists(self.bm25_path):
+            os.remove(self.bm25_path)
+        self._token_stores = {}
+        remove_token_stores(self.tokens_dir)
+        self.compact()
+
+    # ---------- 預先 tokenize 的 token id ----------
+
+    def _token_store(self, tokenizer: DocTokenizer) -> TokenStore:
+        store = self._token_stores.get(tokenizer.key)
+        if store is None:
+            store = self._token_stores[tokenizer.key] = TokenStore(self.tokens_dir, tokenizer.key)
+        return store
+
+    def put_tokens(self, ids: List[int], tokenizer: DocTokenizer, token_ids: List[np.ndarray]):
+        """
+        ingest 時寫入已 tokenize 好的 token id（token_ids 與 ids 一一對應）
+        """
+        texts = [doc_text(self.metadatas[i]) for i in ids]
+        self._token_store(tokenizer).put(ids, texts, token_ids)
+
+    def get_tokens(self, ids: Iterable[int], tokenizer: DocTokenizer) -> List[np.ndarray]:
+        """
+        依 vector id 取回 token id（不含特殊 token）；沒存過或文字已變動的當場 tokenize 並寫回
+        """
+        ids = list(ids)
+        texts = [doc_text(self.metadatas[i]) for i in ids]
+        return self._token_store(tokenizer).get(ids, texts, tokenizer.tokenize)
+
+    # ---------- BM25 ----------
+
+    def build_bm25(self, save: bool = True):
+        """
+        從目前所有 chunk 的原文重建 BM25 索引（save=True 時寫到 index.faiss.bm25.npz）
+        """
+        self.bm25 = BM25Index.build({i: meta.get("text") or meta.get("abstract") or ""
+                                     for i, meta in self.metadatas.items()})
+        self._bm25_stale = False
+        if save:
+            self.bm25.save(self.bm25_path)
 
     # ---------- 搜尋 ----------
 
-    def search(self, query_vecs: np.ndarray, top_k: int = 10
-               ) -> List[List[Tuple[float, Dict]]]:
+    def resolve_filters(self, filters: Filters) -> np.ndarray:
+        """
+        過濾條件 → 符合的 vector id（排序過的 int64 陣列）
+        """
+        return self.fields.resolve(filters, self.metadatas)
+
+    def search(self, query_vecs: np.ndarray, top_k: int = 10,
+               nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None,
+               filters: Optional[Filters] = None,
+               with_ids: bool = False
+               ) -> List[List[Tuple]]:
         """
         依多個 query 向量做搜尋。
+        nprobe（IVF）/ ef_search（HNSW）：只影響這次搜尋，None 表示用 index 預設值
+        filters：metadata 過濾條件（見 retriever/metadata_filter.py），只回傳符合的 chunk
 
         回傳：List (num_queries)，
-              每個元素是 list[(score, metadata)] (長度 top_k)
+              每個元素是 list[(score, metadata)] (長度 top_k)；
+              with_ids=True 時為 (score, metadata, vector id)
         """
         if self.index is None or len(self.metadatas) == 0:
             return [[] for _ in range(len(query_vecs))]
 
-        query_vecs = query_vecs.astype("float32")
-        scores, indices = self.index.search(query_vecs, top_k)
+        query_vecs = np.ascontiguousarray(query_vecs, dtype="float32")
+        sel = None
+        if filters:
+            allowed = self.resolve_filters(filters)
+            if len(allowed) == 0:
+                return [[] for _ in range(len(query_vecs))]
+            if len(allowed) <= FILTER_EXACT_MAX:
+                # 子集合很小：直接算精確內積，比 ANN 上過濾更快，也不會被 nprobe / efSearch 漏掉
+                scores, indices = self._exact_search(query_vecs, allowed, top_k)
+                return self._to_results(scores, indices, with_ids)
+            sel = faiss.IDSelectorBatch(allowed)
+
+        params = search_params(self.index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+        k = top_k * self.rescore_factor if self.compressed else top_k
+        scores, indices = self.index.search(self._encode(query_vecs), k, params=params)
+        if self.compressed:
+            scores, indices = self._rescore(query_vecs, indices, top_k)
+        return self._to_results(scores, indices, with_ids)
 
-        all_results: List[List[Tuple[float, Dict]]] = []
-        for q_idx in range(len(query_vecs)):
+    def _to_results(self, scores: np.ndarray, indices: np.ndarray, with_ids: bool = False
+                    ) -> List[List[Tuple]]:
+        all_results: List[List[Tuple]] = []
+        for q_idx in range(len(indices)):
             q_scores = scores[q_idx]
             q_indices = indices[q_idx]
             results = []
             for s, idx in zip(q_scores, q_indices):
-                if idx < 0 or idx >= len(self.metadatas):
+                meta = self.metadatas.get(int(idx))
+                if meta is None:
                     continue
-                meta = self.metadatas[idx]
-                results.append((float(s), meta))
+                results.append((float(s), meta, int(idx)) if with_ids else (float(s), meta))
             all_results.append(results)
         return all_results
+
+    def _exact_search(self, query_vecs: np.ndarray, ids: np.ndarray, top_k: int
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        只在 ids 這些向量上做精確 kNN（完整維度；IVF-PQ 用的是量化後的近似向量）
+        """
+        scores = query_vecs @ self.get_vectors(ids).T
+        k = min(top_k, len(ids))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        return np.take_along_axis(top_scores, order, axis=1), ids[np.take_along_axis(top, order, axis=1)]
+
+    def _rescore(self, query_vecs: np.ndarray, indices: np.ndarray, top_k: int
+                 ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        第一輪的候選用 float32 原向量重算內積，取前 top_k（不足補 -1）
+        """
+        scores = np.full((len(query_vecs), top_k), -np.inf, dtype="float32")
+        out = np.full((len(query_vecs), top_k), -1, dtype="int64")
+        for q_idx, row in enumerate(indices):
+            cand = row[row >= 0]
+            if len(cand) == 0:
+                continue
+            s = self.vectors.read(cand) @ query_vecs[q_idx]
+            order = np.argsort(-s, kind="stable")[:top_k]
+            scores[q_idx, :len(order)] = s[order]
+            out[q_idx, :len(order)] = cand[order]
+        return scores, out
+
+    def sparse_search(self, queries: List[str], top_k: int = SPARSE_TOPK,
+                      filters: Optional[Filters] = None,
+                      with_ids: bool = False
+                      ) -> List[List[Tuple]]:
+        """
+        BM25 關鍵字搜尋，回傳格式同 search()（score 為 BM25 分數）。
+        索引與目前的向量不一致時先在記憶體內重建（不寫檔）。
+        """
+        if self._bm25_stale:
+            self.build_bm25(save=False)
+
+        allowed = self.resolve_filters(filters) if filters else None
+        all_results: List[List[Tuple]] = []
+        for q_res in self.bm25.search(queries, top_k=top_k, allowed=allowed):
+            all_results.append([(s, self.metadatas[i], i) if with_ids else (s, self.metadatas[i])
+                                for s, i in q_res if i in self.metadatas])
+        return all_results
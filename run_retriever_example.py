@@ -10,6 +10,7 @@
 """
 from config.settings import RERANK_TOPK
 from retriever import RetrieverPipeline
+from utils import instrument
 
 VECTOR_DB_PATH = "data/vector_db/index.faiss"
 
@@ -21,8 +22,17 @@ def main():
     query = "我想要知道特殊教育法修正日期"
 
     print(f"\n=== 查詢：{query} ===")
-    results = pipeline.retrieve(query, top_k=RERANK_TOPK,use_rerank=True)
-    # results = pipeline.retrieve(query, top_k=RERANK_TOPK,use_rerank=False)
+    with instrument.collect() as events:
+        results = pipeline.retrieve(query, top_k=RERANK_TOPK,use_rerank=True)
+        # results = pipeline.retrieve(query, top_k=RERANK_TOPK,use_rerank=False)
+
+    print("\n=== 各階段耗時 ===")
+    for e in events:
+        if e["type"] == "span":
+            indent = "  " if e["parent"] else ""
+            print(f"{indent}{e['name']:<22}{e['duration_ms']:>9.1f} ms  {e['attrs']}")
+        else:
+            print(f"{e['name']:<24}{e['value']:>9g}")
 
     if not results:
         print("找不到相關文件。")
@@ -0,0 +1,142 @@
+# tools/check_backend.py
+"""
+推論 backend 比對工具：
+同一批文字 / (query, 文件) 分別用 PyTorch、ONNX float32、ONNX int8 跑 FileEmbedder 與 Reranker，
+報告與 PyTorch 輸出的一致性與吞吐量，一致性低於門檻時 exit code 為 1（可放進 CI / 換模型後檢查）。
+
+- embedding：每筆向量與 PyTorch 結果的 cosine（最小值 / 平均）
+- reranker：分數最大誤差、各 query 候選排序的 top-1 一致率與 top-k 重疊率
+- 吞吐量：texts/s、pairs/s（先各跑一次暖機，不含匯出 / 載入時間）
+
+用法：
+    python -m tools.check_backend
+    python -m tools.check_backend --tiny                 # 用迷你隨機模型（不需下載），只檢查流程與一致性
+    python -m tools.check_backend --backends onnx --min-cosine 0.999
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from config.settings import RERANK_TOPK
+from benchmarks.synthetic import make_corpus, make_queries, make_tiny_models
+
+
+def _timed(fn):
+    fn()    # 暖機
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+
+def check_embedder(model_name: str, variants, texts):
+    from retriever.file_embedding import FileEmbedder
+
+    rows, ref = [], None
+    for name, backend, quantize in variants:
+        embedder = FileEmbedder(model_name, backend=backend, quantize=quantize)
+        vecs, sec = _timed(lambda: embedder.encode(texts))
+        if ref is None:
+            ref = vecs
+        cos = np.sum(_unit(vecs) * _unit(ref), axis=1)
+        rows.append({"variant": name, "texts_per_s": len(texts) / sec,
+                     "min_cosine": float(cos.min()), "mean_cosine": float(cos.mean())})
+    return rows
+
+
+def check_reranker(model_name: str, variants, queries, candidates, top_k: int):
+    from retriever.reranker import Reranker
+
+    pairs_q = [q for q, docs in zip(queries, candidates) for _ in docs]
+    pairs_d = [d for docs in candidates for d in docs]
+    rows, ref = [], None
+    for name, backend, quantize in variants:
+        reranker = Reranker(model_name, backend=backend, quantize=quantize)
+        reranker.cache = None       # 比的是模型本身，不能命中快取
+        scores, sec = _timed(lambda: np.asarray(reranker.score_pairs(pairs_q, pairs_d)))
+        if ref is None:
+            ref = scores
+
+        top1, overlap, start = 0, 0.0, 0
+        for docs in candidates:
+            s, r = scores[start:start + len(docs)], ref[start:start + len(docs)]
+            start += len(docs)
+            k = min(top_k, len(docs))
+            top1 += int(np.argmax(s) == np.argmax(r))
+            overlap += len(set(np.argsort(-s)[:k]) & set(np.argsort(-r)[:k])) / k
+        rows.append({"variant": name, "pairs_per_s": len(pairs_d) / sec,
+                     "max_abs_diff": float(np.abs(scores - ref).max()),
+                     "top1_agree": top1 / len(candidates),
+                     f"top{top_k}_overlap": overlap / len(candidates)})
+    return rows
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def _print(title, rows):
+    print(f"\n=== {title} ===")
+    keys = list(rows[0].keys())
+    print("".join(f"{k:>16}" for k in keys))
+    for row in rows:
+        print("".join(f"{v:>16.4f}" if isinstance(v, float) else f"{v:>16}" for v in row.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embedder", help="embedding 模型（預設同 FileEmbedder）")
+    parser.add_argument("--reranker", help="reranker 模型（預設同 Reranker）")
+    parser.add_argument("--tiny", action="store_true", help="改用 benchmarks 的迷你隨機模型")
+    parser.add_argument("--model-dir", default="data/bench_models")
+    parser.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"],
+                        choices=["onnx", "onnx-int8"], help="與 PyTorch 比對的 backend")
+    parser.add_argument("--texts", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=8)
+    parser.add_argument("--candidates", type=int, default=16, help="每個 query 的候選數")
+    parser.add_argument("--top-k", type=int, default=RERANK_TOPK)
+    parser.add_argument("--min-cosine", type=float, default=0.99,
+                        help="embedding 與 PyTorch 的最小 cosine 門檻（int8 一般在 0.99 上下）")
+    parser.add_argument("--min-top1", type=float, default=0.8,
+                        help="reranker top-1 與 PyTorch 一致的比例門檻")
+    parser.add_argument("--skip-reranker", action="store_true")
+    args = parser.parse_args()
+
+    from retriever.file_embedding import EMBEDDING_MODEL_NAME
+    from retriever.reranker import RERANKER_MODEL_NAME
+
+    embedder_name, reranker_name = args.embedder or EMBEDDING_MODEL_NAME, args.reranker or RERANKER_MODEL_NAME
+    if args.tiny:
+        paths = make_tiny_models(args.model_dir)
+        embedder_name, reranker_name = paths["embedder"], paths["reranker"]
+
+    variants = [("torch", "torch", False)] + [
+        (b, "onnx", b == "onnx-int8") for b in args.backends]
+
+    docs = make_corpus(max(args.texts, args.queries), articles_per_doc=2)
+    texts = [d["text"] for d in docs[:args.texts]]
+    queries = [q["query"] for q in make_queries(docs, args.queries)]
+    rng = np.random.default_rng(0)
+    candidates = [[texts[i] for i in rng.choice(len(texts), min(args.candidates, len(texts)), replace=False)]
+                  for _ in queries]
+
+    failed = []
+    emb_rows = check_embedder(embedder_name, variants, texts)
+    _print(f"Embedding（{embedder_name}，{len(texts)} 筆）", emb_rows)
+    failed += [r["variant"] for r in emb_rows if r["min_cosine"] < args.min_cosine]
+
+    if not args.skip_reranker:
+        rr_rows = check_reranker(reranker_name, variants, queries, candidates, args.top_k)
+        _print(f"Reranker（{reranker_name}，{len(queries)} query × {len(candidates[0])} 候選）", rr_rows)
+        failed += [f"{r['variant']} (reranker)" for r in rr_rows if r["top1_agree"] < args.min_top1]
+
+    if failed:
+        print(f"\n⚠️  與 PyTorch 輸出差異超過門檻：{', '.join(failed)}")
+        sys.exit(1)
+    print("\n✅ 各 backend 與 PyTorch 輸出一致")
+
+
+if __name__ == "__main__":
+    main()
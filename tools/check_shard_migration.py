@@ -0,0 +1,137 @@
+# tools/check_shard_migration.py
+"""
+未分片 → 分片 vector DB 搬移的中斷檢查：
+在暫存資料夾建立一個未分片的 VectorStore，另開一個 process 以 ShardedVectorStore 開啟（觸發搬移），
+並在指定時間點直接結束 process（os._exit，不跑任何清理），再重新開啟，檢查
+
+- 筆數與搜尋結果與搬移前相同
+- shards.json 已建立、舊的 meta.json 已刪除
+
+中斷點：
+    add     搬完第一批、尚未 commit
+    commit  各 shard 已 commit、shards.json 已寫、尚未刪除舊檔
+另外檢查只有 metadata、沒有向量的舊 DB 會直接報錯（ValueError），不會先清空 shard。
+任何一項失敗時 exit code 為 1。
+
+用法：
+    python -m tools.check_shard_migration
+    python -m tools.check_shard_migration --rows 5000 --shards 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from retriever import sharded_store
+from retriever.sharded_store import ShardedVectorStore
+from retriever.vector_store import VectorStore
+
+KILL_POINTS = ("add", "commit")
+
+
+def _make_legacy(index_path: str, rows: int, dim: int = 16):
+    rng = np.random.default_rng(0)
+    vecs = rng.standard_normal((rows, dim)).astype("float32")
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    metas = [{"id": f"doc{i % 37}_chunk{i}", "source": f"doc{i % 37}", "text": f"chunk {i}"}
+             for i in range(rows)]
+    store = VectorStore(index_path)
+    store.add_embeddings(vecs, metas)
+    store.commit(compact=True)
+    return vecs, [[m["id"] for _, m in q] for q in store.search(vecs[:20], 5)]
+
+
+def _migrate_and_die(index_path: str, num_shards: int, kill_at: str):
+    """
+    子 process：開啟分片 store 觸發搬移，在 kill_at 直接結束
+    """
+    if kill_at == "add":
+        add = ShardedVectorStore.add_embeddings
+        calls = []
+
+        def add_then_die(self, embeddings, metadatas):
+            calls.append(len(metadatas))
+            if len(calls) > 1:
+                self.flush()
+                os._exit(1)
+            return add(self, embeddings, metadatas)
+
+        ShardedVectorStore.add_embeddings = add_then_die
+    else:
+        sharded_store.drop_unsharded = lambda index_path: os._exit(1)
+    ShardedVectorStore(index_path, num_shards=num_shards)
+    os._exit(0)     # 沒走到中斷點（資料太少），視為失敗
+
+
+def check_kill(folder: str, rows: int, num_shards: int, kill_at: str) -> list:
+    index_path = os.path.join(folder, kill_at, "index.faiss")
+    os.makedirs(os.path.dirname(index_path))
+    vecs, expected = _make_legacy(index_path, rows)
+
+    proc = multiprocessing.get_context("spawn").Process(
+        target=_migrate_and_die, args=(index_path, num_shards, kill_at))
+    proc.start()
+    proc.join()
+
+    errors = []
+    if proc.exitcode != 1:
+        errors.append(f"[{kill_at}] 子 process 沒有在中斷點結束（exit code {proc.exitcode}）")
+    if not os.path.exists(index_path + ".meta.json"):
+        errors.append(f"[{kill_at}] 中斷後舊的 meta.json 不見了")
+
+    store = ShardedVectorStore(index_path, num_shards=num_shards)
+    got = [[m["id"] for _, m in q] for q in store.search(vecs[:20], 5)]
+    if len(store) != rows:
+        errors.append(f"[{kill_at}] 重新開啟後有 {len(store)} 筆，應為 {rows}")
+    if got != expected:
+        errors.append(f"[{kill_at}] 搜尋結果與搬移前不同")
+    if not os.path.exists(index_path + ".shards.json"):
+        errors.append(f"[{kill_at}] 沒有建立 shards.json")
+    if os.path.exists(index_path + ".meta.json"):
+        errors.append(f"[{kill_at}] 搬移完成後舊的 meta.json 沒有刪除")
+    return errors
+
+
+def check_metadata_only(folder: str, num_shards: int) -> list:
+    index_path = os.path.join(folder, "meta_only", "index.faiss")
+    os.makedirs(os.path.dirname(index_path))
+    with open(index_path + ".meta.json", "w", encoding="utf-8") as f:
+        json.dump([{"id": "a_chunk0", "text": "", "abstract": ""}], f)
+
+    try:
+        ShardedVectorStore(index_path, num_shards=num_shards)
+    except ValueError:
+        pass
+    else:
+        return ["[meta_only] 沒有向量的舊 DB 沒有報錯"]
+    if os.path.exists(index_path + ".shards.json"):
+        return ["[meta_only] 報錯前已寫入 shards.json"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=3000, help="舊 DB 的向量數（需大於一批 VECTOR_STORE_FLUSH_ROWS）")
+    parser.add_argument("--shards", type=int, default=3)
+    args = parser.parse_args()
+
+    errors = []
+    with tempfile.TemporaryDirectory() as folder:
+        for kill_at in KILL_POINTS:
+            errors += check_kill(folder, args.rows, args.shards, kill_at)
+        errors += check_metadata_only(folder, args.shards)
+
+    if errors:
+        for line in errors:
+            print(f"❌ {line}")
+        sys.exit(1)
+    print(f"✅ 搬移中斷（{', '.join(KILL_POINTS)}）後重新開啟皆完整，只有 metadata 的舊 DB 會報錯")
+
+
+if __name__ == "__main__":
+    main()
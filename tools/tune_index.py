@@ -0,0 +1,110 @@
+# tools/tune_index.py
+"""
+ANN index 調參工具：
+以目前 vector DB 的向量為資料，對 flat（精確解）比較各種 index 設定的
+recall@SEARCH_TOPK 與單筆查詢 p50 / p99 延遲，方便依數據選 VECTOR_INDEX_TYPE / nprobe / efSearch。
+
+用法：
+    python -m tools.tune_index --index data/vector_db/index.faiss
+    python -m tools.tune_index --queries queries.txt --types ivf_flat hnsw --nprobe 8 16 32
+"""
+
+import argparse
+import time
+
+import numpy as np
+import faiss
+
+from config.settings import SEARCH_TOPK
+from retriever.vector_store import VectorStore, build_index, train_sample, search_params
+
+
+def load_queries(args, store: VectorStore, base: np.ndarray) -> np.ndarray:
+    if args.queries:
+        from retriever.file_embedding import FileEmbedder
+        with open(args.queries, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return FileEmbedder().encode(texts).astype("float32")
+
+    # 沒給 query 檔：從庫內向量取樣並加一點雜訊當 query
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(base), min(args.num_queries, len(base)), replace=False)
+    q = base[picks] + rng.normal(scale=0.01, size=(len(picks), base.shape[1])).astype("float32")
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def measure(index: faiss.Index, queries: np.ndarray, top_k: int, params=None):
+    """
+    逐筆查詢（模擬線上單 query 的延遲），回傳 (labels, latencies_ms)
+    """
+    labels = np.empty((len(queries), top_k), dtype="int64")
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        _, labels[i:i + 1] = index.search(queries[i:i + 1], top_k, params=params)
+        latencies[i] = (time.perf_counter() - t0) * 1000
+    return labels, latencies
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f >= 0]) & set(t[t >= 0])) for f, t in zip(found, truth))
+    return hits / max(1, int((truth >= 0).sum()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", default="data/vector_db/index.faiss")
+    parser.add_argument("--queries", help="每行一個 query 的文字檔（會用 FileEmbedder 編碼）")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=SEARCH_TOPK)
+    parser.add_argument("--types", nargs="+", default=["ivf_flat", "hnsw", "ivf_pq"])
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", nargs="+", type=int, default=[16, 64, 128, 256])
+    args = parser.parse_args()
+
+    store = VectorStore(args.index)
+    if len(store) == 0:
+        print("vector DB 是空的，請先執行 preprocess_data.py")
+        return
+
+    ids = np.asarray(list(store.metadatas.keys()), dtype="int64")
+    base = store.get_vectors(ids)
+    queries = load_queries(args, store, base)
+    top_k = min(args.top_k, len(base))
+    print(f"資料 {len(base)} 筆 × {base.shape[1]} 維，query {len(queries)} 筆，k={top_k}\n")
+
+    exact = build_index("flat", base.shape[1])
+    exact.add_with_ids(base, ids)
+    truth, lat = measure(exact, queries, top_k)
+
+    print(f"{'index':<10}{'param':<14}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'build s':>10}")
+    print(f"{'flat':<10}{'-':<14}{1.0:>10.4f}{np.percentile(lat, 50):>10.3f}"
+          f"{np.percentile(lat, 99):>10.3f}{'-':>10}")
+
+    for index_type in args.types:
+        sample = train_sample(base)
+        t0 = time.perf_counter()
+        try:
+            index = build_index(index_type, base.shape[1], num_train=len(sample))
+        except ValueError as e:
+            print(f"{index_type:<10}跳過：{e}")
+            continue
+        if not index.is_trained:
+            index.train(sample)
+        index.add_with_ids(base, ids)
+        build_s = time.perf_counter() - t0
+
+        if index_type == "hnsw":
+            grid = [("efSearch", v, search_params(index, ef_search=v)) for v in args.ef_search]
+        else:
+            grid = [("nprobe", v, search_params(index, nprobe=v))
+                    for v in args.nprobe if v <= index.nlist]
+
+        for name, value, params in grid:
+            found, lat = measure(index, queries, top_k, params=params)
+            print(f"{index_type:<10}{f'{name}={value}':<14}{recall_at_k(found, truth):>10.4f}"
+                  f"{np.percentile(lat, 50):>10.3f}{np.percentile(lat, 99):>10.3f}{build_s:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# tools/tune_storage.py
+"""
+向量壓縮評估工具：
+以目前 vector DB 的向量為資料，比較各種 VECTOR_STORAGE / VECTOR_SEARCH_DIM 組合
+相對 float32 flat（精確解）的 index 記憶體、recall@SEARCH_TOPK 與單筆查詢延遲。
+
+壓縮的 index 走 VectorStore 實際的搜尋路徑（第一輪壓縮 code → float32 原向量重新打分），
+float32 原向量放在磁碟上 memmap，不算進常駐記憶體。
+
+用法：
+    python -m tools.tune_storage --index data/vector_db/index.faiss
+    python -m tools.tune_storage --storages fp16 int8 binary --dims 1024 512 256 --rescore 2 4 8
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import faiss
+
+from config.settings import SEARCH_TOPK
+from retriever.vector_store import VectorStore
+from tools.tune_index import load_queries, recall_at_k
+
+
+def index_bytes(index) -> int:
+    if isinstance(index, faiss.IndexBinary):
+        return faiss.serialize_index_binary(index).nbytes
+    return faiss.serialize_index(index).nbytes
+
+
+def run_store(store: VectorStore, queries: np.ndarray, top_k: int):
+    """
+    回傳 (vector id 矩陣, 單筆查詢延遲 ms)；metadata 裡的 "vid" 即 vector id
+    """
+    found = np.full((len(queries), top_k), -1, dtype="int64")
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        res = store.search(queries[i:i + 1], top_k=top_k)[0]
+        latencies[i] = (time.perf_counter() - t0) * 1000
+        found[i, :len(res)] = [meta["vid"] for _, meta in res]
+    return found, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", default="data/vector_db/index.faiss")
+    parser.add_argument("--queries", help="每行一個 query 的文字檔（會用 FileEmbedder 編碼）")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=SEARCH_TOPK)
+    parser.add_argument("--storages", nargs="+", default=["fp16", "int8", "binary"])
+    parser.add_argument("--dims", nargs="+", type=int, default=[],
+                        help="Matryoshka 截斷維度（另外一定會測完整維度）")
+    parser.add_argument("--rescore", nargs="+", type=int, default=[4])
+    args = parser.parse_args()
+
+    source = VectorStore(args.index)
+    if len(source) == 0:
+        print("vector DB 是空的，請先執行 preprocess_data.py")
+        return
+
+    ids = np.asarray(list(source.metadatas.keys()), dtype="int64")
+    base = source.get_vectors(ids)
+    queries = load_queries(args, source, base)
+    top_k = min(args.top_k, len(base))
+    full_dim = base.shape[1]
+    metas = [{"vid": int(i)} for i in ids]
+    print(f"資料 {len(base)} 筆 × {full_dim} 維，query {len(queries)} 筆，k={top_k}\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def build(storage, dim, rescore):
+            path = os.path.join(tmp, f"{storage}_{dim}_{rescore}.faiss")
+            store = VectorStore(path, index_type="flat", storage=storage,
+                                search_dim=None if dim == full_dim else dim,
+                                rescore_factor=rescore)
+            store.add_embeddings(base, metas)
+            return store
+
+        exact = build("float32", full_dim, 1)
+        truth, lat = run_store(exact, queries, top_k)
+        flat_bytes = index_bytes(exact.index)
+
+        print(f"{'storage':<10}{'dim':>6}{'rescore':>9}{'index MB':>10}{'saved':>8}"
+              f"{'recall@k':>10}{'p50 ms':>9}{'p99 ms':>9}")
+        print(f"{'float32':<10}{full_dim:>6}{'-':>9}{flat_bytes / 2**20:>10.2f}{'-':>8}"
+              f"{1.0:>10.4f}{np.percentile(lat, 50):>9.3f}{np.percentile(lat, 99):>9.3f}")
+
+        for storage in args.storages:
+            for dim in [full_dim] + [d for d in args.dims if d < full_dim]:
+                for rescore in args.rescore:
+                    try:
+                        store = build(storage, dim, rescore)
+                    except ValueError as e:
+                        print(f"{storage:<10}{dim:>6} 跳過：{e}")
+                        continue
+                    found, lat = run_store(store, queries, top_k)
+                    size = index_bytes(store.index)
+                    print(f"{storage:<10}{dim:>6}{rescore:>9}{size / 2**20:>10.2f}"
+                          f"{1 - size / flat_bytes:>8.1%}{recall_at_k(found, truth):>10.4f}"
+                          f"{np.percentile(lat, 50):>9.3f}{np.percentile(lat, 99):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
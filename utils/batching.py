@@ -0,0 +1,34 @@
+# utils/batching.py
+
+from typing import List, Optional
+
+
+def token_budget_batches(lengths: List[int],
+                         max_tokens: int,
+                         max_batch_size: Optional[int] = None) -> List[List[int]]:
+    """
+    依長度排序後切 batch，每個 batch 的「padding 後 token 數」
+    （batch 大小 × 最長序列）不超過 max_tokens。
+    回傳每個 batch 對應的原始 index，呼叫端再依 index 把結果放回原順序。
+
+    長度相近的放在同一 batch，padding 浪費最少；最長的先跑，OOM 會在一開始就出現。
+    單一序列超過 max_tokens 時自己一個 batch。
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+
+    batches = []
+    current: List[int] = []
+    longest = 0
+    for i in order:
+        longest_if_added = max(longest, lengths[i])
+        too_big = longest_if_added * (len(current) + 1) > max_tokens
+        too_many = max_batch_size is not None and len(current) >= max_batch_size
+        if current and (too_big or too_many):
+            batches.append(current)
+            current, longest_if_added = [], lengths[i]
+        current.append(i)
+        longest = longest_if_added
+
+    if current:
+        batches.append(current)
+    return batches
@@ -3,32 +3,115 @@
 from typing import List
 from .preprocess import split_into_sentences
 
-from config.settings import CHUNK_MAX_TOKENS
+from config.settings import CHUNK_MAX_TOKENS, CHUNK_TOKEN_BUDGET, CHUNK_OVERLAP_TOKENS
 
 def chunk_by_sentences(text: str, max_tokens: int = CHUNK_MAX_TOKENS):
 
     """
-    將長文件切成多段 chunk，每段 ~300 tokens（可自行調整）
+    將長文件切成多段 chunk，每段不超過 max_tokens 個字元
     使用句子累積，避免切斷語意。
     """
     sentences = split_into_sentences(text)
 
     chunks = []
-    current = ""
+    current: List[str] = []
+    current_len = 0     # 以空白串接後的字元數
 
     for sent in sentences:
-        if len(current) + len(sent) > max_tokens:
-            chunks.append(current.strip())
-            current = sent
+        if current and current_len + 1 + len(sent) > max_tokens:
+            chunks.append(" ".join(current))
+            current = [sent]
+            current_len = len(sent)
         else:
-            current += " " + sent
+            current_len += len(sent) + (1 if current else 0)
+            current.append(sent)
 
-    if current.strip():
-        chunks.append(current.strip())
+    if current:
+        chunks.append(" ".join(current))
 
     return chunks
 
 
+def _split_long_sentence(sent: str, tokenizer, max_tokens: int) -> List[str]:
+    """
+    單句就超過 token 上限：依 tokenizer 的 offset 每 max_tokens 個 token 切一段，
+    沒有 offset（非 fast tokenizer）時退回依比例切字元
+    """
+    try:
+        enc = tokenizer(sent, add_special_tokens=False, return_offsets_mapping=True)
+        offsets = enc["offset_mapping"]
+    except (NotImplementedError, KeyError, TypeError):
+        offsets = None
+
+    if offsets:
+        pieces = []
+        for i in range(0, len(offsets), max_tokens):
+            window = offsets[i:i + max_tokens]
+            pieces.append(sent[window[0][0]:window[-1][1]])
+        return [p.strip() for p in pieces if p.strip()]
+
+    n_tokens = len(tokenizer(sent, add_special_tokens=False)["input_ids"])
+    step = max(1, len(sent) * max_tokens // max(n_tokens, 1))
+    return [sent[i:i + step] for i in range(0, len(sent), step)]
+
+
+def chunk_by_tokens(text: str,
+                    tokenizer,
+                    max_tokens: int = CHUNK_TOKEN_BUDGET,
+                    overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """
+    以 embedding tokenizer 的真實 token 數切 chunk：
+    - 所有句子一次 batch tokenize 取得長度（不逐句呼叫）
+    - 依序把句子裝進 chunk，直到加入下一句會超過 max_tokens
+      （預留模型自動加的 special tokens 與句子間空白）
+    - overlap_tokens > 0 時，新 chunk 會帶上前一個 chunk 結尾、總長不超過 overlap_tokens 的句子
+    - 單句超過上限時依 token 邊界再切開
+    整體為線性時間，適用數 MB 的長文件。
+    """
+    sentences = split_into_sentences(text)
+    if not sentences:
+        return []
+
+    budget = max_tokens - tokenizer.num_special_tokens_to_add()
+    sep = len(tokenizer(" ", add_special_tokens=False)["input_ids"])
+
+    lengths = [len(ids) for ids in tokenizer(sentences, add_special_tokens=False)["input_ids"]]
+
+    # 過長的句子先切開
+    pieces, piece_lens = [], []
+    for sent, n in zip(sentences, lengths):
+        if n <= budget:
+            pieces.append(sent)
+            piece_lens.append(n)
+            continue
+        parts = _split_long_sentence(sent, tokenizer, budget)
+        pieces.extend(parts)
+        piece_lens.extend(len(ids) for ids in tokenizer(parts, add_special_tokens=False)["input_ids"])
+
+    chunks = []
+    start = 0           # 目前 chunk 的第一個片段
+    used = 0            # 目前 chunk 的 token 數（含分隔）
+    for i, n in enumerate(piece_lens):
+        extra = n + (sep if i > start else 0)
+        if i > start and used + extra > budget:
+            chunks.append(" ".join(pieces[start:i]))
+
+            # 往回找可重疊的句子
+            new_start, carried = i, 0
+            while (new_start - 1 > start
+                   and carried + piece_lens[new_start - 1] + sep <= overlap_tokens
+                   and carried + piece_lens[new_start - 1] + sep + n <= budget):
+                new_start -= 1
+                carried += piece_lens[new_start] + sep
+
+            start, used = new_start, carried + n
+        else:
+            used += extra
+
+    chunks.append(" ".join(pieces[start:]))
+    return chunks
+
+
 def chunk_fixed(text: str, size: int = 512) -> List[str]:
     """
     固定字元 chunk（保留給不想用句子拆的場景）
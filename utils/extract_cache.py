@@ -0,0 +1,63 @@
+# utils/extract_cache.py
+"""
+文件抽取結果快取：
+- index.json 記錄 {檔案路徑: {size, mtime, sha256}}
+- texts/<sha256>.txt 存抽取出的全文
+
+size + mtime 都沒變 → 直接讀快取（不用算 hash）；
+有變 → 算內容 sha256，內容其實沒變（例如只是 touch / 複製）仍可命中。
+"""
+
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+from .hashing import file_sha256
+
+
+class ExtractCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.text_dir = os.path.join(cache_dir, "texts")
+        os.makedirs(self.text_dir, exist_ok=True)
+
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def _text_path(self, sha: str) -> str:
+        return os.path.join(self.text_dir, sha + ".txt")
+
+    def lookup(self, path: str) -> Tuple[Optional[str], str]:
+        """
+        回傳 (快取的全文 or None, 檔案 sha256)；sha256 留給 miss 時 store() 用
+        """
+        key = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self.entries.get(key)
+
+        if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            sha = entry["sha256"]
+        else:
+            sha = file_sha256(path)
+            self.entries[key] = {"size": st.st_size, "mtime": st.st_mtime, "sha256": sha}
+
+        text_path = self._text_path(sha)
+        if not os.path.exists(text_path):
+            return None, sha
+        with open(text_path, "r", encoding="utf-8") as f:
+            return f.read(), sha
+
+    def store(self, sha: str, text: str):
+        tmp = self._text_path(sha) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self._text_path(sha))
+
+    def save(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
@@ -0,0 +1,21 @@
+# utils/hashing.py
+
+import hashlib
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """
+    計算檔案內容的 sha256（分塊讀取，避免大檔一次載入記憶體）
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """
+    chunk 內容的 hash，用來判斷 chunk 是否變動 / 作為快取 key
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
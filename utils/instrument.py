@@ -0,0 +1,295 @@
+# utils/instrument.py
+"""
+輕量 instrumentation（計時 / 計數 / hook）：
+
+    from utils import instrument
+
+    with instrument.span("embed.forward", batch=len(batch)) as sp:
+        ...
+        sp.set(tokens=n)
+    instrument.count("rerank_cache.hit", hits)
+
+span / count 產生的事件（dict）會送給所有註冊的 hook：
+    {"type": "span",  "name", "duration_ms", "parent", "attrs", "error", "peak_rss_mb"}
+    {"type": "count", "name", "value", "attrs"}
+
+沒有註冊任何 hook 時 span() 直接回傳共用的 no-op 物件、count() 直接 return，
+關閉狀態下的成本只有一次 list 判斷。
+
+內建 hook：
+- LogHook：每個事件寫一行 JSON log（structured logging）
+- MetricsRegistry：累積成 Prometheus text format，可掛在 API 的 /metrics 或用 serve_metrics() 開獨立 port
+- collect()：暫時收集事件到 list（除錯 / benchmark 用）
+"""
+
+from typing import Callable, Dict, List, Optional
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import logging
+import re
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:      # Windows
+    resource = None
+
+Hook = Callable[[Dict], None]
+
+_hooks: List[Hook] = []
+_hooks_lock = threading.Lock()
+_local = threading.local()
+
+
+def add_hook(hook: Hook) -> Hook:
+    with _hooks_lock:
+        if hook not in _hooks:
+            _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook: Hook):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def enabled() -> bool:
+    return bool(_hooks)
+
+
+def _emit(event: Dict):
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as e:  # hook 出錯不能影響查詢本身
+            print(f"⚠️  instrumentation hook 發生錯誤：{e!r}", file=sys.stderr)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    process 到目前為止的最高常駐記憶體（MB）；有用 CUDA 時另外看 torch 的 max_memory_allocated
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def _peak_cuda_mb() -> Optional[float]:
+    torch = sys.modules.get("torch")     # 沒載入 torch 就不要為了量記憶體去 import
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.max_memory_allocated() / 2 ** 20
+
+
+# ---------- span ----------
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "parent", "_start")
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self.parent = None
+        self._start = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        _local.stack.pop()
+        event = {
+            "type": "span",
+            "name": self.name,
+            "duration_ms": duration_ms,
+            "parent": self.parent,
+            "attrs": self.attrs,
+            "error": exc_type.__name__ if exc_type else None,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        cuda = _peak_cuda_mb()
+        if cuda is not None:
+            event["peak_cuda_mb"] = cuda
+        _emit(event)
+        return False
+
+
+def span(name: str, **attrs):
+    """
+    量測一段程式的耗時；可巢狀（事件會帶上 parent span 名稱）
+    """
+    if not _hooks:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def count(name: str, value: float = 1, **attrs):
+    """
+    計數事件，例如候選數、cache hit / miss
+    """
+    if not _hooks:
+        return
+    _emit({"type": "count", "name": name, "value": value, "attrs": attrs})
+
+
+@contextmanager
+def collect():
+    """
+    暫時把事件收集到 list：
+        with instrument.collect() as events:
+            pipeline.retrieve(...)
+    """
+    events: List[Dict] = []
+    add_hook(events.append)
+    try:
+        yield events
+    finally:
+        remove_hook(events.append)
+
+
+# ==========================================================
+# 內建 hook
+# ==========================================================
+class LogHook:
+    """
+    每個事件寫一行 JSON 到 logging（logger 預設 "rag.trace"）
+    """
+
+    def __init__(self, logger: logging.Logger | None = None, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger("rag.trace")
+        self.level = level
+
+    def __call__(self, event: Dict):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json.dumps(event, ensure_ascii=False, default=str))
+
+
+_METRIC_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+# span 耗時的 histogram 分桶（秒）
+_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsRegistry:
+    """
+    把事件累積成 Prometheus 指標：
+    - span → rag_span_seconds{name="..."} histogram
+    - count → rag_<name>_total counter
+    - 最高常駐記憶體 → rag_peak_rss_bytes gauge
+    """
+
+    def __init__(self, prefix: str = "rag"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[int]] = defaultdict(lambda: [0] * len(_BUCKETS))
+        self._sum: Dict[str, float] = defaultdict(float)
+        self._count: Dict[str, int] = defaultdict(int)
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._peak_rss_mb = 0.0
+
+    def __call__(self, event: Dict):
+        with self._lock:
+            if event["type"] == "span":
+                name, sec = event["name"], event["duration_ms"] / 1000
+                self._sum[name] += sec
+                self._count[name] += 1
+                buckets = self._buckets[name]
+                for i, bound in enumerate(_BUCKETS):
+                    if sec <= bound:
+                        buckets[i] += 1
+                if event.get("peak_rss_mb"):
+                    self._peak_rss_mb = max(self._peak_rss_mb, event["peak_rss_mb"])
+            elif event["type"] == "count":
+                self._counters[event["name"]] += event["value"]
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format
+        """
+        p = self.prefix
+        lines = [f"# TYPE {p}_span_seconds histogram"]
+        with self._lock:
+            for name in sorted(self._count):
+                label = f'name="{name}"'
+                for bound, n in zip(_BUCKETS, self._buckets[name]):
+                    lines.append(f'{p}_span_seconds_bucket{{{label},le="{bound}"}} {n}')
+                lines.append(f'{p}_span_seconds_bucket{{{label},le="+Inf"}} {self._count[name]}')
+                lines.append(f"{p}_span_seconds_sum{{{label}}} {self._sum[name]:.6f}")
+                lines.append(f"{p}_span_seconds_count{{{label}}} {self._count[name]}")
+
+            for name in sorted(self._counters):
+                metric = f"{p}_{_METRIC_NAME_RE.sub('_', name)}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {self._counters[name]:g}")
+
+            lines.append(f"# TYPE {p}_peak_rss_bytes gauge")
+            lines.append(f"{p}_peak_rss_bytes {int(self._peak_rss_mb * 2 ** 20)}")
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(registry: MetricsRegistry, port: int, host: str = "0.0.0.0"):
+    """
+    沒有 API server 的 process（例如 preprocess）用：背景 thread 提供 GET /metrics
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def setup_from_settings() -> Optional[MetricsRegistry]:
+    """
+    依 config/settings.py 註冊 hook：INSTRUMENT_LOG → LogHook，METRICS_ENABLED → MetricsRegistry（回傳）
+    """
+    from config.settings import INSTRUMENT_LOG, METRICS_ENABLED
+
+    if INSTRUMENT_LOG:
+        add_hook(LogHook())
+    if METRICS_ENABLED:
+        return add_hook(MetricsRegistry())
+    return None
@@ -1,7 +1,14 @@
 # utils/pdf_reader.py
 
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Optional
+
 import fitz  # PyMuPDF
 
+from config.settings import PDF_WORKERS, PDF_PAGES_PER_TASK
+
+
 def read_pdf(path: str) -> str:
     """
     將 PDF 每頁合併成一段文字
@@ -16,3 +23,46 @@ def read_pdf(path: str) -> str:
     doc.close()
     return "\n".join(texts)
 
+
+def page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def read_pdf_pages(path: str, start: int, end: int) -> List[str]:
+    """
+    抽取 [start, end) 頁的文字（給 process pool 的單位工作）
+    """
+    with fitz.open(path) as doc:
+        return [doc[i].get_text("text") for i in range(start, min(end, doc.page_count))]
+
+
+def read_pdfs(paths: List[str],
+              workers: Optional[int] = PDF_WORKERS,
+              pages_per_task: int = PDF_PAGES_PER_TASK,
+              executor: Optional[Executor] = None) -> Dict[str, str]:
+    """
+    平行抽取多個 PDF：每個 PDF 依頁數切成多段 task 丟進 process pool，
+    大檔不會卡住單一 worker。回傳 {path: 全文}，頁面順序與 read_pdf 相同。
+    executor：重複呼叫時（例如 streaming ingest 逐檔載入）可共用同一個 pool，省去每次開 process 的成本
+    """
+    tasks = []
+    for path in paths:
+        n = page_count(path)
+        for start in range(0, max(n, 1), pages_per_task):
+            tasks.append((path, start, start + pages_per_task))
+
+    workers = workers or os.cpu_count() or 1
+    if executor is not None and len(tasks) > 1:
+        parts = list(executor.map(read_pdf_pages, *zip(*tasks)))
+    elif workers <= 1 or len(tasks) <= 1:
+        parts = [read_pdf_pages(*t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            parts = list(pool.map(read_pdf_pages, *zip(*tasks)))
+
+    pages: Dict[str, List[str]] = {path: [] for path in paths}
+    for (path, _, _), texts in zip(tasks, parts):
+        pages[path].extend(texts)
+
+    return {path: "\n".join(texts) for path, texts in pages.items()}
@@ -4,7 +4,7 @@ import json
 import os
 
 def save_json(path: str, data):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
@@ -13,3 +13,50 @@ def load_json(path: str):
         return None
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
+
+
+class JsonlStore:
+    """
+    append-only 的 key → value 存檔（每行一筆 {"k": key, "v": value}）：
+    每次 put_many 只追加新資料並 fsync，程式中斷最多損失最後一行（載入時略過）。
+    同一 key 寫多次時以最後一筆為準。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = {}
+        self._torn_tail = False
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    self._torn_tail = f.read(1) != b"\n"
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue    # 寫到一半的最後一行
+                    self.data[row["k"]] = row["v"]
+
+    def __contains__(self, key) -> bool:
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def put_many(self, items):
+        items = list(items)
+        if not items:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self._torn_tail:
+                f.write("\n")      # 上次寫到一半的行自成一行，不要跟新資料黏在一起
+                self._torn_tail = False
+            for k, v in items:
+                f.write(json.dumps({"k": k, "v": v}, ensure_ascii=False) + "\n")
+                self.data[k] = v
+            f.flush()
+            os.fsync(f.fileno())